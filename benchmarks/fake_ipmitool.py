@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the ipmitool executable, replaying recorded iDRAC output.
+
+Answers the commands PiFan sends over lanplus from a corpus directory, with
+files named like the parse benchmark's corpus: sdr-type-fan.txt,
+sdr-type-temperature.txt, sdr-elist-full.txt and sdr-get-fans.txt.  Other
+commands get a canned response.
+
+Environment:
+    FAKE_IPMITOOL_CORPUS   corpus directory to replay, required
+    FAKE_IPMITOOL_LATENCY  seconds to wait before answering (default: 0)
+    FAKE_IPMITOOL_LOG      file to append each invocation's command to
+
+Usage: FAKE_IPMITOOL_CORPUS=benchmarks/corpus/idrac7-r720 \\
+    benchmarks/fake_ipmitool.py -I lanplus -H host -U root -P x sdr info
+"""
+
+import os
+import sys
+import time
+from typing import List
+
+# Options followed by a value, as PiFan and ipmitool use them.
+VALUE_OPTIONS = ('-I', '-H', '-U', '-P', '-p', '-S', '-N', '-R')
+
+SDR_INFO = '''SDR Version                         : 0x51
+Record Count                        : 96
+Free Space                          : unspecified
+Most recent Addition                : 01/01/1970 00:00:00
+Most recent Erase                   : 01/01/1970 00:00:00
+SDR overflow                        : no
+SDR Repository Update Support       : unspecified
+'''
+
+POWER_READING = '''
+    Instantaneous power reading:                   142 Watts
+    Minimum during sampling period:                 98 Watts
+    Maximum during sampling period:                310 Watts
+    Average power reading over sample period:      151 Watts
+    IPMI timestamp:                           Thu Jan  1 00:00:00 1970
+    Sampling period:                          00000001 Seconds.
+    Power reading state is:                   activated
+
+'''
+
+# Written by `sdr dump`; only read back through -S by the fake itself.
+SDR_DUMP = b'\x00' * 64
+
+
+def command_args(argv: List[str]) -> List[str]:
+    """
+    Command words after the connection options.
+    """
+    args = list(argv)
+    while args and args[0].startswith('-'):
+        option = args.pop(0)
+        if option in VALUE_OPTIONS and args:
+            args.pop(0)
+    return args
+
+
+def corpus_file(corpus: str, name: str) -> str:
+    """
+    Contents of a corpus file.
+    """
+    with open(os.path.join(corpus, name), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def respond(corpus: str, args: List[str]) -> str:
+    """
+    Output of a command.
+    Raise LookupError for commands the fake doesn't know.
+    """
+    if args[:2] == ['sdr', 'type'] and len(args) == 3:
+        return corpus_file(corpus, f'sdr-type-{args[2].lower()}.txt')
+    if args[:2] == ['sdr', 'elist']:
+        list_type = args[2] if len(args) > 2 else 'all'
+        return corpus_file(corpus, f'sdr-elist-{list_type}.txt')
+    if args[:2] == ['sdr', 'get']:
+        return corpus_file(corpus, 'sdr-get-fans.txt')
+    if args == ['sdr', 'info']:
+        return SDR_INFO
+    if args[:2] == ['sdr', 'dump'] and len(args) == 3:
+        with open(args[2], 'wb') as dump_file:
+            dump_file.write(SDR_DUMP)
+        return f'Dumping Sensor Data Repository to \'{args[2]}\'\n'
+    if args == ['dcmi', 'power', 'reading']:
+        return POWER_READING
+    if args[:1] == ['raw']:
+        return '\n'
+    raise LookupError(' '.join(args))
+
+
+def main() -> int:
+    """
+    Replay the response of one command.
+    """
+    corpus = os.environ.get('FAKE_IPMITOOL_CORPUS')
+    if corpus is None:
+        print('FAKE_IPMITOOL_CORPUS is not set', file=sys.stderr)
+        return 1
+
+    args = command_args(sys.argv[1:])
+    log_filename = os.environ.get('FAKE_IPMITOOL_LOG')
+    if log_filename:
+        with open(log_filename, 'a', encoding='utf-8') as log_file:
+            log_file.write(' '.join(args[:2]) + '\n')
+
+    latency = float(os.environ.get('FAKE_IPMITOOL_LATENCY', '0'))
+    if latency > 0:
+        time.sleep(latency)
+
+    try:
+        output = respond(corpus, args)
+    except (LookupError, FileNotFoundError):
+        print(f'Invalid command: {" ".join(args)}', file=sys.stderr)
+        return 1
+    sys.stdout.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
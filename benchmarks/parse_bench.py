@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Benchmark ipmitool output parsing against the corpus of iDRAC 7/8/9 output.
+
+Compares the streaming parsers in mylib.ipmitool_parser with the previous
+approach of buffering the output, splitting every line into a list and
+matching regexes per field.  Both must produce the same sensor values.
+
+Corpus files in corpus/<idrac>-<model>/ are named after the ipmitool
+command that produced them: sdr-type-*.txt, sdr-elist-*.txt and
+sdr-get-*.txt.
+
+Usage: PYTHONPATH=src python3 benchmarks/parse_bench.py [--repeat N]
+"""
+
+import argparse
+import functools
+import io
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+from mylib.ipmitool_parser import parse_sdr_get, parse_sdr_list
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'corpus')
+
+# Fields IpmiFan asks sdr get for.
+SDR_GET_FIELDS = frozenset(['Normal Maximum'])
+
+# (name, sensor id, value, normal maximum) of each parsed sensor.
+Result = List[Tuple[str, int, Optional[int], Optional[int]]]
+
+PAT_INTEGER = r'^(\d+)'
+PAT_NAME = r'^(.+) \((.+)\)'
+
+
+def legacy_sdr_list(text: str) -> Result:
+    """
+    Previous parser: parse_pdv() of the whole output, then a regex match of
+    each reading.
+    """
+    rows = []
+    for line in text.split('\n'):
+        row = []
+        for col in line.split('|'):
+            row.append(col.strip())
+        rows.append(row)
+
+    result: Result = []
+    for row in rows:
+        if len(row) < 5:
+            continue
+        match_integer = re.match(PAT_INTEGER, row[4])
+        value = int(match_integer.groups()[0]) if match_integer else None
+        result.append((row[0], int(row[1].rstrip('h'), 16), value, None))
+    return result
+
+
+def legacy_sdr_get(text: str) -> Result:
+    """
+    Previous parser: regexes compiled per call over every line, all fields
+    kept, then IpmiFan's regexes over the kept fields.
+    """
+    parsed: Dict[str, Dict[str, str]] = {}
+    header_re = re.compile(r'^\S.+:(.+)')
+    prop_re = re.compile(r'^ (.+):(.*)')
+    item: Dict[str, str] = {}
+    for line in text.split('\n'):
+        match_header = header_re.match(line)
+        if match_header is not None:
+            item = {}
+            parsed[match_header.groups()[0].strip()] = item
+            continue
+        match_prop = prop_re.match(line)
+        if match_prop is not None:
+            item[match_prop.groups()[0].strip()] = \
+                match_prop.groups()[1].strip()
+
+    result: Result = []
+    for key, fields in parsed.items():
+        match_name = re.match(PAT_NAME, key)
+        if match_name is None:
+            continue
+        name, sensor_id = match_name.groups()
+        values: List[Optional[int]] = []
+        for field in ('Sensor Reading', 'Normal Maximum'):
+            match_integer = re.match(PAT_INTEGER, fields.get(field, ''))
+            values.append(int(match_integer.groups()[0])
+                          if match_integer else None)
+        result.append((name, int(sensor_id, 16), values[0], values[1]))
+    return result
+
+
+def stream_sdr_list(text: str) -> Result:
+    """
+    Streaming parser, reading lines from a file object like the pipe.
+    """
+    return [(reading.name, reading.id,
+             int(reading.value) if reading.value is not None else None, None)
+            for reading in parse_sdr_list(io.StringIO(text))]
+
+
+def stream_sdr_get(text: str) -> Result:
+    """
+    Streaming parser, reading lines from a file object like the pipe.
+    """
+    result: Result = []
+    for reading in parse_sdr_get(io.StringIO(text), SDR_GET_FIELDS):
+        maximum = reading.field('Normal Maximum')
+        result.append((reading.name, reading.id,
+                       int(reading.value) if reading.value is not None
+                       else None,
+                       int(float(maximum)) if maximum is not None else None))
+    return result
+
+
+def measure_memory(parse: Callable[[str], Result], text: str) -> int:
+    """
+    Peak bytes allocated while parsing text.
+    """
+    tracemalloc.start()
+    try:
+        parse(text)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def load_corpus() -> List[Tuple[str, str]]:
+    """
+    Load corpus files as (name, text).
+    """
+    corpus = []
+    for host in sorted(os.listdir(CORPUS_PATH)):
+        host_path = os.path.join(CORPUS_PATH, host)
+        for filename in sorted(os.listdir(host_path)):
+            with open(os.path.join(host_path, filename), 'r',
+                      encoding='utf-8') as corpus_file:
+                corpus.append((f'{host}/{filename}', corpus_file.read()))
+    return corpus
+
+
+def main() -> int:
+    """
+    Run benchmark and print a table of results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, metavar='N', default=2000,
+                        help='Parses of each file per timing (default: 2000)')
+    args = parser.parse_args()
+
+    print(f'{"file":<36} {"parser":<7} {"lines/s":>10} {"MB/s":>7} '
+          f'{"peak KiB":>9}')
+    failed = False
+    for name, text in load_corpus():
+        if '/sdr-get-' in name:
+            parsers = (('legacy', legacy_sdr_get), ('stream', stream_sdr_get))
+        else:
+            parsers = (('legacy', legacy_sdr_list),
+                       ('stream', stream_sdr_list))
+
+        results = [parse(text) for _, parse in parsers]
+        if results[0] != results[1]:
+            print(f'{name}: parsers disagree:\n  {results[0]}\n  '
+                  f'{results[1]}', file=sys.stderr)
+            failed = True
+
+        lines = text.count('\n')
+        for parser_name, parse in parsers:
+            seconds = min(timeit.repeat(functools.partial(parse, text),
+                                        number=args.repeat, repeat=3))
+            rate = args.repeat / seconds
+            peak = measure_memory(parse, text)
+            print(f'{name:<36} {parser_name:<7} {lines * rate:>10.0f} '
+                  f'{len(text) * rate / 1e6:>7.1f} {peak / 1024:>9.1f}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Benchmark the poll path end to end against a stand-in ipmitool.
+
+fake_ipmitool.py replays the corpus of iDRAC 7/8/9 output, optionally after
+a delay standing in for iDRAC latency.  For each corpus host, measures:
+
+- PiFanController.poll wall time, of the discovery poll and of steady
+  polls, with requests sent one at a time and in parallel
+- ipmitool processes started per poll
+- parse time of parse_sdr_list and parse_sdr_get, and the time of a whole
+  Ipmitool.sdr_get call
+- save_state and load_state time
+
+and the benchmark's peak RSS.  Results are printed as JSON to compare
+releases.
+
+Usage: PYTHONPATH=src python3 benchmarks/poll_bench.py [--polls N]
+    [--latency SEC] [--output FILE]
+"""
+
+import argparse
+from datetime import datetime, timezone
+import functools
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Tuple
+from mylib import IpmiCpu, IpmiFan, PiFanController
+from mylib.ipmitool import Ipmitool
+from mylib.ipmitool_parser import parse_sdr_get, parse_sdr_list
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+
+CORPUS_PATH = os.path.join(BENCH_PATH, 'corpus')
+
+FAKE_IPMITOOL = os.path.join(BENCH_PATH, 'fake_ipmitool.py')
+
+# Concurrency of each measured poll mode.  Sequential polls read all
+# sensors with one `sdr elist`; parallel polls read fans in the background.
+POLL_MODES = {'sequential': 1, 'parallel': 2}
+
+# Fields IpmiFan asks sdr get for.
+SDR_GET_FIELDS = frozenset(['Normal Maximum'])
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    Summary statistics of samples.
+    """
+    ordered = sorted(values)
+    return {
+        'mean': statistics.mean(ordered),
+        'median': statistics.median(ordered),
+        'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+        'min': ordered[0],
+        'max': ordered[-1],
+    }
+
+
+def best_time(function: Callable[[], Any], number: int) -> float:
+    """
+    Seconds per call, best of 3 timings of number calls.
+    """
+    return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of this process in bytes.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def git_revision() -> str:
+    """
+    Revision of the working tree, if in a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], cwd=BENCH_PATH,
+            capture_output=True, encoding='utf-8', check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def install_fake_ipmitool(bin_dir: str) -> None:
+    """
+    Put an `ipmitool` running fake_ipmitool.py first on PATH.
+    """
+    filename = os.path.join(bin_dir, 'ipmitool')
+    with open(filename, 'w', encoding='utf-8') as script:
+        script.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_IPMITOOL}" '
+                     '"$@"\n')
+    os.chmod(filename, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+
+class ProcessLog:
+    """
+    Count ipmitool processes from the log the fake appends to.
+    """
+    filename: str
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        os.environ['FAKE_IPMITOOL_LOG'] = filename
+
+    def take(self) -> int:
+        """
+        Processes started since the last call.
+        """
+        if not os.path.exists(self.filename):
+            return 0
+        with open(self.filename, 'r', encoding='utf-8') as log_file:
+            count = sum(1 for _ in log_file)
+        os.unlink(self.filename)
+        return count
+
+
+def create_controller(name: str, state_path: str,
+                      concurrency: int) -> PiFanController:
+    """
+    Controller of a host answered by the fake ipmitool.
+    """
+    controller = PiFanController(name, IpmiFan(name, 'root', 'calvin'),
+                                 IpmiCpu(name, 'root', 'calvin'))
+    controller.state_path = state_path
+    controller.concurrency = concurrency
+    return controller
+
+
+def bench_polls(name: str, state_path: str, concurrency: int, polls: int,
+                processes: ProcessLog) -> Dict[str, Any]:
+    """
+    Time the discovery poll and steady polls of a new controller.
+    """
+    controller = create_controller(name, state_path, concurrency)
+    state = controller.load_state()
+    processes.take()
+
+    start = time.perf_counter()
+    controller.poll(state)
+    discovery = time.perf_counter() - start
+    discovery_processes = processes.take()
+
+    durations: List[float] = []
+    counts: List[float] = []
+    for _ in range(polls):
+        start = time.perf_counter()
+        controller.poll(state)
+        durations.append(time.perf_counter() - start)
+        counts.append(processes.take())
+
+    if controller.executor is not None:
+        controller.executor.shutdown()
+    return {
+        'discovery_poll_s': discovery,
+        'discovery_processes': discovery_processes,
+        'poll_s': summarize(durations),
+        'processes_per_poll': summarize(counts),
+    }
+
+
+def stream_sdr_list(text: str) -> None:
+    """
+    Parse sdr list output from a file object like the pipe.
+    """
+    for _ in parse_sdr_list(io.StringIO(text)):
+        pass
+
+
+def stream_sdr_get(text: str) -> None:
+    """
+    Parse sdr get output from a file object like the pipe.
+    """
+    for _ in parse_sdr_get(io.StringIO(text), SDR_GET_FIELDS):
+        pass
+
+
+def bench_parsers(corpus: str, repeat: int) -> Dict[str, float]:
+    """
+    Seconds per parse of each corpus file.
+    """
+    results: Dict[str, float] = {}
+    for filename in sorted(os.listdir(corpus)):
+        with open(os.path.join(corpus, filename), 'r',
+                  encoding='utf-8') as corpus_file:
+            text = corpus_file.read()
+        key = os.path.splitext(filename)[0]
+        if filename.startswith('sdr-get-'):
+            results[f'parse_sdr_get:{key}'] = best_time(
+                functools.partial(stream_sdr_get, text), repeat)
+        else:
+            results[f'parse_sdr_list:{key}'] = best_time(
+                functools.partial(stream_sdr_list, text), repeat)
+    return results
+
+
+def bench_sdr_get(name: str, calls: int) -> Dict[str, float]:
+    """
+    Time whole Ipmitool.sdr_get calls: process, pipe and parse.
+    """
+    ipmitool = Ipmitool(name, 'root', 'calvin')
+    fan_names = [reading.name for reading in ipmitool.sdr_type('fan')]
+    durations = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        ipmitool.sdr_get(fan_names, SDR_GET_FIELDS)
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def bench_state(name: str, state_path: str,
+                repeat: int) -> Tuple[Dict[str, float], int]:
+    """
+    Time save_state and load_state of a state file left by bench_polls().
+    Return times and state file size.
+    """
+    controller = create_controller(name, state_path, 1)
+    state = controller.load_state()
+
+    def save() -> None:
+        # Unchanged state isn't written; force a write.
+        controller.saved_state_buf = None
+        controller.save_state(state)
+
+    times = {
+        'save_state_s': best_time(save, repeat),
+        'load_state_s': best_time(controller.load_state, repeat),
+    }
+    return times, os.path.getsize(controller.state_filename())
+
+
+def bench_host(host: str, args: argparse.Namespace,
+               work_dir: str) -> Dict[str, Any]:
+    """
+    Run all benchmarks against one corpus host.
+    """
+    corpus = os.path.join(CORPUS_PATH, host)
+    os.environ['FAKE_IPMITOOL_CORPUS'] = corpus
+    os.environ['FAKE_IPMITOOL_LATENCY'] = str(args.latency)
+    processes = ProcessLog(os.path.join(work_dir, f'{host}.log'))
+
+    result: Dict[str, Any] = {}
+    for mode, concurrency in POLL_MODES.items():
+        state_path = os.path.join(work_dir, f'{host}-{mode}')
+        os.mkdir(state_path)
+        result[mode] = bench_polls(host, state_path, concurrency,
+                                   args.polls, processes)
+
+    result['parse_s'] = bench_parsers(corpus, args.repeat)
+    result['sdr_get_call_s'] = bench_sdr_get(host, args.polls)
+    processes.take()
+    times, size = bench_state(host, os.path.join(work_dir,
+                                                 f'{host}-sequential'),
+                              args.repeat)
+    result.update(times)
+    result['state_bytes'] = size
+    return result
+
+
+def main() -> int:
+    """
+    Run benchmarks and print results as JSON.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--polls', type=int, metavar='N', default=20,
+                        help='Steady polls per host and mode (default: 20)')
+    parser.add_argument('--latency', type=float, metavar='SEC', default=0.0,
+                        help='Delay of each fake ipmitool response '
+                             '(default: 0)')
+    parser.add_argument('--repeat', type=int, metavar='N', default=200,
+                        help='Calls per timing of parse and state '
+                             'benchmarks (default: 200)')
+    parser.add_argument('--host', metavar='NAME', action='append',
+                        default=None,
+                        help='Corpus host to replay, repeat for several '
+                             '(default: all)')
+    parser.add_argument('--output', metavar='FILE', default=None,
+                        help='Write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+
+    # Keep poll logging, including errors about sensors the corpus has no
+    # reading for, out of the timings and the output.  Failed polls still
+    # raise.
+    logging.disable(logging.CRITICAL)
+
+    hosts = args.host or sorted(os.listdir(CORPUS_PATH))
+    results: Dict[str, Any] = {
+        'benchmark': 'poll',
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'polls': args.polls, 'latency': args.latency,
+                     'repeat': args.repeat},
+        'hosts': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='pifan-bench.') as work_dir:
+        bin_dir = os.path.join(work_dir, 'bin')
+        os.mkdir(bin_dir)
+        install_fake_ipmitool(bin_dir)
+        for host in hosts:
+            results['hosts'][host] = bench_host(host, args, work_dir)
+    results['peak_rss_bytes'] = peak_rss()
+
+    text = json.dumps(results, indent=2) + '\n'
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
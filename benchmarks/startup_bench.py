@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold start of cron-mode runs against a stand-in ipmitool.
+
+Runs `bin/pifan --count 1 --startup-profile` repeatedly, like cron does,
+against fake_ipmitool.py replaying a corpus host, with a state file and SDR
+cache left by a first run.  Measures, from the startup profile of each run:
+
+- time from process start to the first IPMI command
+- time of each startup phase: python, imports, setup, load_state
+
+and the wall time of whole runs.  Results are printed as JSON to compare
+releases.  With --target, exits with status 1 if the median time to the
+first IPMI command is above it.
+
+Usage: PYTHONPATH=src python3 benchmarks/startup_bench.py [--runs N]
+    [--target MS] [--output FILE]
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+from poll_bench import BENCH_PATH, CORPUS_PATH, git_revision, \
+    install_fake_ipmitool, summarize
+
+PIFAN = os.path.join(os.path.dirname(BENCH_PATH), 'bin', 'pifan')
+
+SRC_PATH = os.path.join(os.path.dirname(BENCH_PATH), 'src')
+
+PAT_PHASE = re.compile(r'(\w+) ([\d.]+)ms')
+
+PAT_FIRST_REQUEST = re.compile(r'first IPMI command \((.*)\) ([\d.]+)ms')
+
+
+def run_pifan(host: str, env: Dict[str, str]) -> str:
+    """
+    Run one cron-mode poll.
+    Return its startup profile line.
+    """
+    output = subprocess.run(
+        [sys.executable, PIFAN, '--count', '1', '--startup-profile',
+         host, 'root', 'calvin'],
+        env=env, capture_output=True, encoding='utf-8', check=True).stdout
+    for line in output.splitlines():
+        if 'Startup profile:' in line:
+            return line
+    raise Exception(f'No startup profile in output:\n{output}')
+
+
+def bench_host(host: str, runs: int, work_dir: str) -> Dict[str, Any]:
+    """
+    Time cron-mode runs against one corpus host.
+    """
+    env = dict(os.environ)
+    env['FAKE_IPMITOOL_CORPUS'] = os.path.join(CORPUS_PATH, host)
+    env['PYTHONPATH'] = SRC_PATH
+    env['TMP'] = os.path.join(work_dir, host)
+    os.mkdir(env['TMP'])
+    # Cron runs of an installed package use compiled modules.
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    # Discover sensors and build the SDR cache, like the first cron run.
+    run_pifan(host, env)
+
+    phases: Dict[str, List[float]] = {}
+    first_request: List[float] = []
+    durations: List[float] = []
+    command = ''
+    for _ in range(runs):
+        start = time.perf_counter()
+        line = run_pifan(host, env)
+        durations.append(time.perf_counter() - start)
+
+        profile = line.split('Startup profile: ', 1)[1]
+        for phase, value in PAT_PHASE.findall(profile.split(';')[0]):
+            phases.setdefault(phase, []).append(float(value) / 1000)
+        match = PAT_FIRST_REQUEST.search(profile)
+        if match is None:
+            raise Exception(f'Unexpected startup profile: {line}')
+        command = match.group(1)
+        first_request.append(float(match.group(2)) / 1000)
+
+    return {
+        'first_command': command,
+        'first_request_s': summarize(first_request),
+        'phases_s': {phase: summarize(values)
+                     for phase, values in phases.items()},
+        'run_s': summarize(durations),
+    }
+
+
+def main() -> int:
+    """
+    Run benchmarks and print results as JSON.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, metavar='N', default=20,
+                        help='Timed runs per host (default: 20)')
+    parser.add_argument('--host', metavar='NAME', action='append',
+                        default=None,
+                        help='Corpus host to replay, repeat for several '
+                             '(default: all)')
+    parser.add_argument('--target', type=float, metavar='MS', default=None,
+                        help='Fail if the median time to the first IPMI '
+                             'command of a host is above MS milliseconds')
+    parser.add_argument('--output', metavar='FILE', default=None,
+                        help='Write JSON results to FILE (default: stdout)')
+    args = parser.parse_args()
+
+    hosts = args.host or sorted(os.listdir(CORPUS_PATH))
+    results: Dict[str, Any] = {
+        'benchmark': 'startup',
+        'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'runs': args.runs, 'target_ms': args.target},
+        'hosts': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='pifan-bench.') as work_dir:
+        bin_dir = os.path.join(work_dir, 'bin')
+        os.mkdir(bin_dir)
+        install_fake_ipmitool(bin_dir)
+        for host in hosts:
+            results['hosts'][host] = bench_host(host, args.runs, work_dir)
+
+    text = json.dumps(results, indent=2) + '\n'
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(text)
+
+    if args.target is not None:
+        for host, result in results['hosts'].items():
+            median_ms = result['first_request_s']['median'] * 1000
+            if median_ms > args.target:
+                print(f'{host}: first IPMI command after {median_ms:0.1f}ms, '
+                      f'above target {args.target:g}ms', file=sys.stderr)
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
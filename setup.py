@@ -18,6 +18,10 @@ setuptools.setup(
     scripts=[
         'bin/pifan'
     ],
+    extras_require={
+        # pifan tune
+        'tune': ['numpy'],
+    },
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Environment :: Console',
@@ -1,8 +1,80 @@
 """
 PiFan local modules.
+Exports are imported on first use, so a light command such as `pifan ctl`
+doesn't pay for importing the controller.
 """
-from .controller_state import ControllerState
-from .ipmi_cpu import IpmiCpu
-from .ipmi_fan import IpmiFan
-from .monitor import Monitor
-from .pi_fan_controller import PiFanController
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .adaptive_interval import AdaptiveInterval, parse_interval_range
+    from .aggregator import AggregateSpec, TempAggregator, \
+        parse_aggregate_spec
+    from .control import ControlClient
+    from .controller_state import ControllerState
+    from .fleet import Fleet, HostConfig, load_fleet_config
+    from .history import HistoryFile, HistoryRecord
+    from .ipmi_backend import BACKENDS, create_backend
+    from .ipmi_cpu import IpmiCpu
+    from .ipmi_errors import IpmiCommandError, IpmiError, IpmiSessionError, \
+        IpmiTimeoutError, IpmiUnavailableError
+    from .ipmi_fan import IpmiFan
+    from .ipmi_lan import close_sessions
+    from .ipmi_native import IpmiNative
+    from .ipmi_snapshot import IpmiSnapshot
+    from .monitor import Monitor
+    from .pi_fan_controller import PiFanController
+    from .pid import PidController, PidState, parse_pid_gains
+    from .retry import RetryPolicy
+    from .scheduler import PollScheduler, ScheduleStats
+    from .thermal_sim import ThermalModel, ThermalSimulation, Workload
+
+# Module of each export.
+_EXPORTS = {
+    'AdaptiveInterval': 'adaptive_interval',
+    'parse_interval_range': 'adaptive_interval',
+    'AggregateSpec': 'aggregator',
+    'TempAggregator': 'aggregator',
+    'parse_aggregate_spec': 'aggregator',
+    'ControlClient': 'control',
+    'ControllerState': 'controller_state',
+    'Fleet': 'fleet',
+    'HostConfig': 'fleet',
+    'load_fleet_config': 'fleet',
+    'HistoryFile': 'history',
+    'HistoryRecord': 'history',
+    'BACKENDS': 'ipmi_backend',
+    'create_backend': 'ipmi_backend',
+    'IpmiCpu': 'ipmi_cpu',
+    'IpmiCommandError': 'ipmi_errors',
+    'IpmiError': 'ipmi_errors',
+    'IpmiSessionError': 'ipmi_errors',
+    'IpmiTimeoutError': 'ipmi_errors',
+    'IpmiUnavailableError': 'ipmi_errors',
+    'IpmiFan': 'ipmi_fan',
+    'close_sessions': 'ipmi_lan',
+    'IpmiNative': 'ipmi_native',
+    'IpmiSnapshot': 'ipmi_snapshot',
+    'Monitor': 'monitor',
+    'PiFanController': 'pi_fan_controller',
+    'PidController': 'pid',
+    'PidState': 'pid',
+    'parse_pid_gains': 'pid',
+    'RetryPolicy': 'retry',
+    'PollScheduler': 'scheduler',
+    'ScheduleStats': 'scheduler',
+    'ThermalModel': 'thermal_sim',
+    'ThermalSimulation': 'thermal_sim',
+    'Workload': 'thermal_sim',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
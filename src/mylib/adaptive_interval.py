@@ -0,0 +1,137 @@
+"""
+Adaptive polling interval driven by CPU temperature trend.
+"""
+
+import logging
+from typing import Optional, Tuple
+from .controller_state import ControllerState
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveInterval:
+    """
+    Choose the delay until the next poll from the aggregate CPU temperature.
+
+    While the temperature is flat and at least margin degrees below the
+    ideal temperature, the interval grows by growth per poll up to
+    max_interval.  Above that, it returns to the base interval, and
+    shrinks toward min_interval as the temperature nears max temp or is
+    rising fast enough to reach it within a few intervals.
+    """
+    min_interval: float
+
+    max_interval: float
+
+    # Interval when neither idle nor hot, normally --interval.
+    base_interval: float
+
+    # Degrees C below ideal temp to be considered idle.
+    margin: float
+
+    # Max rate of change in degrees C per second to be considered flat.
+    flat_rate: float
+
+    # Interval multiplier per idle poll.
+    growth: float
+
+    # Keep at least this many polls before temperature is projected to
+    # reach max temp.
+    lead_polls: float
+
+    def __init__(self, min_interval: float = 5.0,
+                 max_interval: float = 60.0,
+                 base_interval: float = 10.0) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.base_interval = base_interval
+        self.margin = 3.0
+        self.flat_rate = 0.01
+        self.growth = 1.5
+        self.lead_polls = 4.0
+
+    def __str__(self) -> str:
+        return (f'AdaptiveInterval: min={self.min_interval:g}s, '
+                f'max={self.max_interval:g}s, '
+                f'base={self.base_interval:g}s')
+
+    def _clamp(self, interval: float) -> float:
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def next_interval(self, interval: float, temp: float,
+                      rate: Optional[float], ideal_temp: float,
+                      max_temp: float) -> Tuple[float, str]:
+        """
+        Compute next interval from current interval, aggregate temperature
+        and its rate of change in degrees C per second, if known.
+        Return (interval, reason).
+        """
+        # pylint: disable=too-many-arguments
+        if rate is not None and abs(rate) <= self.flat_rate \
+                and temp <= ideal_temp - self.margin:
+            return self._clamp(max(interval, self.base_interval)
+                               * self.growth), 'idle'
+
+        # Shrink linearly from base to min interval between ideal and max
+        # temp.
+        reason = 'normal'
+        target = self.base_interval
+        if temp > ideal_temp and max_temp > ideal_temp:
+            hot = min(1.0, (temp - ideal_temp) / (max_temp - ideal_temp))
+            target = self.base_interval \
+                - hot * (self.base_interval - self.min_interval)
+            reason = 'hot'
+
+        if rate is not None and rate > self.flat_rate:
+            time_to_max = max(0.0, max_temp - temp) / rate
+            if time_to_max / self.lead_polls < target:
+                target = time_to_max / self.lead_polls
+                reason = 'rising'
+
+        return self._clamp(target), reason
+
+    def update(self, state: ControllerState, temp: float, now: float,
+               ideal_temp: float, max_temp: float) -> float:
+        """
+        Compute interval after a poll at epoch seconds now with aggregate
+        temperature temp.  Store interval and trend in state.
+        Return interval.
+        """
+        # pylint: disable=too-many-arguments
+        rate: Optional[float] = None
+        if state.last_poll_temp is not None \
+                and state.last_poll_time is not None \
+                and 0 < now - state.last_poll_time <= 2 * self.max_interval:
+            rate = (temp - state.last_poll_temp) \
+                / (now - state.last_poll_time)
+
+        interval = state.poll_interval
+        if interval is None:
+            interval = self.base_interval
+        new_interval, reason = self.next_interval(interval, temp, rate,
+                                                  ideal_temp, max_temp)
+        if new_interval != interval:
+            rate_text = 'unknown' if rate is None else f'{rate * 60:+0.2f}'
+            logger.info('Poll interval: %0.1fs -> %0.1fs (%s, %0.1fC, '
+                        '%sC/min)', interval, new_interval, reason, temp,
+                        rate_text)
+
+        state.poll_interval = new_interval
+        state.last_poll_temp = temp
+        state.last_poll_time = now
+        return new_interval
+
+
+def parse_interval_range(text: str) -> Tuple[float, float]:
+    """
+    Parse adaptive interval range MIN:MAX in seconds.
+    """
+    parts = text.split(':')
+    try:
+        min_interval, max_interval = (float(part) for part in parts)
+    except ValueError as error:
+        raise ValueError(f'Invalid interval range "{text}", expected '
+                         'MIN:MAX') from error
+    if not 0 < min_interval <= max_interval:
+        raise ValueError(f'Invalid interval range "{text}"')
+    return min_interval, max_interval
@@ -0,0 +1,161 @@
+"""
+Minimal pure Python AES-128 block cipher with CBC mode.
+Used by the native IPMI client for AES-CBC-128 confidentiality.
+https://nvlpubs.nist.gov/nistpubs/FIPS/NIST.FIPS.197.pdf
+"""
+
+from typing import List
+
+
+BLOCK_SIZE = 16
+
+
+def _build_tables() -> List[List[int]]:
+    """
+    Generate S-box, inverse S-box and GF(2^8) multiplication helpers.
+    """
+    exp = [0] * 512
+    log = [0] * 256
+    value = 1
+    for i in range(255):
+        exp[i] = value
+        log[value] = i
+        # Multiply by generator 3.
+        value ^= (value << 1) ^ (0x11b if value & 0x80 else 0)
+        value &= 0xff
+    for i in range(255, 512):
+        exp[i] = exp[i - 255]
+
+    sbox = [0] * 256
+    inv_sbox = [0] * 256
+    for i in range(256):
+        inv = 0 if i == 0 else exp[255 - log[i]]
+        out = inv
+        for shift in range(1, 5):
+            out ^= ((inv << shift) | (inv >> (8 - shift))) & 0xff
+        out ^= 0x63
+        sbox[i] = out
+        inv_sbox[out] = i
+
+    return [exp, log, sbox, inv_sbox]
+
+
+_EXP, _LOG, _SBOX, _INV_SBOX = _build_tables()
+
+
+def _mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+_MUL2 = [_mul(i, 2) for i in range(256)]
+_MUL3 = [_mul(i, 3) for i in range(256)]
+_MUL9 = [_mul(i, 9) for i in range(256)]
+_MUL11 = [_mul(i, 11) for i in range(256)]
+_MUL13 = [_mul(i, 13) for i in range(256)]
+_MUL14 = [_mul(i, 14) for i in range(256)]
+
+# State is a flat list of 16 bytes in column-major order.
+_SHIFT_ROWS = [0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11]
+_INV_SHIFT_ROWS = [0, 13, 10, 7, 4, 1, 14, 11, 8, 5, 2, 15, 12, 9, 6, 3]
+
+
+class Aes128:
+    """
+    AES-128 block cipher.
+    """
+    round_keys: List[List[int]]
+
+    def __init__(self, key: bytes) -> None:
+        if len(key) != BLOCK_SIZE:
+            raise ValueError('AES-128 key must be 16 bytes')
+        self.round_keys = self._expand_key(key)
+
+    @staticmethod
+    def _expand_key(key: bytes) -> List[List[int]]:
+        words = [list(key[i:i + 4]) for i in range(0, 16, 4)]
+        rcon = 1
+        for i in range(4, 44):
+            word = list(words[i - 1])
+            if i % 4 == 0:
+                word = word[1:] + word[:1]
+                word = [_SBOX[b] for b in word]
+                word[0] ^= rcon
+                rcon = _MUL2[rcon]
+            words.append([a ^ b for a, b in zip(words[i - 4], word)])
+
+        return [sum(words[r * 4:r * 4 + 4], []) for r in range(11)]
+
+    def encrypt_block(self, block: bytes) -> bytes:
+        """
+        Encrypt a single 16 byte block.
+        """
+        keys = self.round_keys
+        state = [b ^ k for b, k in zip(block, keys[0])]
+
+        for rnd in range(1, 11):
+            state = [_SBOX[state[i]] for i in _SHIFT_ROWS]
+            if rnd != 10:
+                mixed = []
+                for col in range(0, 16, 4):
+                    a0, a1, a2, a3 = state[col:col + 4]
+                    mixed += [
+                        _MUL2[a0] ^ _MUL3[a1] ^ a2 ^ a3,
+                        a0 ^ _MUL2[a1] ^ _MUL3[a2] ^ a3,
+                        a0 ^ a1 ^ _MUL2[a2] ^ _MUL3[a3],
+                        _MUL3[a0] ^ a1 ^ a2 ^ _MUL2[a3],
+                    ]
+                state = mixed
+            state = [b ^ k for b, k in zip(state, keys[rnd])]
+
+        return bytes(state)
+
+    def decrypt_block(self, block: bytes) -> bytes:
+        """
+        Decrypt a single 16 byte block.
+        """
+        keys = self.round_keys
+        state = [b ^ k for b, k in zip(block, keys[10])]
+
+        for rnd in range(9, -1, -1):
+            state = [_INV_SBOX[state[i]] for i in _INV_SHIFT_ROWS]
+            state = [b ^ k for b, k in zip(state, keys[rnd])]
+            if rnd != 0:
+                mixed = []
+                for col in range(0, 16, 4):
+                    a0, a1, a2, a3 = state[col:col + 4]
+                    mixed += [
+                        _MUL14[a0] ^ _MUL11[a1] ^ _MUL13[a2] ^ _MUL9[a3],
+                        _MUL9[a0] ^ _MUL14[a1] ^ _MUL11[a2] ^ _MUL13[a3],
+                        _MUL13[a0] ^ _MUL9[a1] ^ _MUL14[a2] ^ _MUL11[a3],
+                        _MUL11[a0] ^ _MUL13[a1] ^ _MUL9[a2] ^ _MUL14[a3],
+                    ]
+                state = mixed
+
+        return bytes(state)
+
+    def encrypt_cbc(self, iv: bytes, data: bytes) -> bytes:
+        """
+        Encrypt data in CBC mode.  Length must be a multiple of 16.
+        """
+        out = bytearray()
+        prev = iv
+        for i in range(0, len(data), BLOCK_SIZE):
+            block = bytes(a ^ b for a, b in zip(data[i:i + BLOCK_SIZE], prev))
+            prev = self.encrypt_block(block)
+            out += prev
+        return bytes(out)
+
+    def decrypt_cbc(self, iv: bytes, data: bytes) -> bytes:
+        """
+        Decrypt data in CBC mode.  Length must be a multiple of 16.
+        """
+        out = bytearray()
+        prev = iv
+        for i in range(0, len(data), BLOCK_SIZE):
+            block = data[i:i + BLOCK_SIZE]
+            out += bytes(
+                a ^ b for a, b in zip(self.decrypt_block(block), prev))
+            prev = block
+        return bytes(out)
@@ -0,0 +1,268 @@
+"""
+CPU temperature aggregation over a sliding window.
+"""
+
+import bisect
+from collections import deque
+import math
+from typing import Deque, List, Optional, Tuple
+from .util import parse_duration
+
+
+AGGREGATE_TYPES = ['mean', 'ewma', 'median', 'max']
+
+# Capacity of time based windows.
+MAX_SAMPLES = 4096
+
+
+class AggregateSpec:
+    """
+    Aggregation settings, parsed from a spec string::
+
+        TYPE[:WINDOW][:stale=DURATION]
+
+    TYPE is mean, ewma, median or max.  WINDOW is a sample count, such as 3,
+    or a duration, such as 60s or 5m.  For ewma, WINDOW is the time constant
+    or equivalent sample span.  Samples older than the stale duration
+    (default: 1h) are discarded.
+    """
+    kind: str
+
+    # Window as sample count, or 0 if time based.
+    samples: int
+
+    # Window in seconds, or 0 if sample count based.
+    seconds: float
+
+    # Discard all samples if the newest is older than this many seconds.
+    stale: float
+
+    def __init__(self, kind: str = 'mean', samples: int = 3,
+                 seconds: float = 0.0, stale: float = 3600.0) -> None:
+        self.kind = kind
+        self.samples = samples
+        self.seconds = seconds
+        self.stale = stale
+
+    def __str__(self) -> str:
+        window = f'{self.seconds:g}s' if self.seconds else str(self.samples)
+        return f'{self.kind}:{window}:stale={self.stale:g}s'
+
+    def is_time_based(self) -> bool:
+        """
+        True if the window is a duration instead of a sample count.
+        """
+        return self.seconds > 0
+
+
+def parse_aggregate_spec(text: str) -> AggregateSpec:
+    """
+    Parse aggregate spec string.  See AggregateSpec.
+    """
+    parts = text.strip().split(':')
+    spec = AggregateSpec(parts[0].lower())
+    if spec.kind not in AGGREGATE_TYPES:
+        raise ValueError(f'Unrecognized aggregate type "{parts[0]}"')
+
+    for part in parts[1:]:
+        if part.startswith('stale='):
+            spec.stale = parse_duration(part[6:])
+        elif part.isdigit():
+            spec.samples = int(part)
+            spec.seconds = 0.0
+        else:
+            spec.seconds = parse_duration(part)
+            spec.samples = 0
+
+    if spec.samples < 1 and spec.seconds <= 0:
+        raise ValueError(f'Invalid aggregate window in "{text}"')
+
+    return spec
+
+
+class TempAggregator:
+    """
+    Ring buffer of timestamped samples with O(1) running aggregates.
+    mean keeps a running sum, max a monotonic queue, ewma a single running
+    value.  median keeps a sorted copy of the window.
+    """
+    spec: AggregateSpec
+
+    capacity: int
+
+    # Number of samples in window.
+    count: int
+
+    # Epoch seconds of first sample since reset.
+    start_time: Optional[float]
+
+    # Epoch seconds of newest sample.
+    last_time: Optional[float]
+
+    ewma: Optional[float]
+
+    def __init__(self, spec: AggregateSpec) -> None:
+        self.spec = spec
+        self.capacity = spec.samples if spec.samples else MAX_SAMPLES
+        self._times: List[float] = [0.0] * self.capacity
+        self._values: List[float] = [0.0] * self.capacity
+        self._head = 0
+        self._seq = 0
+        self._total = 0.0
+        self._sorted: List[float] = []
+        self._max_queue: Deque[Tuple[int, float]] = deque()
+        self.count = 0
+        self.start_time = None
+        self.last_time = None
+        self.ewma = None
+
+    def reset(self) -> None:
+        """
+        Discard all samples.
+        """
+        self._head = 0
+        self._total = 0.0
+        self._sorted = []
+        self._max_queue.clear()
+        self.count = 0
+        self.start_time = None
+        self.last_time = None
+        self.ewma = None
+
+    def _tail(self) -> int:
+        return (self._head - self.count) % self.capacity
+
+    def _evict(self) -> None:
+        tail = self._tail()
+        value = self._values[tail]
+        self._total -= value
+        if self.spec.kind == 'median':
+            del self._sorted[bisect.bisect_left(self._sorted, value)]
+        if self._max_queue and \
+                self._max_queue[0][0] == self._seq - self.count:
+            self._max_queue.popleft()
+        self.count -= 1
+
+    def add(self, value: float, now: float) -> float:
+        """
+        Add a sample taken at epoch seconds now.
+        Return new aggregate value.
+        """
+        if self.last_time is not None and \
+                now - self.last_time > self.spec.stale:
+            # Too old, clear samples.
+            self.reset()
+
+        if self.count == self.capacity:
+            self._evict()
+
+        self._times[self._head] = now
+        self._values[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        self.count += 1
+        self._total += value
+        if self._head == 0:
+            # Limit floating point drift of the running sum.
+            self._total = sum(self.values())
+
+        if self.spec.kind == 'median':
+            bisect.insort(self._sorted, value)
+        while self._max_queue and self._max_queue[-1][1] <= value:
+            self._max_queue.pop()
+        self._max_queue.append((self._seq, value))
+        self._seq += 1
+
+        if self.spec.is_time_based():
+            cutoff = now - self.spec.seconds
+            while self.count > 1 and self._times[self._tail()] < cutoff:
+                self._evict()
+
+        self._update_ewma(value, now)
+        if self.start_time is None:
+            self.start_time = now
+        self.last_time = now
+        return self.value()
+
+    def _update_ewma(self, value: float, now: float) -> None:
+        if self.ewma is None or self.last_time is None:
+            self.ewma = value
+            return
+
+        if self.spec.is_time_based():
+            elapsed = max(0.0, now - self.last_time)
+            alpha = 1.0 - math.exp(-elapsed / self.spec.seconds)
+        else:
+            alpha = 2.0 / (self.spec.samples + 1)
+        self.ewma += alpha * (value - self.ewma)
+
+    def value(self) -> float:
+        """
+        Current aggregate value.
+        """
+        if self.count == 0:
+            return float('nan')
+
+        kind = self.spec.kind
+        if kind == 'ewma':
+            assert self.ewma is not None
+            return self.ewma
+        if kind == 'max':
+            return self._max_queue[0][1]
+        if kind == 'median':
+            middle = self.count // 2
+            if self.count % 2:
+                return self._sorted[middle]
+            return (self._sorted[middle - 1] + self._sorted[middle]) / 2
+        return self._total / self.count
+
+    def ready(self) -> bool:
+        """
+        True once the window is full.
+        """
+        if self.spec.is_time_based():
+            if self.start_time is None or self.last_time is None:
+                return False
+            return self.last_time - self.start_time >= self.spec.seconds
+        return self.count >= self.spec.samples
+
+    def progress(self) -> str:
+        """
+        Describe how full the window is.
+        """
+        if self.spec.is_time_based():
+            span = 0.0
+            if self.start_time is not None and self.last_time is not None:
+                span = min(self.spec.seconds,
+                           self.last_time - self.start_time)
+            return f'{span:.0f}/{self.spec.seconds:.0f}s'
+        return f'{self.count}/{self.spec.samples} samples'
+
+    def values(self) -> List[float]:
+        """
+        Sample values in window, oldest first.
+        """
+        tail = self._tail()
+        return [self._values[(tail + i) % self.capacity]
+                for i in range(self.count)]
+
+    def samples(self) -> List[Tuple[float, float]]:
+        """
+        (epoch seconds, value) samples in window, oldest first.
+        """
+        tail = self._tail()
+        return [(self._times[(tail + i) % self.capacity],
+                 self._values[(tail + i) % self.capacity])
+                for i in range(self.count)]
+
+    def restore(self, samples: List[Tuple[float, float]],
+                ewma: Optional[float], start_time: Optional[float]) -> None:
+        """
+        Restore persisted samples, possibly saved with a different spec.
+        """
+        self.reset()
+        for sample_time, value in samples:
+            self.add(value, sample_time)
+        if ewma is not None:
+            self.ewma = ewma
+        if start_time is not None and self.count:
+            self.start_time = start_time
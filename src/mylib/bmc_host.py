@@ -0,0 +1,26 @@
+"""
+Address and credentials of a server's BMC.
+"""
+
+from dataclasses import dataclass
+
+
+@dataclass
+class BmcHost:
+    """
+    Server managed by PiFan: how to reach its BMC.
+    """
+    # Name in logs and control requests.
+    name: str
+
+    # Address of the BMC.
+    host: str
+
+    username: str = ''
+
+    password: str = ''
+
+    # IPMI backend: ipmitool | native.
+    ipmi: str = 'ipmitool'
+
+    port: int = 623
@@ -0,0 +1,484 @@
+"""
+Local UDP BMC simulator speaking IPMI v2.0 RMCP+.
+Emulates the subset of an iDRAC used by PiFan: session setup, SDR
+repository, sensor readings and the Dell OEM fan commands.
+
+Run standalone for manual testing::
+
+    python3 -m mylib.bmc_simulator --port 6230
+    pifan --ipmi native --port 6230 localhost root calvin
+
+"""
+
+import argparse
+import hmac
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from .aes import Aes128, BLOCK_SIZE
+from .ipmi_lan import AUTH_TYPE_RMCPP, CIPHER_SUITES, PAYLOAD_AUTHENTICATED, \
+    PAYLOAD_ENCRYPTED, PAYLOAD_IPMI, PAYLOAD_OPEN_SESSION_REQUEST, \
+    PAYLOAD_OPEN_SESSION_RESPONSE, PAYLOAD_RAKP1, PAYLOAD_RAKP2, \
+    PAYLOAD_RAKP3, PAYLOAD_RAKP4, RMCP_HEADER, checksum
+
+
+class SimSensor:
+    """
+    Simulated threshold sensor.
+    """
+    name: str
+
+    number: int
+
+    sensor_type: int
+
+    base_unit: int
+
+    entity_id: int
+
+    entity_instance: int
+
+    # Reading = raw * m.
+    m: int
+
+    value: float
+
+    normal_max: float
+
+    def __init__(self, name: str, number: int, sensor_type: int,
+                 base_unit: int, value: float, m: int = 1,
+                 normal_max: float = 0.0) -> None:
+        self.name = name
+        self.number = number
+        self.sensor_type = sensor_type
+        self.base_unit = base_unit
+        self.entity_id = 3 if sensor_type == 0x01 else 7
+        self.entity_instance = 1
+        self.m = m
+        self.value = value
+        self.normal_max = normal_max
+
+    def raw_value(self) -> int:
+        """
+        Raw reading byte.
+        """
+        return max(0, min(0xff, int(round(self.value / self.m))))
+
+    def sdr_record(self, record_id: int) -> bytes:
+        """
+        Encode as full sensor record, including header.
+        """
+        name = self.name.encode('ascii')
+        body = bytearray(43)
+        body[0] = 0x20                      # owner
+        body[1] = 0x00                      # LUN
+        body[2] = self.number
+        body[3] = self.entity_id
+        body[4] = self.entity_instance
+        body[7] = self.sensor_type
+        body[8] = 0x01                      # threshold reading type
+        body[15] = 0x00                     # unsigned analog
+        body[16] = self.base_unit
+        body[19] = self.m & 0xff
+        body[20] = (self.m >> 2) & 0xc0
+        if self.normal_max:
+            body[25] = 0x02
+            body[27] = max(0, min(0xff, int(self.normal_max / self.m)))
+        body[42] = 0xc0 | len(name)
+        body += name
+        header = struct.pack('<HBBB', record_id, 0x51, 0x01, len(body))
+        return header + bytes(body)
+
+
+def default_sensors() -> List[SimSensor]:
+    """
+    Sensors resembling a dual socket PowerEdge R720.
+    """
+    sensors = [
+        SimSensor('Inlet Temp', 0x04, 0x01, 1, 22.0),
+        SimSensor('Exhaust Temp', 0x01, 0x01, 1, 30.0),
+        SimSensor('Temp', 0x0e, 0x01, 1, 45.0),
+        SimSensor('Temp', 0x0f, 0x01, 1, 42.0),
+    ]
+    for index in range(6):
+        sensors.append(SimSensor(f'Fan{index + 1}', 0x30 + index, 0x04, 18,
+                                 3600.0, m=120, normal_max=23640.0))
+    return sensors
+
+
+class SimSession:
+    """
+    Simulator side of an RMCP+ session.
+    """
+    def __init__(self, bmc_sid: int, console_sid: int) -> None:
+        self.bmc_sid = bmc_sid
+        self.console_sid = console_sid
+        self.tag = 0
+        self.console_rand = b''
+        self.bmc_rand = os.urandom(16)
+        self.user_info = b''
+        self.k1 = b''
+        self.aes: Optional[Aes128] = None
+        self.active = False
+
+
+class BmcSimulator:
+    """
+    UDP BMC simulator.
+    """
+    host: str
+
+    port: int
+
+    username: str
+
+    password: str
+
+    cipher_suite: int
+
+    sensors: List[SimSensor]
+
+    # Last fan speed percent set by OEM raw command, per fan index.
+    fan_speeds: Dict[int, int]
+
+    static_fans: bool
+
+    # Power draw in watts reported by DCMI Get Power Reading.
+    power: float
+
+    # Log of (netfn, cmd, data) received.
+    requests: List[Tuple[int, int, bytes]]
+
+    sessions_opened: int
+
+    # Artificial delay before each response, in seconds.
+    latency: float
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 username: str = 'root', password: str = 'calvin',
+                 listen: bool = True) -> None:
+        self.host = host
+        self.username = username
+        self.password = password
+        self.cipher_suite = 3
+        self.sensors = default_sensors()
+        self.fan_speeds = {}
+        self.static_fans = False
+        self.power = 120.0
+        self.requests = []
+        self.sessions_opened = 0
+        self.latency = 0.0
+        self.guid = os.urandom(16)
+        self.sdr_timestamp = int(time.time())
+        self._sessions: Dict[int, SimSession] = {}
+        self._reservation = 1
+        # Without a socket, commands are only served by handle_command().
+        self._sock: Optional[socket.socket] = None
+        self.port = port
+        if listen:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.bind((host, port))
+            self.port = self._sock.getsockname()[1]
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self) -> None:
+        """
+        Serve requests on a background thread.
+        """
+        self._running = True
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop serving.
+        """
+        self._running = False
+        if self._sock is not None:
+            self._sock.close()
+        if self._thread is not None:
+            self._thread.join(1.0)
+
+    def drop_sessions(self) -> None:
+        """
+        Forget all sessions, as a rebooted or timed out BMC would.
+        """
+        self._sessions.clear()
+
+    def serve_forever(self) -> None:
+        """
+        Receive and answer packets until stopped.
+        """
+        assert self._sock is not None
+        self._running = True
+        while self._running:
+            try:
+                packet, addr = self._sock.recvfrom(1024)
+            except OSError:
+                break
+            try:
+                response = self.handle_packet(packet)
+            except Exception:  # pylint: disable=broad-except
+                response = None
+            if response is not None:
+                if self.latency:
+                    time.sleep(self.latency)
+                try:
+                    self._sock.sendto(response, addr)
+                except OSError:
+                    break
+
+    def _hmac(self, key: bytes, data: bytes) -> bytes:
+        return hmac.new(key, data,
+                        CIPHER_SUITES[self.cipher_suite][3]).digest()
+
+    def _wrap(self, payload_type: int, payload: bytes,
+              session: Optional[SimSession] = None) -> bytes:
+        if session is None or not session.active:
+            return (RMCP_HEADER
+                    + struct.pack('<BBIIH', AUTH_TYPE_RMCPP, payload_type, 0,
+                                  0, len(payload))
+                    + payload)
+
+        assert session.aes is not None
+        pad_len = (BLOCK_SIZE - (len(payload) + 1) % BLOCK_SIZE) % BLOCK_SIZE
+        plain = payload + bytes(range(1, pad_len + 1)) + bytes([pad_len])
+        iv = os.urandom(BLOCK_SIZE)
+        payload = iv + session.aes.encrypt_cbc(iv, plain)
+        body = struct.pack(
+            '<BBIIH', AUTH_TYPE_RMCPP,
+            payload_type | PAYLOAD_ENCRYPTED | PAYLOAD_AUTHENTICATED,
+            session.console_sid, 0, len(payload)) + payload
+        integrity_pad = (4 - (len(body) + 2) % 4) % 4
+        body += b'\xff' * integrity_pad + bytes([integrity_pad, 0x07])
+        auth_len = CIPHER_SUITES[self.cipher_suite][4]
+        return RMCP_HEADER + body + self._hmac(session.k1, body)[:auth_len]
+
+    def handle_packet(self, packet: bytes) -> Optional[bytes]:
+        """
+        Process one RMCP+ packet.
+        Return response packet, or None to stay silent.
+        """
+        if packet[:4] != RMCP_HEADER or packet[4] != AUTH_TYPE_RMCPP:
+            return None
+
+        payload_type = packet[5]
+        sid, _, length = struct.unpack_from('<IIH', packet, 6)
+        payload = packet[16:16 + length]
+        ptype = payload_type & 0x3f
+
+        if ptype == PAYLOAD_OPEN_SESSION_REQUEST:
+            return self._open_session(payload)
+        if ptype == PAYLOAD_RAKP1:
+            return self._rakp1(payload)
+        if ptype == PAYLOAD_RAKP3:
+            return self._rakp3(payload)
+        if ptype != PAYLOAD_IPMI:
+            return None
+
+        session = self._sessions.get(sid)
+        if session is None or not session.active:
+            return None
+
+        auth_len = CIPHER_SUITES[self.cipher_suite][4]
+        expected = self._hmac(session.k1, packet[4:-auth_len])[:auth_len]
+        if not hmac.compare_digest(expected, packet[-auth_len:]):
+            return None
+
+        assert session.aes is not None
+        plain = session.aes.decrypt_cbc(payload[:BLOCK_SIZE],
+                                        payload[BLOCK_SIZE:])
+        msg = plain[:-1 - plain[-1]]
+        netfn, lun = msg[1] >> 2, msg[1] & 0x03
+        seq, cmd, data = msg[4], msg[5], msg[6:-1]
+        self.requests.append((netfn, cmd, bytes(data)))
+
+        resp_data = self.handle_command(netfn, cmd, bytes(data), session)
+        header = bytes([0x81, ((netfn + 1) << 2) | lun])
+        body = bytes([0x20, seq, cmd]) + resp_data
+        response = (header + bytes([checksum(header)]) + body
+                    + bytes([checksum(body)]))
+        return self._wrap(PAYLOAD_IPMI, response, session)
+
+    def _open_session(self, payload: bytes) -> bytes:
+        console_sid = struct.unpack_from('<I', payload, 4)[0]
+        bmc_sid = struct.unpack('<I', os.urandom(4))[0] | 1
+        session = SimSession(bmc_sid, console_sid)
+        session.tag = payload[0]
+        self._sessions[bmc_sid] = session
+        response = (bytes([payload[0], 0, 4, 0])
+                    + struct.pack('<II', console_sid, bmc_sid)
+                    + payload[8:32])
+        return self._wrap(PAYLOAD_OPEN_SESSION_RESPONSE, response)
+
+    def _rakp1(self, payload: bytes) -> Optional[bytes]:
+        bmc_sid = struct.unpack_from('<I', payload, 4)[0]
+        session = self._sessions.get(bmc_sid)
+        if session is None:
+            return None
+
+        session.console_rand = payload[8:24]
+        role = payload[24]
+        username = payload[28:28 + payload[27]]
+        session.user_info = bytes([role, len(username)]) + username
+        if username.decode('utf-8') != self.username:
+            # Unauthorized name.
+            response = bytes([payload[0], 0x0d, 0, 0]) \
+                + struct.pack('<I', session.console_sid)
+            return self._wrap(PAYLOAD_RAKP2, response)
+
+        password = self.password.encode('utf-8')
+        auth = self._hmac(password,
+                          struct.pack('<II', session.console_sid, bmc_sid)
+                          + session.console_rand + session.bmc_rand
+                          + self.guid + session.user_info)
+        response = (bytes([payload[0], 0, 0, 0])
+                    + struct.pack('<I', session.console_sid)
+                    + session.bmc_rand + self.guid + auth)
+        return self._wrap(PAYLOAD_RAKP2, response)
+
+    def _rakp3(self, payload: bytes) -> Optional[bytes]:
+        bmc_sid = struct.unpack_from('<I', payload, 4)[0]
+        session = self._sessions.get(bmc_sid)
+        if session is None:
+            return None
+
+        password = self.password.encode('utf-8')
+        expected = self._hmac(password,
+                              session.bmc_rand
+                              + struct.pack('<I', session.console_sid)
+                              + session.user_info)
+        if not hmac.compare_digest(expected, payload[8:8 + len(expected)]):
+            response = bytes([payload[0], 0x0f, 0, 0]) \
+                + struct.pack('<I', session.console_sid)
+            return self._wrap(PAYLOAD_RAKP4, response)
+
+        sik = self._hmac(password, session.console_rand + session.bmc_rand
+                         + session.user_info)
+        session.k1 = self._hmac(sik, b'\x01' * len(sik))
+        k2 = self._hmac(sik, b'\x02' * len(sik))
+        session.aes = Aes128(k2[:BLOCK_SIZE])
+        icv_len = CIPHER_SUITES[self.cipher_suite][4]
+        icv = self._hmac(sik, session.console_rand
+                         + struct.pack('<I', bmc_sid) + self.guid)[:icv_len]
+        response = (bytes([payload[0], 0, 0, 0])
+                    + struct.pack('<I', session.console_sid) + icv)
+        packet = self._wrap(PAYLOAD_RAKP4, response)
+        session.active = True
+        self.sessions_opened += 1
+        return packet
+
+    def sensor_by_number(self, number: int) -> Optional[SimSensor]:
+        """
+        Find sensor by sensor number.
+        """
+        for sensor in self.sensors:
+            if sensor.number == number:
+                return sensor
+        return None
+
+    def sdr_records(self) -> List[bytes]:
+        """
+        Encode SDR repository.
+        """
+        return [sensor.sdr_record(index)
+                for index, sensor in enumerate(self.sensors)]
+
+    def handle_command(self, netfn: int, cmd: int, data: bytes,
+                       session: Optional[SimSession] = None) -> bytes:
+        """
+        Execute an IPMI command.
+        Return response data, starting with completion code.
+        """
+        # pylint: disable=too-many-return-statements
+        if netfn == 0x06 and cmd == 0x3b:
+            # Set Session Privilege Level.
+            return bytes([0x00, data[0]])
+        if netfn == 0x06 and cmd == 0x3c:
+            # Close Session.
+            if session is not None:
+                self._sessions.pop(session.bmc_sid, None)
+            return bytes([0x00])
+        if netfn == 0x0a and cmd == 0x20:
+            # Get SDR Repository Info.
+            return struct.pack('<BBHHIIB', 0x00, 0x51, len(self.sensors),
+                               0xffff, self.sdr_timestamp,
+                               self.sdr_timestamp, 0x02)
+        if netfn == 0x0a and cmd == 0x22:
+            # Reserve SDR Repository.
+            self._reservation = (self._reservation + 1) & 0xffff or 1
+            return bytes([0x00]) + struct.pack('<H', self._reservation)
+        if netfn == 0x0a and cmd == 0x23:
+            # Get SDR.
+            records = self.sdr_records()
+            record_id, offset, count = struct.unpack_from('<HBB', data, 2)
+            if record_id >= len(records):
+                return bytes([0xcb])
+            next_id = record_id + 1 if record_id + 1 < len(records) \
+                else 0xffff
+            record = records[record_id]
+            return (bytes([0x00]) + struct.pack('<H', next_id)
+                    + record[offset:offset + count])
+        if netfn == 0x04 and cmd == 0x2d:
+            # Get Sensor Reading.
+            sensor = self.sensor_by_number(data[0])
+            if sensor is None:
+                return bytes([0xcb])
+            return bytes([0x00, sensor.raw_value(), 0xc0, 0x00])
+        if netfn == 0x2c and cmd == 0x02 and data[:1] == b'\xdc':
+            # DCMI Get Power Reading: current, min, max and average watts,
+            # timestamp, period and measurement active state.
+            watts = max(0, min(0xffff, int(round(self.power))))
+            return bytes([0x00, 0xdc]) + struct.pack(
+                '<HHHHIIB', watts, watts, watts, watts, int(time.time()),
+                1000, 0x40)
+        if netfn == 0x30 and cmd == 0x30 and len(data) >= 2 \
+                and data[0] == 0x01:
+            # Dell OEM fan mode.
+            self.static_fans = data[1] == 0x00
+            return bytes([0x00])
+        if netfn == 0x30 and cmd == 0x30 and len(data) >= 3 \
+                and data[0] == 0x02:
+            # Dell OEM fan speed, of all fans or of one fan by index.
+            if data[1] == 0xff:
+                self.fan_speeds = {}
+            self.fan_speeds[data[1]] = data[2]
+            return bytes([0x00])
+
+        # Invalid command.
+        return bytes([0xc1])
+
+
+def main() -> None:
+    """
+    Run simulator in the foreground.
+    """
+    parser = argparse.ArgumentParser(
+        prog='bmc_simulator',
+        description='Local IPMI RMCP+ BMC simulator for PiFan testing.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Bind address (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=6230,
+                        help='UDP port (default: 6230)')
+    parser.add_argument('--username', default='root',
+                        help='Username (default: root)')
+    parser.add_argument('--password', default='calvin',
+                        help='Password (default: calvin)')
+    args = parser.parse_args()
+
+    simulator = BmcSimulator(args.host, args.port, args.username,
+                             args.password)
+    print(f'BMC simulator listening on {args.host}:{simulator.port}')
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Per-BMC limit of concurrent IPMI requests.
+Some iDRACs reject parallel sessions, so every backend talking to the same
+BMC shares one semaphore.
+"""
+
+import threading
+from typing import Dict
+
+# Concurrent requests per BMC unless configured.  Sequential by default: a
+# poll then reads all sensors from one `sdr elist` snapshot, and iDRACs
+# that reject parallel sessions work out of the box.
+DEFAULT_CONCURRENCY = 1
+
+_limits: Dict[str, threading.BoundedSemaphore] = {}
+_limits_lock = threading.Lock()
+
+
+def set_bmc_concurrency(host: str, limit: int) -> None:
+    """
+    Set max concurrent requests to host.  Requests already waiting keep
+    the previous limit.
+    """
+    if limit < 1:
+        raise ValueError(f'Invalid concurrency {limit}')
+    with _limits_lock:
+        _limits[host] = threading.BoundedSemaphore(limit)
+
+
+def bmc_semaphore(host: str) -> threading.BoundedSemaphore:
+    """
+    Semaphore limiting concurrent requests to host.
+    """
+    with _limits_lock:
+        semaphore = _limits.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(DEFAULT_CONCURRENCY)
+            _limits[host] = semaphore
+        return semaphore
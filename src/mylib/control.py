@@ -0,0 +1,76 @@
+"""
+Client of the daemon's control socket.
+Each connection sends one JSON request line and reads one JSON response
+line.  Only standard library modules are imported, so `pifan ctl` starts
+quickly.
+"""
+
+import json
+import os
+import socket
+from typing import Any, Dict, Optional
+from .util import default_state_path
+
+# Seconds to wait for the daemon to respond.
+DEFAULT_TIMEOUT = 5.0
+
+# Settings changeable at runtime, named like the command line options.
+SETTINGS = ['idealtemp', 'maxtemp', 'easing', 'dry-run']
+
+
+def default_socket_path() -> str:
+    """
+    Control socket of the daemon: pifan.sock in the state directory.
+    """
+    return os.path.join(default_state_path(), 'pifan.sock')
+
+
+class ControlClient:
+    """
+    Query and change settings of a running daemon.
+    """
+    path: str
+
+    timeout: float
+
+    def __init__(self, path: Optional[str] = None,
+                 timeout: float = DEFAULT_TIMEOUT) -> None:
+        self.path = path if path is not None else default_socket_path()
+        self.timeout = timeout
+
+    def request(self, command: str, **args: Any) -> Dict[str, Any]:
+        """
+        Send a command and return the daemon's response.
+        """
+        request = json.dumps({'command': command, **args}) + '\n'
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except (FileNotFoundError, ConnectionRefusedError) as error:
+                raise Exception(f'No daemon listening on {self.path}') \
+                    from error
+            sock.sendall(request.encode('utf-8'))
+            with sock.makefile('rb') as sock_file:
+                line = sock_file.readline()
+
+        if not line:
+            raise Exception('Daemon closed connection without a response')
+        response: Dict[str, Any] = json.loads(line)
+        if 'error' in response:
+            raise Exception(response['error'])
+        return response
+
+    def status(self, host: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Current status and settings of one host or, by default, all hosts.
+        """
+        return self.request('status', host=host)
+
+    def set(self, settings: Dict[str, Any],
+            host: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Change settings of one host or, by default, all hosts.
+        Return status of the changed hosts.
+        """
+        return self.request('set', host=host, settings=settings)
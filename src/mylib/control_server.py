@@ -0,0 +1,273 @@
+"""
+Control socket of the fleet daemon, serving `pifan ctl`.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from .control import SETTINGS
+from .easing import EASINGS
+from .pi_fan_controller import PiFanController
+
+if TYPE_CHECKING:
+    from .fleet import Fleet
+
+logger = logging.getLogger(__name__)
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+
+def _number(value: Optional[float]) -> Optional[float]:
+    """
+    JSON has no NaN; report unknown values as null.
+    """
+    if value is None or math.isnan(value):
+        return None
+    return value
+
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f'Invalid boolean "{value}"')
+
+
+class ControlServer:
+    """
+    Answer status queries and apply setting changes on a Unix socket.
+    Accepts connections on the fleet's event loop and executes requests on
+    a worker thread, since switching on dry run may wait for the BMC.
+    Settings are plain attributes read by the next poll, so changes take
+    effect without a restart.
+    """
+    fleet: 'Fleet'
+
+    path: str
+
+    server: Optional[asyncio.AbstractServer]
+
+    def __init__(self, fleet: 'Fleet', path: str) -> None:
+        self.fleet = fleet
+        self.path = path
+        self.server = None
+
+    async def start(self) -> None:
+        """
+        Listen on the socket.  Only the daemon's user may connect.
+        """
+        self._remove_stale_socket()
+        # Create the socket without group and other permissions, rather
+        # than restricting it after others could already connect.
+        umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(self._handle,
+                                                          path=self.path)
+        finally:
+            os.umask(umask)
+        logger.info('Listening for control requests on %s', self.path)
+
+    async def stop(self) -> None:
+        """
+        Stop listening and remove the socket.
+        """
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_stale_socket(self) -> None:
+        """
+        Remove a socket left by a daemon that didn't exit cleanly.
+        """
+        if not os.path.exists(self.path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)
+                return
+        raise Exception(f'Another daemon is listening on {self.path}')
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        try:
+            line = await reader.readline()
+            response = await asyncio.get_running_loop().run_in_executor(
+                None, self.handle_request, json.loads(line))
+        except Exception as error:  # pylint: disable=broad-except
+            response = {'error': str(error)}
+        writer.write(json.dumps(response).encode('utf-8') + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Execute a request.
+        Commands::
+
+            {"command": "status", "host": <name or null>}
+            {"command": "set", "host": <name or null>,
+             "settings": {<setting>: <value>, ...}}
+
+        """
+        command = request.get('command')
+        names = self._select(request.get('host'))
+        if command == 'status':
+            return {'hosts': {name: self.host_status(name)
+                              for name in names}}
+        if command == 'set':
+            settings = request.get('settings') or {}
+            for name in names:
+                self._check_settings(self.fleet.controllers[name], settings)
+            if _parse_bool(settings.get('dry-run', False)):
+                for name in names:
+                    self._enter_dry_run(name)
+            for name in names:
+                self._apply_settings(name, settings)
+            return {'hosts': {name: self.host_status(name)
+                              for name in names}}
+
+        raise Exception(f'Unknown command "{command}"')
+
+    def _select(self, host: Optional[str]) -> List[str]:
+        """
+        Names of hosts a request applies to.
+        """
+        if host is None:
+            return list(self.fleet.controllers)
+        if host not in self.fleet.controllers:
+            raise Exception(f'Unknown host "{host}"')
+        return [host]
+
+    @staticmethod
+    def _check_settings(controller: PiFanController,
+                        settings: Dict[str, Any]) -> None:
+        """
+        Validate settings before changing any host.
+        """
+        for key, value in settings.items():
+            if key not in SETTINGS:
+                raise Exception(f'Unknown setting "{key}", expected one of '
+                                f'{", ".join(SETTINGS)}')
+            if key in ('idealtemp', 'maxtemp'):
+                float(value)
+            elif key == 'easing' and value not in EASINGS:
+                raise Exception(f'Unrecognized easing type "{value}"')
+            elif key == 'dry-run':
+                _parse_bool(value)
+
+        ideal_temp = float(settings.get('idealtemp', controller.ideal_temp))
+        max_temp = float(settings.get('maxtemp', controller.max_temp))
+        if ideal_temp >= max_temp:
+            raise Exception(f'idealtemp {ideal_temp} must be below maxtemp '
+                            f'{max_temp}')
+
+    def _enter_dry_run(self, name: str) -> None:
+        """
+        Switch a host to dry run.  A host in static fan mode is given back
+        to the BMC first: polls in dry run neither write fan speeds nor
+        escalate, so static fans would stay at their last speed however
+        hot the CPUs get.
+        """
+        controller = self.fleet.controllers[name]
+        if controller.dry_run:
+            return
+        # Stop writes of later polls before restoring dynamic mode.
+        controller.dry_run = True
+        state = self.fleet.states.get(name)
+        if state is None or not state.static_fans:
+            return
+        if not controller.release_fans(state, force=True):
+            controller.dry_run = False
+            raise Exception(f'{name}: failed to restore dynamic fan mode, '
+                            'dry-run not enabled')
+
+    def _apply_settings(self, name: str, settings: Dict[str, Any]) -> None:
+        controller = self.fleet.controllers[name]
+        if 'idealtemp' in settings:
+            controller.ideal_temp = float(settings['idealtemp'])
+        if 'maxtemp' in settings:
+            controller.max_temp = float(settings['maxtemp'])
+        if 'easing' in settings:
+            controller.easing = settings['easing']
+        if 'dry-run' in settings:
+            controller.dry_run = _parse_bool(settings['dry-run'])
+        logger.info('%s: changed settings: %s', name,
+                    ', '.join(f'{key}={value}'
+                              for key, value in settings.items()))
+
+    def host_status(self, name: str) -> Dict[str, Any]:
+        """
+        Settings, last poll and schedule counters of a host.
+        """
+        controller = self.fleet.controllers[name]
+        state = self.fleet.states.get(name)
+        status: Dict[str, Any] = {
+            'host': controller.name,
+            'idealtemp': controller.ideal_temp,
+            'maxtemp': controller.max_temp,
+            'easing': controller.easing,
+            'dry-run': controller.dry_run,
+        }
+        if state is not None:
+            status['interval'] = controller.next_interval(state)
+            status['cpu_temps'] = {key: cpu.temp for key, cpu
+                                   in (state.cpu_map or {}).items()}
+            status['fan_rpms'] = {key: fan.rpm for key, fan
+                                  in (state.fan_map or {}).items()}
+            if controller.zones:
+                status['zones'] = {
+                    zone.name: {
+                        'fans': zone.fans,
+                        'cpus': zone.cpus,
+                        'agg_temp': _number(state.zone_state(zone.name)
+                                            .aggregator.value()),
+                        'applied_speed': state.zone_state(zone.name)
+                        .applied_speed,
+                    } for zone in controller.zones}
+
+        record = controller.last_record
+        if record is not None:
+            status['last_poll'] = {
+                'time': record.time,
+                'cpu_temp': _number(record.cpu_temp),
+                'agg_temp': _number(record.agg_temp),
+                'suggested_speed': record.suggested_speed
+                if record.suggested_speed >= 0 else None,
+                'applied_speed': record.applied_speed
+                if record.applied_speed >= 0 else None,
+                'fan_percent': _number(record.fan_percent),
+                'flags': record.flags,
+            }
+
+        scheduler = self.fleet.schedulers.get(name)
+        if scheduler is not None:
+            stats = scheduler.stats
+            status['schedule'] = {
+                'polls': stats.polls,
+                'overruns': stats.overruns,
+                'skipped': stats.skipped,
+                'mean_jitter': stats.mean_jitter(),
+                'max_jitter': stats.max_jitter,
+            }
+        return status
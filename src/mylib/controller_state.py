@@ -1,75 +1,134 @@
 """
 Runtime state of PiFanController.
 """
-from datetime import datetime, timedelta
-from functools import reduce
-import pickle
-from typing import Dict, List
+import time
+from typing import Dict, Optional
+from .aggregator import AggregateSpec, TempAggregator
 from .cpu_sensor import CpuSensor
 from .fan_sensor import FanSensor
+from .fan_zone import ZoneState
+from .multi_input import InputState
+from .pid import PidState
+from .state_format import decode_legacy_state, decode_state, \
+    encode_state, is_legacy_pickle
 
 
 class ControllerState:
     """
     Runtime state of PiFanController.
     """
-    sample_size: int
-
-    samples: List[float]
+    # CPU temp aggregation window.
+    aggregator: TempAggregator
 
     cpu_map: Dict[str, CpuSensor]
 
     fan_map: Dict[str, FanSensor]
 
-    # Epoch seconds.
-    last_sample_time: float
+    # Inlet and exhaust temperature sensors by name.
+    air_map: Dict[str, CpuSensor]
+
+    # True if static fan speed mode has been enabled on the BMC.
+    static_fans: bool
+
+    # Last fan speed percent written to the BMC.
+    applied_speed: Optional[int]
+
+    # Epoch seconds of last fan speed write.
+    applied_time: Optional[float]
+
+    # Number of fan speed writes skipped by FanActuator.
+    suppressed_writes: int
+
+    # Integrator and history of PID easing.
+    pid: PidState
+
+    # Seconds until next poll chosen by AdaptiveInterval.
+    poll_interval: Optional[float]
+
+    # Aggregate temperature and epoch seconds of last poll, to compute the
+    # temperature trend.
+    last_poll_temp: Optional[float]
+
+    last_poll_time: Optional[float]
+
+    # State of each fan zone by name.
+    zones: Dict[str, ZoneState]
+
+    # Power readings of multi-input control.
+    inputs: InputState
+
+    # Consecutive failed polls.
+    failed_polls: int
+
+    # Epoch seconds the SDR cache was last checked against the BMC.
+    sdr_check_time: Optional[float]
 
     def __init__(self):
-        self.sample_size = 3
-        self.samples = []
-        self.last_sample_time = None
+        self.aggregator = TempAggregator(AggregateSpec())
         self.cpu_map = None
         self.fan_map = None
+        self.air_map = None
+        self.static_fans = False
+        self.applied_speed = None
+        self.applied_time = None
+        self.suppressed_writes = 0
+        self.pid = PidState()
+        self.poll_interval = None
+        self.last_poll_temp = None
+        self.last_poll_time = None
+        self.zones = {}
+        self.inputs = InputState()
+        self.failed_polls = 0
+        self.sdr_check_time = None
+
+    def add_aggregate_temp(self, value: float,
+                           now: Optional[float] = None) -> float:
+        """
+        Add a CPU temp value to aggregate.
+        Return new aggregate value.
+        """
+        if now is None:
+            now = time.time()
+        return self.aggregator.add(value, now)
+
+    def set_aggregate_spec(self, spec: AggregateSpec) -> None:
+        """
+        Set aggregation settings, keeping collected samples.
+        """
+        old = self.aggregator
+        self.aggregator = TempAggregator(spec)
+        self.aggregator.restore(old.samples(), old.ewma, old.start_time)
+        for zone in self.zones.values():
+            zone.set_aggregate_spec(spec)
 
-    def add_aggregate_temp(self, value: float) -> float:
+    def zone_state(self, name: str) -> ZoneState:
         """
-        Add a CPU temp value to aggregate average.
-        Return new average.
+        Get state of a fan zone, created on first use.
         """
-        # Check if aggregate samples are too old.
-        if self.last_sample_time is not None:
-            last_sample_time2 = datetime.fromtimestamp(self.last_sample_time)
-            now = datetime.now()
-            threshold_time = now - timedelta(hours=1)
-            if last_sample_time2 < threshold_time:
-                # Too old, clear samples.
-                self.samples = []
-
-        self.samples.append(value)
-        self.samples = self.samples[-self.sample_size:]
-        agg_value = reduce(
-            lambda a, b: a + b,
-            self.samples
-        ) / len(self.samples)
-        self.last_sample_time = datetime.now().timestamp()
-        return agg_value
+        zone = self.zones.get(name)
+        if zone is None:
+            zone = ZoneState(self.aggregator.spec)
+            self.zones[name] = zone
+        return zone
 
     def set_sample_size(self, sample_size: int) -> None:
         """
-        Set sample size.
+        Set sample size of a mean aggregate.
         """
-        self.sample_size = sample_size
-        self.samples = self.samples[-sample_size:]
+        self.set_aggregate_spec(AggregateSpec('mean', sample_size))
 
     def restore(self, serialized: bytes) -> None:
         """
         Restore state from serialized data previously created by dump().
+        Legacy pickle state is migrated.
         """
-        loaded_state = pickle.loads(serialized)
-        self.__dict__.update(loaded_state.__dict__)
+        if is_legacy_pickle(serialized):
+            decode_legacy_state(serialized, self)
+        else:
+            decode_state(serialized, self)
 
     def dump(self) -> bytes:
         """
         Serialize state.
         """
-        return pickle.dumps(self)
+        return encode_state(self)
@@ -2,11 +2,16 @@
 CPU sensor state.
 """
 
+from typing import Any, Dict
+
 
 class CpuSensor:
     """
     CPU sensor state.
+    Slotted, since every cron run loads all sensors from the state file.
     """
+    __slots__ = ('name', 'id', 'temp')
+
     name: str
 
     id: int
@@ -18,6 +23,12 @@ class CpuSensor:
         self.id = 0
         self.temp = 0.0
 
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # Legacy pickle state files hold the attributes of unslotted
+        # sensors.
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def __str__(self) -> str:
         return(f'CpuSensor: name={self.name}, id={self.id:#x}, '
                f'temp={self.temp}C')
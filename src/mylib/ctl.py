@@ -0,0 +1,103 @@
+"""
+Command line of `pifan ctl`.
+Only the socket client is imported, so it answers in milliseconds rather
+than paying for importing the controller.
+"""
+
+import argparse
+from datetime import datetime
+import json
+import sys
+from .control import SETTINGS, ControlClient, default_socket_path
+
+
+def parse_ctl_args(argv):
+    """
+    Parse command line arguments of ctl command.
+    Return arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='pifan ctl',
+        description='Query or change settings of a running daemon.')
+
+    parser.add_argument('--socket', metavar='PATH',
+                        default=default_socket_path(),
+                        help='Control socket of the daemon (default: '
+                             '$TMP/pifan.sock)')
+    parser.add_argument('--host', metavar='NAME', default=None,
+                        help='Fleet host to query or change (default: all)')
+    parser.add_argument('--json', default=False, action='store_true',
+                        help='Print daemon response as JSON')
+    parser.add_argument('action', metavar='ACTION', choices=['status', 'set'],
+                        help='status | set')
+    parser.add_argument('settings', metavar='KEY=VALUE', nargs='*',
+                        help='Settings to change: '
+                             f'{" | ".join(SETTINGS)}')
+
+    args = parser.parse_args(argv)
+    if args.action == 'set' and not args.settings:
+        parser.error('set requires at least one KEY=VALUE')
+    if args.action == 'status' and args.settings:
+        parser.error('status takes no settings')
+    for setting in args.settings:
+        if '=' not in setting:
+            parser.error(f'invalid setting "{setting}", expected KEY=VALUE')
+    return args
+
+
+def format_host_status(name, status):
+    """
+    Format host status of a ctl response for display.
+    """
+    lines = [f'{name} ({status["host"]}): idealtemp={status["idealtemp"]}C '
+             f'maxtemp={status["maxtemp"]}C easing={status["easing"]} '
+             f'dry-run={"yes" if status["dry-run"] else "no"}']
+    poll = status.get('last_poll')
+    if poll is not None:
+        poll_time = datetime.fromtimestamp(poll['time']) \
+            .strftime('%Y-%m-%d %H:%M:%S')
+        values = [f'cpu={poll["cpu_temp"]}C']
+        if poll['agg_temp'] is not None:
+            values.append(f'agg={poll["agg_temp"]:0.1f}C')
+        if poll['applied_speed'] is not None:
+            values.append(f'applied={poll["applied_speed"]}%')
+        if poll['fan_percent'] is not None:
+            values.append(f'fan={poll["fan_percent"]:0.1f}%')
+        lines.append(f'  last poll {poll_time}: {" ".join(values)}')
+    for zone_name, zone in status.get('zones', {}).items():
+        values = [f'fans={",".join(str(fan) for fan in zone["fans"])}',
+                  f'cpus={",".join(str(cpu) for cpu in zone["cpus"])}']
+        if zone['agg_temp'] is not None:
+            values.append(f'agg={zone["agg_temp"]:0.1f}C')
+        if zone['applied_speed'] is not None:
+            values.append(f'applied={zone["applied_speed"]}%')
+        lines.append(f'  zone {zone_name}: {" ".join(values)}')
+    if 'interval' in status:
+        lines.append(f'  next poll in {status["interval"]:g}s')
+    return '\n'.join(lines)
+
+
+def ctl_main(argv):
+    """
+    Ctl command entrypoint.
+    Return exit status.
+    """
+    args = parse_ctl_args(argv)
+    client = ControlClient(args.socket)
+    try:
+        if args.action == 'set':
+            settings = dict(setting.split('=', 1)
+                            for setting in args.settings)
+            response = client.set(settings, args.host)
+        else:
+            response = client.status(args.host)
+    except Exception as error:  # pylint: disable=broad-except
+        print(f'pifan ctl: {error}', file=sys.stderr)
+        return 1
+
+    if args.json:
+        print(json.dumps(response, indent=2))
+    else:
+        for name, status in response['hosts'].items():
+            print(format_host_status(name, status))
+    return 0
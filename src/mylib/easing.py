@@ -0,0 +1,33 @@
+"""
+Easing curves: fan speed as a function of CPU temperature above the ideal
+temperature.
+"""
+
+
+def ease_linear(offset, temp_range, max_fan):
+    """
+    Fan speed of linear easing at offset degrees above ideal temperature,
+    before limiting and truncation.
+    Also accepts numpy arrays.
+    """
+    return max_fan * offset / temp_range
+
+
+def ease_parabolic(offset, temp_range, max_fan):
+    """
+    Fan speed of parabolic easing at offset degrees above ideal
+    temperature, before limiting and truncation.
+    Also accepts numpy arrays.
+    """
+    # https://www.futurelearn.com/info/courses/maths-linear-quadratic/0/steps/12130
+    # y = max_temp/(temp_range^2)*x^2
+    return max_fan / (temp_range * temp_range) * (offset * offset)
+
+
+# Easing functions by name, for batch evaluation of candidate settings.
+EASING_CURVES = {
+    'linear': ease_linear,
+    'parabolic': ease_parabolic,
+}
+
+EASINGS = ['linear', 'parabolic', 'pid']
@@ -0,0 +1,121 @@
+"""
+Write-coalescing fan speed actuator.
+"""
+
+import logging
+import time
+from typing import Callable, Optional, Union
+from .controller_state import ControllerState
+from .fan_zone import FanZone, ZoneState
+from .ipmi_fan import IpmiFan
+from .tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+class FanActuator:
+    """
+    Apply suggested fan speeds to the BMC, skipping redundant writes.
+    Tracks static fan mode and last applied speed in ControllerState, and
+    last applied speed of each fan zone in its ZoneState.
+    """
+    ipmi_fan: IpmiFan
+
+    # Skip writes changing speed by this many percent or less.
+    deadband: int
+
+    # Max fan speed decrease per write, in percent.  0=unlimited.
+    max_step_down: int
+
+    # Re-send static mode and speed after this many seconds, in case the
+    # BMC reverted them.  0=never.
+    reassert_interval: float
+
+    max_fan: int
+
+    # Source of epoch seconds.  Replaced by the thermal simulator.
+    clock: Callable[[], float]
+
+    def __init__(self, ipmi_fan: IpmiFan) -> None:
+        self.ipmi_fan = ipmi_fan
+        self.deadband = 2
+        self.max_step_down = 10
+        self.reassert_interval = 300.0
+        self.max_fan = 100
+        self.clock = time.time
+
+    def target_speed(self, state: Union[ControllerState, ZoneState],
+                     speed: int) -> int:
+        """
+        Limit downward step from last applied speed.
+        """
+        last = state.applied_speed
+        if last is not None and self.max_step_down > 0 \
+                and speed < last - self.max_step_down:
+            return last - self.max_step_down
+        return speed
+
+    @traced('apply_fan_speed')
+    def apply(self, state: ControllerState, speed: int,
+              zone: Optional[FanZone] = None) -> int:
+        """
+        Set fan speed of all fans, or of the fans of zone, unless they are
+        already at a speed within the deadband.
+        Return speed now in effect.
+        """
+        applied: Union[ControllerState, ZoneState] = state
+        if zone is not None:
+            applied = state.zone_state(zone.name)
+        speed = self.target_speed(applied, speed)
+        last = applied.applied_speed
+        now = self.clock()
+
+        reassert = (
+            not state.static_fans
+            or last is None
+            or applied.applied_time is None
+            or 0 < self.reassert_interval <= now - applied.applied_time)
+
+        if not reassert:
+            assert last is not None
+            # Always honor a jump to max speed.
+            to_max = speed >= self.max_fan > last
+            if abs(speed - last) <= self.deadband and not to_max:
+                state.suppressed_writes += 1
+                logger.debug('Fan speed %d%% within %d%% deadband of %d%%, '
+                             'skipped write (%d suppressed)', speed,
+                             self.deadband, last, state.suppressed_writes)
+                return last
+
+        if zone is None:
+            self.ipmi_fan.set_fan_speed(speed, set_static=reassert)
+            logger.debug('Applied fan speed: %d%%', speed)
+        else:
+            self.ipmi_fan.set_fan_speeds(zone.fan_indexes(), speed,
+                                         set_static=reassert)
+            logger.debug('Applied zone %s fan speed: %d%%', zone.name, speed)
+        state.static_fans = True
+        applied.applied_speed = speed
+        applied.applied_time = now
+        return speed
+
+    @traced('restore_dynamic_fans')
+    def restore_dynamic(self, state: ControllerState) -> None:
+        """
+        Give fan control back to the BMC.
+        """
+        self.ipmi_fan.set_dynamic_fans()
+        self.invalidate(state)
+        logger.debug('Restored dynamic fan mode')
+
+    def invalidate(self, state: ControllerState) -> None:
+        """
+        Forget applied settings so the next apply() writes unconditionally,
+        e.g. after dynamic fan mode was restored.
+        """
+        state.static_fans = False
+        state.applied_speed = None
+        state.applied_time = None
+        for zone in state.zones.values():
+            zone.applied_speed = None
+            zone.applied_time = None
@@ -2,11 +2,16 @@
 Fan sensor state.
 """
 
+from typing import Any, Dict
+
 
 class FanSensor:
     """
     Fan sensor state.
+    Slotted, since every cron run loads all sensors from the state file.
     """
+    __slots__ = ('name', 'id', 'rpm', 'max')
+
     name: str
 
     id: int
@@ -21,6 +26,12 @@ class FanSensor:
         self.rpm = 0
         self.max = 0
 
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # Legacy pickle state files hold the attributes of unslotted
+        # sensors.
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def __str__(self) -> str:
         return(f'FanSensor: name={self.name}, id={self.id:#x}, '
                f'rpm={self.rpm}, max={self.max}, '
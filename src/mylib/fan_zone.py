@@ -0,0 +1,143 @@
+"""
+Fan zones: groups of fans driven by the temperature of their own CPUs.
+"""
+
+from typing import List, Optional
+from .aggregator import AggregateSpec, TempAggregator
+from .easing import EASINGS
+from .pid import PidState
+
+
+class FanZone:
+    """
+    Fans cooled for a set of CPUs, with an optional curve of their own.
+
+    Spec format::
+
+        NAME:FANS:CPUS[:ideal=DEG_C][:max=DEG_C][:easing=TYPE]
+
+    FANS are fan numbers, 1 for Fan1, and CPUS are CPU numbers in order of
+    temperature sensor ID, both comma separated.  Curve settings default to
+    the controller's.
+    """
+    name: str
+
+    # Fan numbers, 1-based.
+    fans: List[int]
+
+    # CPU numbers, 1-based.
+    cpus: List[int]
+
+    ideal_temp: Optional[float]
+
+    max_temp: Optional[float]
+
+    easing: Optional[str]
+
+    def __init__(self, name: str, fans: List[int], cpus: List[int]) -> None:
+        self.name = name
+        self.fans = fans
+        self.cpus = cpus
+        self.ideal_temp = None
+        self.max_temp = None
+        self.easing = None
+
+    def __str__(self) -> str:
+        return (f'FanZone: name={self.name}, fans={self.fans}, '
+                f'cpus={self.cpus}, ideal_temp={self.ideal_temp}, '
+                f'max_temp={self.max_temp}, easing={self.easing}')
+
+    def fan_indexes(self) -> List[int]:
+        """
+        Fan indexes of the per-fan raw speed command.
+        """
+        return [fan - 1 for fan in self.fans]
+
+
+class ZoneState:
+    """
+    Persistent state of a fan zone, kept in ControllerState.
+    """
+    aggregator: TempAggregator
+
+    # Last fan speed percent written to the zone's fans.
+    applied_speed: Optional[int]
+
+    # Epoch seconds of last fan speed write.
+    applied_time: Optional[float]
+
+    pid: PidState
+
+    def __init__(self, spec: AggregateSpec) -> None:
+        self.aggregator = TempAggregator(spec)
+        self.applied_speed = None
+        self.applied_time = None
+        self.pid = PidState()
+
+    def set_aggregate_spec(self, spec: AggregateSpec) -> None:
+        """
+        Set aggregation settings, keeping collected samples.
+        """
+        old = self.aggregator
+        self.aggregator = TempAggregator(spec)
+        self.aggregator.restore(old.samples(), old.ewma, old.start_time)
+
+
+def _parse_numbers(text: str, what: str) -> List[int]:
+    try:
+        numbers = [int(value) for value in text.split(',')]
+    except ValueError as error:
+        raise ValueError(f'Invalid {what} list "{text}"') from error
+    if not numbers or min(numbers) < 1:
+        raise ValueError(f'Invalid {what} list "{text}"')
+    return numbers
+
+
+def parse_zone_spec(text: str) -> FanZone:
+    """
+    Parse fan zone spec string.  See FanZone.
+    """
+    parts = text.strip().split(':')
+    if len(parts) < 3 or not parts[0]:
+        raise ValueError(f'Invalid fan zone "{text}", expected '
+                         'NAME:FANS:CPUS')
+    if len(parts[0].encode('utf-8')) > 16:
+        raise ValueError(f'Fan zone name "{parts[0]}" is longer than 16 '
+                         'bytes')
+    zone = FanZone(parts[0], _parse_numbers(parts[1], 'fan'),
+                   _parse_numbers(parts[2], 'CPU'))
+
+    for part in parts[3:]:
+        key, _, value = part.partition('=')
+        if key == 'ideal':
+            zone.ideal_temp = float(value)
+        elif key == 'max':
+            zone.max_temp = float(value)
+        elif key == 'easing':
+            if value not in EASINGS:
+                raise ValueError(f'Unrecognized easing type "{value}"')
+            zone.easing = value
+        else:
+            raise ValueError(f'Unknown fan zone setting "{part}"')
+
+    if zone.ideal_temp is not None and zone.max_temp is not None \
+            and zone.ideal_temp >= zone.max_temp:
+        raise ValueError(f'Zone {zone.name} ideal temp must be below max '
+                         'temp')
+    return zone
+
+
+def check_zones(zones: List[FanZone]) -> None:
+    """
+    Check that zone names are unique and no fan is in two zones.
+    """
+    names = set()
+    fans = set()
+    for zone in zones:
+        if zone.name in names:
+            raise ValueError(f'Duplicate fan zone "{zone.name}"')
+        names.add(zone.name)
+        for fan in zone.fans:
+            if fan in fans:
+                raise ValueError(f'Fan {fan} is in more than one zone')
+            fans.add(fan)
@@ -0,0 +1,448 @@
+"""
+Manage a fleet of servers from one process.
+Each host runs its own control loop on a shared asyncio event loop.
+"""
+
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import configparser
+import logging
+from typing import Dict, List, Optional, Tuple
+from .adaptive_interval import AdaptiveInterval, parse_interval_range
+from .aggregator import AggregateSpec, parse_aggregate_spec
+from .bmc_host import BmcHost
+from .concurrency import DEFAULT_CONCURRENCY
+from .control_server import ControlServer
+from .controller_state import ControllerState
+from .easing import EASINGS
+from .fan_zone import FanZone, check_zones, parse_zone_spec
+from .ipmi_backend import BACKENDS
+from .ipmi_cpu import IpmiCpu
+from .ipmi_errors import IpmiError
+from .ipmi_fan import IpmiFan
+from .multi_input import InputSpec, MultiInput, parse_input_spec
+from .pi_fan_controller import PiFanController
+from .pid import parse_pid_gains
+from .retry import DEFAULT_RETRIES, DEFAULT_TIMEOUT, RetryPolicy, \
+    set_bmc_retry_policy
+from .scheduler import OVERRUN_POLICIES, PollScheduler
+from .watchdog import Watchdog, WatchdogHost, watchdog_timeout
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait on exit for fan control to be given back to the BMCs.
+RELEASE_TIMEOUT = 15.0
+
+
+class HostConfig(BmcHost):
+    """
+    Per-host settings from a fleet config file.
+    """
+    interval: float
+
+    # Adaptive poll interval range in seconds, or None for fixed interval.
+    adaptive_interval: Optional[Tuple[float, float]]
+
+    ideal_temp: float
+
+    max_temp: float
+
+    easing: str
+
+    # PID easing gains and slew rate.
+    pid_gains: Tuple[float, float, float]
+
+    pid_slew: float
+
+    sample_size: int
+
+    aggregate: Optional[AggregateSpec]
+
+    dry_run: bool
+
+    deadband: int
+
+    max_step_down: int
+
+    reassert: float
+
+    sdr_cache: bool
+
+    history_size: int
+
+    # Seconds to wait for a poll before giving up on it for this cycle.
+    poll_timeout: float
+
+    # Overrun policy of the poll scheduler: skip | catch-up.
+    overrun: str
+
+    # Max concurrent IPMI requests to the BMC, 1=sequential.
+    concurrency: int
+
+    # Seconds an ipmitool request attempt may take.
+    ipmi_timeout: float
+
+    # Retries of ipmitool requests failing with a timeout or session error.
+    ipmi_retries: int
+
+    # Fan zones.  All fans follow the hottest CPU if empty.
+    zones: List[FanZone]
+
+    # Power and air temp inputs, or None for CPU temp only.
+    inputs: Optional[InputSpec]
+
+    # Restore dynamic fan mode after this many consecutive failed polls,
+    # 0=never.
+    failsafe: int
+
+    # Seconds without a poll before the watchdog restores dynamic fan mode,
+    # 0=disabled.
+    watchdog: float
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name, name)
+        self.interval = 10.0
+        self.adaptive_interval = None
+        self.ideal_temp = 40.0
+        self.max_temp = 75.0
+        self.easing = 'parabolic'
+        self.pid_gains = (4.0, 0.02, 10.0)
+        self.pid_slew = 1.0
+        self.sample_size = 3
+        self.aggregate = None
+        self.dry_run = False
+        self.deadband = 2
+        self.max_step_down = 10
+        self.reassert = 300.0
+        self.sdr_cache = True
+        self.history_size = 0
+        self.poll_timeout = 60.0
+        self.overrun = 'skip'
+        self.concurrency = DEFAULT_CONCURRENCY
+        self.ipmi_timeout = DEFAULT_TIMEOUT
+        self.ipmi_retries = DEFAULT_RETRIES
+        self.zones = []
+        self.inputs = None
+        self.failsafe = 3
+        self.watchdog = 0.0
+
+    def __str__(self) -> str:
+        return (f'HostConfig: name={self.name}, host={self.host}, '
+                f'ipmi={self.ipmi}, interval={self.interval}s, '
+                f'idealtemp={self.ideal_temp}C, maxtemp={self.max_temp}C, '
+                f'easing={self.easing}, sample_size={self.sample_size}, '
+                f'dry_run={self.dry_run}')
+
+    def create_controller(self) -> PiFanController:
+        """
+        Create controller for this host.
+        """
+        set_bmc_retry_policy(self.host, RetryPolicy(self.ipmi_timeout,
+                                                    self.ipmi_retries))
+        ipmi_fan = IpmiFan(self.host, self.username, self.password,
+                           self.ipmi, self.port)
+        ipmi_cpu = IpmiCpu(self.host, self.username, self.password,
+                           self.ipmi, self.port)
+
+        controller = PiFanController(self.host, ipmi_fan, ipmi_cpu)
+        controller.ideal_temp = self.ideal_temp
+        controller.max_temp = self.max_temp
+        controller.easing = self.easing
+        controller.interval = self.interval
+        if self.adaptive_interval is not None:
+            controller.adaptive = AdaptiveInterval(*self.adaptive_interval,
+                                                   self.interval)
+        controller.pid.kp, controller.pid.ki, controller.pid.kd = \
+            self.pid_gains
+        controller.pid.slew_rate = self.pid_slew
+        controller.dry_run = self.dry_run
+        controller.sample_size = self.sample_size
+        controller.aggregate = self.aggregate
+        controller.use_sdr_cache = self.sdr_cache
+        controller.history_size = self.history_size
+        controller.concurrency = self.concurrency
+        controller.zones = self.zones
+        if self.inputs is not None:
+            controller.inputs = MultiInput(self.inputs)
+        controller.failsafe_polls = self.failsafe
+        controller.actuator.deadband = self.deadband
+        controller.actuator.max_step_down = self.max_step_down
+        controller.actuator.reassert_interval = self.reassert
+        return controller
+
+
+def load_fleet_config(filename: str) -> List[HostConfig]:
+    """
+    Load fleet config file.
+    INI format with one section per host.  Settings in [DEFAULT] apply to
+    every host.  Keys match the command line options::
+
+        [DEFAULT]
+        username = root
+        password = calvin
+        interval = 10
+
+        [r720-a]
+        host = 192.168.1.20
+        maxtemp = 70
+        zones = cpu1:1,2,3:1
+                cpu2:4,5,6:2:max=70
+
+    """
+    parser = configparser.ConfigParser()
+    with open(filename, 'r', encoding='utf-8') as config_file:
+        parser.read_file(config_file)
+
+    hosts: List[HostConfig] = []
+    for name in parser.sections():
+        section = parser[name]
+        config = HostConfig(name)
+        config.host = section.get('host', name)
+        config.username = section.get('username', '')
+        config.password = section.get('password', '')
+        config.ipmi = section.get('ipmi', config.ipmi)
+        if config.ipmi not in BACKENDS:
+            raise Exception(f'Invalid ipmi backend "{config.ipmi}" '
+                            f'for host "{name}"')
+        config.port = section.getint('port', config.port)
+        config.interval = section.getfloat('interval', config.interval)
+        if config.interval <= 0:
+            raise Exception(f'Invalid interval {config.interval:g} '
+                            f'for host "{name}"')
+        if 'adaptive-interval' in section:
+            config.adaptive_interval = parse_interval_range(
+                section['adaptive-interval'])
+        config.ideal_temp = section.getfloat('idealtemp', config.ideal_temp)
+        config.max_temp = section.getfloat('maxtemp', config.max_temp)
+        config.easing = section.get('easing', config.easing)
+        if config.easing not in EASINGS:
+            raise Exception(f'Invalid easing "{config.easing}" '
+                            f'for host "{name}"')
+        if 'pid-gains' in section:
+            config.pid_gains = parse_pid_gains(section['pid-gains'])
+        config.pid_slew = section.getfloat('pid-slew', config.pid_slew)
+        config.sample_size = section.getint('sample-size',
+                                            config.sample_size)
+        if 'aggregate' in section:
+            config.aggregate = parse_aggregate_spec(section['aggregate'])
+        config.dry_run = section.getboolean('dry-run', config.dry_run)
+        config.deadband = section.getint('deadband', config.deadband)
+        config.max_step_down = section.getint('max-step-down',
+                                              config.max_step_down)
+        config.reassert = section.getfloat('reassert', config.reassert)
+        config.sdr_cache = section.getboolean('sdr-cache', config.sdr_cache)
+        config.history_size = section.getint('history-size',
+                                             config.history_size)
+        config.poll_timeout = section.getfloat('poll-timeout',
+                                               config.poll_timeout)
+        config.overrun = section.get('overrun', config.overrun)
+        if config.overrun not in OVERRUN_POLICIES:
+            raise Exception(f'Invalid overrun policy "{config.overrun}" '
+                            f'for host "{name}"')
+        config.concurrency = section.getint('concurrency',
+                                            config.concurrency)
+        if config.concurrency < 1:
+            raise Exception(f'Invalid concurrency {config.concurrency} '
+                            f'for host "{name}"')
+        config.ipmi_timeout = section.getfloat('ipmi-timeout',
+                                               config.ipmi_timeout)
+        config.ipmi_retries = section.getint('ipmi-retries',
+                                             config.ipmi_retries)
+        if config.ipmi_timeout <= 0 or config.ipmi_retries < 0:
+            raise Exception(f'Invalid ipmi-timeout or ipmi-retries for host '
+                            f'"{name}"')
+        config.failsafe = section.getint('failsafe', config.failsafe)
+        max_interval = config.adaptive_interval[1] \
+            if config.adaptive_interval is not None else config.interval
+        try:
+            config.watchdog = watchdog_timeout(
+                section.getfloat('watchdog', None), max_interval)
+        except ValueError as error:
+            raise Exception(f'{error} for host "{name}"') from error
+        if 'inputs' in section:
+            config.inputs = parse_input_spec(section['inputs'])
+        if 'zones' in section:
+            try:
+                config.zones = [parse_zone_spec(spec)
+                                for spec in section['zones'].split()]
+                check_zones(config.zones)
+            except ValueError as error:
+                raise Exception(f'Invalid fan zones for host "{name}": '
+                                f'{error}') from error
+
+        if not config.username:
+            raise Exception(f'Missing username for host "{name}"')
+        hosts.append(config)
+
+    if not hosts:
+        raise Exception(f'No hosts defined in {filename}')
+
+    return hosts
+
+
+class Fleet:
+    """
+    Run an independent control loop per host, concurrently.
+    Blocking IPMI calls of each host run on a worker thread so a slow or
+    hung BMC never delays the other hosts.
+    """
+    hosts: List[HostConfig]
+
+    controllers: Dict[str, PiFanController]
+
+    states: Dict[str, ControllerState]
+
+    # Poll schedule and its jitter and overrun counters per host.
+    schedulers: Dict[str, PollScheduler]
+
+    # Unix socket serving `pifan ctl`, or None if disabled.
+    control_socket: Optional[str]
+
+    # Restores dynamic fan mode of hosts that stop polling.
+    watchdog: Optional[Watchdog]
+
+    def __init__(self, hosts: List[HostConfig],
+                 control_socket: Optional[str] = None) -> None:
+        self.hosts = hosts
+        self.controllers = {}
+        self.states = {}
+        self.schedulers = {}
+        self.control_socket = control_socket
+        self.watchdog = None
+        # Two workers per host: a hung poll may hold one while state I/O
+        # continues on the other.
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(hosts),
+                                           thread_name_prefix='pifan')
+
+    def launch(self) -> None:
+        """
+        Run all host control loops until interrupted, then give fan
+        control back to the BMCs.
+        """
+        self._start_watchdog()
+        try:
+            asyncio.run(self._run())
+        finally:
+            released = self.release_fans()
+            if self.watchdog is not None:
+                self.watchdog.stop(clean=released)
+            self.executor.shutdown(wait=False)
+
+    def _start_watchdog(self) -> None:
+        hosts = [WatchdogHost(config.name, config.host, config.username,
+                              config.password, config.ipmi, config.port,
+                              config.watchdog)
+                 for config in self.hosts
+                 if config.watchdog > 0 and not config.dry_run]
+        if not hosts:
+            return
+        self.watchdog = Watchdog(hosts)
+        try:
+            self.watchdog.start()
+        except OSError:
+            logger.exception('Continuing without fan watchdog')
+            self.watchdog = None
+
+    def release_fans(self) -> bool:
+        """
+        Restore dynamic fan mode of all hosts.
+        Return True if every host succeeded in time.
+        """
+        futures = [self.executor.submit(controller.release_fans,
+                                        self.states[name])
+                   for name, controller in self.controllers.items()
+                   if name in self.states]
+        if not futures:
+            return True
+        done, not_done = wait(futures, timeout=RELEASE_TIMEOUT)
+        return not not_done and all(future.result() for future in done)
+
+    def _check_watchdog(self, name: str, state: ControllerState) -> None:
+        """
+        Write fan speed of a host again on its next poll, even within the
+        deadband, if the watchdog may have restored dynamic fan mode during
+        a stall.
+        """
+        if self.watchdog is not None and self.watchdog.overdue(name):
+            logger.warning('%s: polling stalled beyond the watchdog timeout',
+                           name)
+            self.controllers[name].actuator.invalidate(state)
+
+    async def _run(self) -> None:
+        control = None
+        if self.control_socket:
+            control = ControlServer(self, self.control_socket)
+            await control.start()
+        try:
+            await asyncio.gather(*[self._run_host(config)
+                                   for config in self.hosts])
+        finally:
+            if control is not None:
+                await control.stop()
+
+    async def _run_host(self, config: HostConfig) -> None:
+        """
+        Run the control loop of a host, restarting it after unexpected
+        errors, e.g. an unreadable state file, so other hosts keep polling.
+        """
+        while True:
+            try:
+                await self._host_loop(config)
+            # Before Python 3.8, CancelledError is an Exception.
+            except asyncio.CancelledError:  # pylint: disable=try-except-raise
+                raise
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('%s: control loop failed, restarting in '
+                                 '%gs', config.name, config.interval)
+            await asyncio.sleep(config.interval)
+
+    async def _host_loop(self, config: HostConfig) -> None:
+        """
+        Control loop of a single host.
+        """
+        loop = asyncio.get_running_loop()
+        controller = config.create_controller()
+        self.controllers[config.name] = controller
+        state: ControllerState = await loop.run_in_executor(
+            self.executor, controller.load_state)
+        self.states[config.name] = state
+
+        pending: Optional[Future] = None
+        scheduler = PollScheduler(config.interval, config.overrun,
+                                  loop.time)
+        self.schedulers[config.name] = scheduler
+        scheduler.start()
+
+        while True:
+            if pending is not None and not pending.done():
+                logger.warning('%s: previous poll still running, skipping '
+                               'this interval', config.name)
+                scheduler.skip()
+            else:
+                scheduler.begin()
+                self._check_watchdog(config.name, state)
+                pending = self.executor.submit(controller.poll, state)
+                done, _ = await asyncio.wait(
+                    [asyncio.wrap_future(pending)],
+                    timeout=config.poll_timeout)
+                if not done:
+                    logger.warning('%s: poll timed out after %gs',
+                                   config.name, config.poll_timeout)
+                else:
+                    error = pending.exception()
+                    if isinstance(error, IpmiError):
+                        logger.error('%s: poll failed: %s', config.name,
+                                     error)
+                    elif error is not None:
+                        logger.error('%s: poll failed', config.name,
+                                     exc_info=error)
+                    self._check_watchdog(config.name, state)
+                    if self.watchdog is not None:
+                        self.watchdog.beat(config.name)
+
+            # Wait for next polling interval.
+            skipped = scheduler.advance(controller.next_interval(state))
+            if skipped > 0:
+                logger.warning('%s: poll overran its interval, skipped %d '
+                               'poll(s)', config.name, skipped)
+            await asyncio.sleep(scheduler.delay())
@@ -0,0 +1,341 @@
+"""
+On-disk time series of every poll.
+Fixed size records in a ring file: appends are O(1) and the file never grows
+beyond its capacity.
+"""
+
+import math
+import os
+import struct
+from typing import BinaryIO, Iterator, List, Optional
+from .util import make_slug
+
+
+MAGIC = b'PFHI'
+VERSION = 1
+
+# Magic, version, record size, capacity, next write index, record count.
+HEADER = struct.Struct('<4sHHIII')
+HEADER_SIZE = 32
+
+MAX_CPUS = 4
+MAX_FANS = 8
+
+# Time, max CPU temp, aggregate temp, suggested speed, applied speed, flags,
+# CPU count, fan count, CPU temps, fan RPMs, mean fan percent.
+RECORD = struct.Struct(f'<dffhhBBB{MAX_CPUS}f{MAX_FANS}Hf')
+
+# Record flags.
+FLAG_READY = 0x01
+FLAG_DRY_RUN = 0x02
+FLAG_ERROR = 0x04
+FLAG_SUPPRESSED = 0x08
+FLAG_FAILSAFE = 0x10
+
+# Records read per chunk when streaming.
+CHUNK_RECORDS = 1024
+
+
+def history_filename(state_path: str, name: str) -> str:
+    """
+    Generate a valid filename for storing poll history of a host.
+    """
+    slug = 'pifan_' + make_slug(name)
+    return os.path.join(state_path, slug + '.hist')
+
+
+class HistoryRecord:
+    """
+    Sensor values and decision of one poll.
+    """
+    time: float
+
+    cpu_temp: float
+
+    # NaN until the aggregate window is full.
+    agg_temp: float
+
+    # Fan speed percent, or -1 if none.
+    suggested_speed: int
+
+    applied_speed: int
+
+    flags: int
+
+    cpu_temps: List[float]
+
+    fan_rpms: List[int]
+
+    fan_percent: float
+
+    def __init__(self) -> None:
+        self.time = 0.0
+        self.cpu_temp = float('nan')
+        self.agg_temp = float('nan')
+        self.suggested_speed = -1
+        self.applied_speed = -1
+        self.flags = 0
+        self.cpu_temps = []
+        self.fan_rpms = []
+        self.fan_percent = float('nan')
+
+    def __str__(self) -> str:
+        return (f'HistoryRecord: time={self.time}, cpu={self.cpu_temp}C, '
+                f'agg={self.agg_temp:0.1f}C, '
+                f'suggested={self.suggested_speed}%, '
+                f'applied={self.applied_speed}%, '
+                f'fan={self.fan_percent:0.1f}%, flags={self.flags:#x}')
+
+    def pack(self) -> bytes:
+        """
+        Encode as fixed size record.
+        """
+        cpu_temps = self.cpu_temps[:MAX_CPUS]
+        fan_rpms = [min(0xffff, rpm) for rpm in self.fan_rpms[:MAX_FANS]]
+        return RECORD.pack(
+            self.time, self.cpu_temp, self.agg_temp, self.suggested_speed,
+            self.applied_speed, self.flags, len(cpu_temps), len(fan_rpms),
+            *(cpu_temps + [float('nan')] * (MAX_CPUS - len(cpu_temps))),
+            *(fan_rpms + [0] * (MAX_FANS - len(fan_rpms))),
+            self.fan_percent)
+
+    @staticmethod
+    def unpack(data: bytes, offset: int = 0) -> 'HistoryRecord':
+        """
+        Decode fixed size record.
+        """
+        fields = RECORD.unpack_from(data, offset)
+        record = HistoryRecord()
+        record.time, record.cpu_temp, record.agg_temp, \
+            record.suggested_speed, record.applied_speed, record.flags, \
+            cpu_count, fan_count = fields[:8]
+        record.cpu_temps = list(fields[8:8 + cpu_count])
+        fan_start = 8 + MAX_CPUS
+        record.fan_rpms = list(fields[fan_start:fan_start + fan_count])
+        record.fan_percent = fields[-1]
+        return record
+
+
+class HistoryFile:
+    """
+    Ring file of HistoryRecords.
+    """
+    filename: str
+
+    capacity: int
+
+    # Index of next record to write.
+    head: int
+
+    count: int
+
+    def __init__(self, filename: str, capacity: int = 100000) -> None:
+        self.filename = filename
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        self._file: Optional[BinaryIO] = None
+
+    def __enter__(self) -> 'HistoryFile':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def open(self, create: bool = True) -> None:
+        """
+        Open file, creating it if needed.
+        An existing file keeps its own capacity.
+        """
+        if self._file is not None:
+            return
+
+        if not os.path.exists(self.filename):
+            if not create:
+                raise FileNotFoundError(f'No history file {self.filename}')
+            with open(self.filename, 'wb') as hist_file:
+                hist_file.write(self._header())
+                # Sparse preallocation of the full ring.
+                hist_file.truncate(HEADER_SIZE
+                                   + self.capacity * RECORD.size)
+
+        self._file = open(self.filename, 'r+b' if create else 'rb')
+        header = self._file.read(HEADER_SIZE)
+        magic, version, record_size, capacity, head, count = \
+            HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION \
+                or record_size != RECORD.size:
+            self.close()
+            raise Exception(f'Unrecognized history file {self.filename}')
+        self.capacity = capacity
+        self.head = head
+        self.count = count
+
+    def close(self) -> None:
+        """
+        Close file.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _header(self) -> bytes:
+        header = HEADER.pack(MAGIC, VERSION, RECORD.size, self.capacity,
+                             self.head, self.count)
+        return header + b'\x00' * (HEADER_SIZE - len(header))
+
+    def append(self, record: HistoryRecord) -> None:
+        """
+        Append record, overwriting the oldest when full.
+        """
+        self.open()
+        assert self._file is not None
+        self._file.seek(HEADER_SIZE + self.head * RECORD.size)
+        self._file.write(record.pack())
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.flush()
+
+    def _slot(self, index: int) -> int:
+        """
+        Ring slot of logical index, 0 being the oldest record.
+        """
+        return (self.head - self.count + index) % self.capacity
+
+    def read(self, index: int) -> HistoryRecord:
+        """
+        Read record by logical index, 0 being the oldest.
+        """
+        assert self._file is not None
+        self._file.seek(HEADER_SIZE + self._slot(index) * RECORD.size)
+        return HistoryRecord.unpack(self._file.read(RECORD.size))
+
+    def find(self, start_time: float) -> int:
+        """
+        Binary search logical index of first record at or after start_time.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.read(middle).time < start_time:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, start_time: Optional[float] = None,
+                end_time: Optional[float] = None) -> Iterator[HistoryRecord]:
+        """
+        Stream records in time range, oldest first, reading in chunks.
+        """
+        self.open(create=False)
+        assert self._file is not None
+
+        index = 0 if start_time is None else self.find(start_time)
+        while index < self.count:
+            slot = self._slot(index)
+            chunk = min(CHUNK_RECORDS, self.count - index,
+                        self.capacity - slot)
+            self._file.seek(HEADER_SIZE + slot * RECORD.size)
+            data = self._file.read(chunk * RECORD.size)
+            for offset in range(0, chunk * RECORD.size, RECORD.size):
+                record = HistoryRecord.unpack(data, offset)
+                if end_time is not None and record.time > end_time:
+                    return
+                yield record
+            index += chunk
+
+
+class RunningStats:
+    """
+    Streaming count, min, max, mean and standard deviation (Welford).
+    NaN values are ignored.
+    """
+    count: int
+
+    min: float
+
+    max: float
+
+    mean: float
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.min = float('nan')
+        self.max = float('nan')
+        self.mean = float('nan')
+        self._m2 = 0.0
+
+    def add(self, value: float) -> None:
+        """
+        Add value.
+        """
+        if math.isnan(value):
+            return
+        if self.count == 0:
+            self.min = self.max = self.mean = value
+        else:
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def stddev(self) -> float:
+        """
+        Population standard deviation.
+        """
+        if self.count == 0:
+            return float('nan')
+        return math.sqrt(self._m2 / self.count)
+
+
+# Columns of downsampled and summarized output.
+COLUMNS = ['cpu_temp', 'agg_temp', 'suggested_speed', 'applied_speed',
+           'fan_percent']
+
+
+def _column_value(record: HistoryRecord, column: str) -> float:
+    value = getattr(record, column)
+    if column in ('suggested_speed', 'applied_speed') and value < 0:
+        return float('nan')
+    return float(value)
+
+
+def downsample(records: Iterator[HistoryRecord],
+               step: float) -> Iterator[List[float]]:
+    """
+    Average records into buckets of step seconds.
+    Yield rows of [bucket start time, count, mean of each column].
+    """
+    bucket_start: Optional[float] = None
+    stats = [RunningStats() for _ in COLUMNS]
+    count = 0
+
+    for record in records:
+        start = record.time - record.time % step
+        if bucket_start is not None and start != bucket_start:
+            yield [bucket_start, count] + [stat.mean for stat in stats]
+            stats = [RunningStats() for _ in COLUMNS]
+            count = 0
+        bucket_start = start
+        count += 1
+        for stat, column in zip(stats, COLUMNS):
+            stat.add(_column_value(record, column))
+
+    if bucket_start is not None:
+        yield [bucket_start, count] + [stat.mean for stat in stats]
+
+
+def summarize(records: Iterator[HistoryRecord]) -> List[RunningStats]:
+    """
+    Compute running stats of each column.
+    """
+    stats = [RunningStats() for _ in COLUMNS]
+    for record in records:
+        for stat, column in zip(stats, COLUMNS):
+            stat.add(_column_value(record, column))
+    return stats
@@ -0,0 +1,34 @@
+"""
+Selection of IPMI transport backend.
+"""
+
+from typing import List, TYPE_CHECKING, Union
+from .ipmitool import Ipmitool
+
+if TYPE_CHECKING:
+    from .ipmi_native import IpmiNative
+
+
+# Either backend provides sdr_type(), sdr_get(), dcmi_power_reading() and
+# raw().  The native backend is imported on first use, so ipmitool runs
+# don't load the RMCP+ client.
+IpmiBackend = Union[Ipmitool, 'IpmiNative']
+
+BACKENDS: List[str] = ['ipmitool', 'native']
+
+
+def create_backend(backend: str, host: str, username: str, password: str,
+                   port: int = 623) -> IpmiBackend:
+    """
+    Create IPMI backend by name.
+    ipmitool: fork `ipmitool -I lanplus` for each request.
+    native: built-in RMCP+ client with a persistent session.
+    """
+    if backend == 'ipmitool':
+        return Ipmitool(host, username, password, port)
+    if backend == 'native':
+        # pylint: disable=import-outside-toplevel
+        from .ipmi_native import IpmiNative
+        return IpmiNative(host, username, password, port)
+
+    raise Exception(f'Unrecognized IPMI backend "{backend}"')
@@ -2,54 +2,72 @@
 IPMI control of CPU temperatures.
 """
 
-import re
-from typing import Dict
+import logging
+from typing import Dict, List, Optional
 from .controller_state import ControllerState
 from .cpu_sensor import CpuSensor
-from .ipmitool import Ipmitool
-from .util import parse_hex
+from .ipmi_backend import IpmiBackend, create_backend
+from .sensor_reading import SensorReading
+
+logger = logging.getLogger(__name__)
+
+# Names of inlet and exhaust temperature sensors.
+INLET_SENSOR = 'Inlet Temp'
+EXHAUST_SENSOR = 'Exhaust Temp'
 
 
 class IpmiCpu:
     """
     IPMI control of CPU temperatures.
     """
-    ipmitool: Ipmitool
-
-    pat_integer = re.compile(r'^(\d+)')
+    ipmitool: IpmiBackend
 
-    def __init__(self, host: str, username: str, password: str) -> None:
-        self.ipmitool = Ipmitool(host, username, password)
+    def __init__(self, host: str, username: str, password: str,
+                 backend: str = 'ipmitool', port: int = 623) -> None:
+        self.ipmitool = create_backend(backend, host, username, password,
+                                       port)
 
     def discover_sensors(self, state: ControllerState) -> None:
         """
-        Query IPMI for list of CPUs.
+        Query IPMI for list of CPUs, and of inlet and exhaust sensors.
         Must call this method first before using this class.
         """
-        rows = self.ipmitool.sdr_type('temperature')
+        readings = self.ipmitool.sdr_type('temperature')
 
         # Filter CPU temp sensors.
         cpu_map: Dict[str, CpuSensor] = {}
-
-        for row in rows:
-            name = row[0]
+        air_map: Dict[str, CpuSensor] = {}
+
+        for reading in readings:
+            name = reading.name
+            if name in (INLET_SENSOR, EXHAUST_SENSOR):
+                air = CpuSensor()
+                air.name = name
+                air.id = reading.id
+                if reading.value is not None:
+                    air.temp = reading.value
+                logger.info('Found air temperature sensor: %s (%#x)', name,
+                            air.id)
+                air_map[name] = air
+                continue
             if name != 'Temp':
                 continue
 
             sensor = CpuSensor()
             sensor.name = name
-            sensor.id = parse_hex(row[1])
+            sensor.id = reading.id
 
             # CPU temperature
-            match_integer = self.pat_integer.match(row[4])
-            if match_integer is not None:
-                sensor.temp = int(match_integer.groups()[0])
+            if reading.value is not None:
+                sensor.temp = int(reading.value)
 
-            print(f'Found CPU temperature sensor: {name} ({sensor.id:#x})')
+            logger.info('Found CPU temperature sensor: %s (%#x)', name,
+                        sensor.id)
             key = f'{name} ({sensor.id:#x})'
             cpu_map[key] = sensor
 
         state.cpu_map = cpu_map
+        state.air_map = air_map
         self.dump_sensors(state)
 
     def read_sensors(self, state: ControllerState) -> None:
@@ -57,31 +75,44 @@ class IpmiCpu:
         Read current sensor values.
         Store values in state.
         """
-        rows = self.ipmitool.sdr_type('temperature')
+        readings = self.ipmitool.sdr_type('temperature')
+        self.update_sensors(state, readings)
+        self.dump_sensors(state)
 
-        for row in rows:
-            if len(row) < 2:
+    def update_sensors(self, state: ControllerState,
+                       readings: List[SensorReading]) -> None:
+        """
+        Update CPU, inlet and exhaust temps in state from `sdr type` or
+        `sdr elist` readings.
+        Readings of other sensors are ignored.
+        """
+        for reading in readings:
+            air = state.air_map.get(reading.name) \
+                if state.air_map is not None else None
+            if air is not None and air.id == reading.id:
+                if reading.value is not None:
+                    air.temp = reading.value
                 continue
 
-            key = f'{row[0]} ({parse_hex(row[1]):#x})'
+            key = f'{reading.name} ({reading.id:#x})'
             if key in state.cpu_map:
                 sensor = state.cpu_map[key]
 
                 # CPU temperature
-                match_integer = self.pat_integer.match(row[4])
-                if match_integer is not None:
-                    sensor.temp = int(match_integer.groups()[0])
-
-        self.dump_sensors(state)
+                if reading.value is not None:
+                    sensor.temp = int(reading.value)
 
     def dump_sensors(self, state: ControllerState) -> None:
         """
-        Dump sensors to console.
+        Log sensors at debug level.
         """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         names = state.cpu_map.keys()
         for name in sorted(names):
-            cpu = state.cpu_map[name]
-            print(cpu)
+            logger.debug('%s', state.cpu_map[name])
+        for sensor in (state.air_map or {}).values():
+            logger.debug('%s', sensor)
 
     def get_max_cpu_temp(self, state: ControllerState) -> float:
         """
@@ -94,3 +125,29 @@ class IpmiCpu:
             temp = max(temp, sensor.temp)
 
         return temp
+
+    def get_air_temp(self, state: ControllerState,
+                     name: str) -> Optional[float]:
+        """
+        Get inlet or exhaust temp by sensor name, None if not discovered.
+        """
+        if state.air_map is None or name not in state.air_map:
+            return None
+        return state.air_map[name].temp
+
+    def get_zone_cpu_temp(self, state: ControllerState,
+                          cpus: List[int]) -> float:
+        """
+        Get maximum temp of CPUs by number, 1 for the CPU sensor with the
+        lowest sensor ID.
+        """
+        sensors = sorted(state.cpu_map.values(), key=lambda cpu: cpu.id)
+        temp: float = 0.0
+
+        for number in cpus:
+            if number > len(sensors):
+                raise Exception(f'CPU {number} not found, {len(sensors)} '
+                                'CPU temperature sensors discovered')
+            temp = max(temp, sensors[number - 1].temp)
+
+        return temp
@@ -0,0 +1,42 @@
+"""
+Exceptions of IPMI backends.
+Callers can tell a BMC that didn't answer from one that rejected a command,
+and only the former is worth retrying.
+"""
+
+
+class IpmiError(Exception):
+    """
+    IPMI request failed.
+    """
+
+
+class IpmiTimeoutError(IpmiError):
+    """
+    No response from the BMC before the deadline.
+    """
+
+
+class IpmiSessionError(IpmiError):
+    """
+    Session with the BMC could not be established, e.g. the BMC ran out of
+    sessions or rejected the login.
+    """
+
+
+class IpmiCommandError(IpmiError):
+    """
+    BMC answered, but rejected the command.
+    """
+
+
+class IpmiUnavailableError(IpmiError):
+    """
+    Request not sent: the BMC's circuit breaker is open after repeated
+    failures.
+    """
+
+
+# Failures suggesting the BMC or network is unwell, rather than the
+# request.  These are retried and counted by the circuit breaker.
+TRANSIENT_ERRORS = (IpmiTimeoutError, IpmiSessionError)
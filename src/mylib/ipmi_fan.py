@@ -2,47 +2,50 @@
 IPMI control of chassis fans.
 """
 
+import logging
 import re
-from typing import Dict
+from typing import Dict, List
 from .controller_state import ControllerState
 from .fan_sensor import FanSensor
-from .ipmitool import Ipmitool
-from .util import parse_hex
+from .ipmi_backend import IpmiBackend, create_backend
+from .sensor_reading import SensorReading
+
+logger = logging.getLogger(__name__)
 
 
 class IpmiFan:
     """
     IPMI control of chassis fans.
     """
-    ipmitool: Ipmitool
+    ipmitool: IpmiBackend
 
     pat_fan = re.compile(r'^Fan\d+$')
-    pat_name = re.compile(r'^(.+) \(')
-    pat_integer = re.compile(r'^(\d+)')
 
-    def __init__(self, host: str, username: str, password: str) -> None:
-        self.ipmitool = Ipmitool(host, username, password)
+    def __init__(self, host: str, username: str, password: str,
+                 backend: str = 'ipmitool', port: int = 623) -> None:
+        self.ipmitool = create_backend(backend, host, username, password,
+                                       port)
 
     def discover_sensors(self, state: ControllerState) -> None:
         """
         Query IPMI for list of chassis fans.
         Must call this method first before using this class.
         """
-        rows = self.ipmitool.sdr_type('fan')
+        readings = self.ipmitool.sdr_type('fan')
 
         # Filter fan sensors.
         fan_map: Dict[str, FanSensor] = {}
 
-        for row in rows:
-            name = row[0]
+        for reading in readings:
+            name = reading.name
             if self.pat_fan.match(name) is None:
                 continue
 
             sensor = FanSensor()
             sensor.name = name
-            sensor.id = parse_hex(row[1])
+            sensor.id = reading.id
 
-            print(f'Found fan sensor: {name} ({sensor.id:#x})')
+            logger.info('Found fan sensor: %s (%#x)', name, sensor.id)
             fan_map[name] = sensor
 
         state.fan_map = fan_map
@@ -52,96 +55,107 @@ class IpmiFan:
 
     def read_sensors(self, state: ControllerState) -> None:
         """
-        Read current sensor values.
+        Read current sensor values, including fan maximums.
         Store values in state.
         """
         fan_names = list(state.fan_map.keys())
-        result = self.ipmitool.sdr_get(fan_names)
-
-        # Sensor ID              : Fan1 (0x30)
-        #  Entity ID             : 7.1 (System Board)
-        #  Sensor Type (Threshold)  : Fan (0x04)
-        #  Sensor Reading        : 2400 (+/- 120) RPM
-        #  Status                : ok
-        #  Nominal Reading       : 10080.000
-        #  Normal Minimum        : 16680.000
-        #  Normal Maximum        : 23640.000
-        #  Lower critical        : 600.000
-        #  Lower non-critical    : 840.000
-        #  Positive Hysteresis   : 120.000
-        #  Negative Hysteresis   : 120.000
-        #  Minimum sensor range  : Unspecified
-        #  Maximum sensor range  : Unspecified
-        #  Event Message Control : Per-threshold
-        #  Readable Thresholds   : lcr lnc
-        #  Settable Thresholds   :
-        #  Threshold Read Mask   : lcr lnc
-        #  Assertion Events      :
-        #  Assertions Enabled    : lnc- lcr-
-        #  Deassertions Enabled  : lnc- lcr-
-
-        for key in result:
-            # Sensor name.
-            match_name = self.pat_name.match(key)
-            if match_name is None:
+        readings = self.ipmitool.sdr_get(fan_names, ['Normal Maximum'])
+
+        for reading in readings:
+            name = reading.name
+            sensor = state.fan_map.get(name)
+            if sensor is None:
                 continue
 
-            name = match_name.groups()[0]
-            sensor_data = result[key]
-            sensor = state.fan_map[name]
-
-            if 'Sensor Reading' in sensor_data:
-                value = sensor_data['Sensor Reading']
-                match_integer = self.pat_integer.match(value)
-                if match_integer is None:
-                    print(f'Error: Parse error on sensor reading for: {name}')
-                    continue
-                rpmstr = match_integer.groups()[0]
-                sensor.rpm = int(rpmstr)
+            if reading.value is not None:
+                sensor.rpm = int(reading.value)
             else:
                 sensor.rpm = 0
-                print(f'Error: Unable to get sensor reading for: {name}')
-
-            if 'Normal Maximum' in sensor_data:
-                value = sensor_data['Normal Maximum']
-                match_integer = self.pat_integer.match(value)
-                if match_integer is None:
-                    print(f'Error: Parse error on sensor maximum for: {name}')
-                    continue
-                maxstr = match_integer.groups()[0]
-                sensor.max = int(maxstr)
-            else:
+                logger.error('Unable to get sensor reading for: %s', name)
+
+            maximum = reading.field('Normal Maximum')
+            if maximum is None:
                 sensor.max = 0
-                print(f'Error: Unable to get sensor maximum for: {name}')
+                logger.error('Unable to get sensor maximum for: %s', name)
+                continue
+            try:
+                sensor.max = int(float(maximum))
+            except ValueError:
+                logger.error('Parse error on sensor maximum for: %s', name)
 
         self.dump_sensors(state)
 
+    def read_speeds(self, state: ControllerState) -> None:
+        """
+        Read current fan RPMs with one `sdr type` call.  Fan maximums are
+        left as read during discovery.
+        Store values in state.
+        """
+        readings = self.ipmitool.sdr_type('fan')
+        self.update_sensors(state, readings)
+        self.dump_sensors(state)
+
+    def update_sensors(self, state: ControllerState,
+                       readings: List[SensorReading]) -> None:
+        """
+        Update fan RPMs in state from `sdr type` or `sdr elist` readings.
+        Fan maximums are left as read by read_sensors() during discovery.
+        Readings of other sensors are ignored.
+        """
+        for reading in readings:
+            sensor = state.fan_map.get(reading.name)
+            if sensor is None:
+                continue
+
+            if reading.value is None:
+                sensor.rpm = 0
+                logger.error('Unable to get sensor reading for: %s',
+                             reading.name)
+                continue
+            sensor.rpm = int(reading.value)
+
     def dump_sensors(self, state: ControllerState) -> None:
         """
-        Dump sensors to console.
+        Log sensors at debug level.
         """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         names = state.fan_map.keys()
         for name in sorted(names):
-            fan = state.fan_map[name]
-            print(fan)
+            logger.debug('%s', state.fan_map[name])
 
-    def set_fan_speed(self, fan_speed: int) -> None:
+    def set_fan_speed(self, fan_speed: int, set_static: bool = True) -> None:
         """
         Set fan speed in percent.
+        Also enable static fan speed mode, unless set_static is False.
         """
-        self.set_static_fans()
+        if set_static:
+            self.set_static_fans()
         self.ipmitool.raw(bytearray([0x30, 0x30, 0x02, 0xff, fan_speed]))
 
+    def set_fan_speeds(self, fan_indexes: List[int], fan_speed: int,
+                       set_static: bool = True) -> None:
+        """
+        Set speed in percent of individual fans, by index from 0 for Fan1.
+        Also enable static fan speed mode, unless set_static is False.
+        """
+        if set_static:
+            self.set_static_fans()
+        for index in fan_indexes:
+            self.ipmitool.raw(bytearray([0x30, 0x30, 0x02, index,
+                                         fan_speed]))
+
     def set_static_fans(self) -> None:
         """
         Enable static fan speed mode.
         """
-        self.ipmitool.raw(bytearray([0x30, 0x30, 0x02, 0x01, 0x00]))
+        self.ipmitool.raw(bytearray([0x30, 0x30, 0x01, 0x00]))
 
     def set_dynamic_fans(self) -> None:
         """
         Enable dynamic fan speed mode.
         The BMC controls fan speed dynamically, but is not very likely to use
-        low fan speeds.
+        low fan speeds.  Sent even if the BMC's circuit breaker is open, as
+        it's the fallback when the BMC misbehaves.
         """
-        self.ipmitool.raw(bytearray([0x30, 0x30, 0x02, 0x01, 0x01]))
+        self.ipmitool.raw(bytearray([0x30, 0x30, 0x01, 0x01]), critical=True)
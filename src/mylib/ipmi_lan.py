@@ -0,0 +1,447 @@
+"""
+Native IPMI v2.0 over LAN (RMCP+) session.
+Speaks the same protocol as `ipmitool -I lanplus` without forking a process
+for every request, and keeps the authenticated session open between polls.
+https://www.intel.com/content/dam/www/public/us/en/documents/product-briefs/ipmi-second-gen-interface-spec-v2-rev1-1.pdf
+"""
+
+import hmac
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from .aes import Aes128, BLOCK_SIZE
+from .ipmi_errors import IpmiError, IpmiSessionError, IpmiTimeoutError
+from .retry import bmc_breaker
+from .startup import STARTUP
+from .tracing import traced
+
+logger = logging.getLogger(__name__)
+
+
+# RMCP header: version 6, reserved, no ack sequence, class IPMI.
+RMCP_HEADER = bytes([0x06, 0x00, 0xff, 0x07])
+
+AUTH_TYPE_RMCPP = 0x06
+
+PAYLOAD_IPMI = 0x00
+PAYLOAD_OPEN_SESSION_REQUEST = 0x10
+PAYLOAD_OPEN_SESSION_RESPONSE = 0x11
+PAYLOAD_RAKP1 = 0x12
+PAYLOAD_RAKP2 = 0x13
+PAYLOAD_RAKP3 = 0x14
+PAYLOAD_RAKP4 = 0x15
+
+PAYLOAD_ENCRYPTED = 0x80
+PAYLOAD_AUTHENTICATED = 0x40
+
+BMC_ADDR = 0x20
+CONSOLE_ADDR = 0x81
+
+NETFN_APP = 0x06
+CMD_SET_SESSION_PRIVILEGE = 0x3b
+CMD_CLOSE_SESSION = 0x3c
+
+PRIV_ADMINISTRATOR = 0x04
+
+# RAKP message 1 "name-only lookup" bit, as sent by ipmitool.
+LOOKUP_NAME_ONLY = 0x10
+
+# Cipher suite ID -> (auth alg, integrity alg, confidentiality alg,
+# hash name, integrity auth code length).
+CIPHER_SUITES: Dict[int, Tuple[int, int, int, str, int]] = {
+    # RAKP-HMAC-SHA1, HMAC-SHA1-96, AES-CBC-128
+    3: (0x01, 0x01, 0x01, 'sha1', 12),
+    # RAKP-HMAC-SHA256, HMAC-SHA256-128, AES-CBC-128
+    17: (0x03, 0x04, 0x01, 'sha256', 16),
+}
+
+
+def checksum(data: bytes) -> int:
+    """
+    IPMI two's complement checksum.
+    """
+    return -sum(data) & 0xff
+
+
+def pack_ipmi_request(netfn: int, cmd: int, data: bytes, seq: int,
+                      lun: int = 0) -> bytes:
+    """
+    Build an IPMI request message for a LAN channel.
+    """
+    header = bytes([BMC_ADDR, (netfn << 2) | lun])
+    body = bytes([CONSOLE_ADDR, (seq << 2) & 0xff, cmd]) + data
+    return (header + bytes([checksum(header)]) + body
+            + bytes([checksum(body)]))
+
+
+def unpack_ipmi_response(msg: bytes) -> Tuple[int, int, int, bytes]:
+    """
+    Split an IPMI response message.
+    Return (netfn, seq, cmd, data) where data starts with completion code.
+    """
+    if len(msg) < 8:
+        raise IpmiError('Truncated IPMI response')
+    if checksum(msg[:2]) != msg[2] or checksum(msg[3:-1]) != msg[-1]:
+        raise IpmiError('Bad IPMI response checksum')
+    return msg[1] >> 2, msg[4] >> 2, msg[5], msg[6:-1]
+
+
+class IpmiLanSession:
+    """
+    Authenticated RMCP+ session with a BMC.
+    """
+    host: str
+
+    port: int
+
+    username: bytes
+
+    password: bytes
+
+    cipher_suite: int
+
+    privilege: int
+
+    # Seconds to wait for each response.
+    timeout: float
+
+    # Attempts per request before the session is considered dropped.
+    retries: int
+
+    # Reopen the session if idle longer than this many seconds, as BMCs
+    # silently expire idle sessions.
+    idle_timeout: float
+
+    active: bool
+
+    sock: Optional[socket.socket]
+
+    def __init__(self, host: str, username: str, password: str,
+                 port: int = 623) -> None:
+        self.host = host
+        self.port = port
+        self.username = username.encode('utf-8')
+        self.password = password.encode('utf-8')
+        self.cipher_suite = 3
+        self.privilege = PRIV_ADMINISTRATOR
+        self.timeout = 1.0
+        self.retries = 3
+        self.idle_timeout = 50.0
+        self.active = False
+        self.sock = None
+        self._lock = threading.Lock()
+        self._console_sid = 0
+        self._bmc_sid = 0
+        self._session_seq = 0
+        self._rq_seq = 0
+        self._k1 = b''
+        self._aes: Optional[Aes128] = None
+        self._last_used = 0.0
+
+    def _digest(self) -> str:
+        return CIPHER_SUITES[self.cipher_suite][3]
+
+    def _hmac(self, key: bytes, data: bytes) -> bytes:
+        return hmac.new(key, data, self._digest()).digest()
+
+    def _socket(self) -> socket.socket:
+        if self.sock is None:
+            addr = socket.getaddrinfo(self.host, self.port,
+                                      type=socket.SOCK_DGRAM)[0]
+            self.sock = socket.socket(addr[0], socket.SOCK_DGRAM)
+            self.sock.connect(addr[4])
+        return self.sock
+
+    def _wrap(self, payload_type: int, payload: bytes) -> bytes:
+        """
+        Wrap payload in RMCP+ session header, encrypting and signing when
+        a session is active.
+        """
+        if not self.active:
+            return (RMCP_HEADER
+                    + struct.pack('<BBIIH', AUTH_TYPE_RMCPP, payload_type,
+                                  0, 0, len(payload))
+                    + payload)
+
+        assert self._aes is not None
+        # AES-CBC-128 confidentiality trailer: pad bytes 1, 2, 3... and a
+        # pad length byte.
+        pad_len = (BLOCK_SIZE - (len(payload) + 1) % BLOCK_SIZE) % BLOCK_SIZE
+        plain = payload + bytes(range(1, pad_len + 1)) + bytes([pad_len])
+        iv = os.urandom(BLOCK_SIZE)
+        payload = iv + self._aes.encrypt_cbc(iv, plain)
+
+        self._session_seq = (self._session_seq + 1) & 0xffffffff or 1
+        session = struct.pack(
+            '<BBIIH', AUTH_TYPE_RMCPP,
+            payload_type | PAYLOAD_ENCRYPTED | PAYLOAD_AUTHENTICATED,
+            self._bmc_sid, self._session_seq, len(payload)) + payload
+
+        # Integrity pad so the signed region is a multiple of 4 bytes.
+        integrity_pad = (4 - (len(session) + 2) % 4) % 4
+        session += b'\xff' * integrity_pad + bytes([integrity_pad, 0x07])
+        auth_len = CIPHER_SUITES[self.cipher_suite][4]
+        return RMCP_HEADER + session + self._hmac(self._k1,
+                                                  session)[:auth_len]
+
+    def _unwrap(self, packet: bytes) -> Tuple[int, bytes]:
+        """
+        Validate and unwrap an RMCP+ packet.
+        Return (payload type, payload).
+        """
+        if len(packet) < 16 or packet[:4] != RMCP_HEADER \
+                or packet[4] != AUTH_TYPE_RMCPP:
+            raise Exception('Not an RMCP+ packet')
+
+        payload_type = packet[5]
+        length = struct.unpack_from('<H', packet, 14)[0]
+        payload = packet[16:16 + length]
+
+        if payload_type & PAYLOAD_AUTHENTICATED:
+            auth_len = CIPHER_SUITES[self.cipher_suite][4]
+            expected = self._hmac(self._k1, packet[4:-auth_len])[:auth_len]
+            if not hmac.compare_digest(expected, packet[-auth_len:]):
+                raise Exception('RMCP+ integrity check failed')
+
+        if payload_type & PAYLOAD_ENCRYPTED:
+            if self._aes is None or len(payload) < 2 * BLOCK_SIZE:
+                raise Exception('Unexpected encrypted payload')
+            plain = self._aes.decrypt_cbc(payload[:BLOCK_SIZE],
+                                          payload[BLOCK_SIZE:])
+            payload = plain[:-1 - plain[-1]]
+
+        return payload_type & 0x3f, payload
+
+    def _exchange(self, payload_type: int, payload: bytes,
+                  expect_type: int, match=None) -> bytes:
+        """
+        Send a payload and wait for the expected response payload.
+        Retransmit on timeout.
+        """
+        sock = self._socket()
+        packet = self._wrap(payload_type, payload)
+
+        for _ in range(self.retries):
+            sock.send(packet)
+            deadline = time.monotonic() + self.timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data = sock.recv(1024)
+                except (socket.timeout, ConnectionRefusedError):
+                    # A refusal means nothing listens on the BMC port yet;
+                    # count it as a failed attempt rather than polling
+                    # recv() until the deadline.
+                    break
+                try:
+                    resp_type, resp = self._unwrap(data)
+                except Exception:  # pylint: disable=broad-except
+                    # Ignore stray or corrupt packets.
+                    continue
+                if resp_type == expect_type and (match is None
+                                                 or match(resp)):
+                    return resp
+
+        raise IpmiTimeoutError(f'No response from BMC {self.host}')
+
+    @traced('lan.open')
+    def open(self) -> None:
+        """
+        Open session: Open Session Request, RAKP 1-4 handshake and raise
+        privilege level.
+        """
+        self.active = False
+        self._aes = None
+        auth_alg, integrity_alg, conf_alg, _, _ = \
+            CIPHER_SUITES[self.cipher_suite]
+        self._console_sid = struct.unpack('<I', os.urandom(4))[0] | 1
+        tag = os.urandom(1)[0]
+
+        # Open Session Request.
+        request = (bytes([tag, 0, 0, 0])
+                   + struct.pack('<I', self._console_sid)
+                   + bytes([0x00, 0, 0, 8, auth_alg, 0, 0, 0])
+                   + bytes([0x01, 0, 0, 8, integrity_alg, 0, 0, 0])
+                   + bytes([0x02, 0, 0, 8, conf_alg, 0, 0, 0]))
+        resp = self._exchange(PAYLOAD_OPEN_SESSION_REQUEST, request,
+                              PAYLOAD_OPEN_SESSION_RESPONSE,
+                              lambda r: r[0] == tag)
+        if resp[1] != 0:
+            raise IpmiSessionError(f'Open session rejected by {self.host}: '
+                                   f'status {resp[1]:#x}')
+        self._bmc_sid = struct.unpack_from('<I', resp, 8)[0]
+
+        # RAKP message 1.
+        role = self.privilege | LOOKUP_NAME_ONLY
+        console_rand = os.urandom(16)
+        rakp1 = (bytes([tag, 0, 0, 0])
+                 + struct.pack('<I', self._bmc_sid)
+                 + console_rand
+                 + bytes([role, 0, 0, len(self.username)])
+                 + self.username)
+        resp = self._exchange(PAYLOAD_RAKP1, rakp1, PAYLOAD_RAKP2,
+                              lambda r: r[0] == tag)
+        if resp[1] != 0:
+            raise IpmiSessionError(f'RAKP authentication failed on '
+                                   f'{self.host}: status {resp[1]:#x}')
+
+        # RAKP message 2: verify BMC knows the password.
+        bmc_rand = resp[8:24]
+        bmc_guid = resp[24:40]
+        user_info = bytes([role, len(self.username)]) + self.username
+        expected = self._hmac(
+            self.password,
+            struct.pack('<II', self._console_sid, self._bmc_sid)
+            + console_rand + bmc_rand + bmc_guid + user_info)
+        if not hmac.compare_digest(expected, resp[40:40 + len(expected)]):
+            raise IpmiSessionError(f'RAKP 2 authentication code mismatch '
+                                   f'from {self.host}: check username and '
+                                   'password')
+
+        # Session keys.
+        sik = self._hmac(self.password, console_rand + bmc_rand + user_info)
+        key_len = len(sik)
+        self._k1 = self._hmac(sik, b'\x01' * key_len)
+        k2 = self._hmac(sik, b'\x02' * key_len)
+
+        # RAKP message 3.
+        rakp3 = (bytes([tag, 0, 0, 0])
+                 + struct.pack('<I', self._bmc_sid)
+                 + self._hmac(self.password,
+                              bmc_rand
+                              + struct.pack('<I', self._console_sid)
+                              + user_info))
+        resp = self._exchange(PAYLOAD_RAKP3, rakp3, PAYLOAD_RAKP4,
+                              lambda r: r[0] == tag)
+        if resp[1] != 0:
+            raise IpmiSessionError(f'RAKP 3 rejected by {self.host}: '
+                                   f'status {resp[1]:#x}')
+        icv_len = CIPHER_SUITES[self.cipher_suite][4]
+        expected = self._hmac(
+            sik, console_rand + struct.pack('<I', self._bmc_sid)
+            + bmc_guid)[:icv_len]
+        if not hmac.compare_digest(expected, resp[8:8 + icv_len]):
+            raise IpmiSessionError(f'RAKP 4 integrity check mismatch from '
+                                   f'{self.host}')
+
+        self._aes = Aes128(k2[:BLOCK_SIZE])
+        self._session_seq = 0
+        self.active = True
+        self._last_used = time.monotonic()
+
+        # Sessions start at user privilege; raise to requested level.
+        data = self._request(NETFN_APP, CMD_SET_SESSION_PRIVILEGE,
+                             bytes([self.privilege]))
+        if data[0] != 0:
+            raise IpmiSessionError(f'Unable to set privilege level on '
+                                   f'{self.host}: completion code '
+                                   f'{data[0]:#x}')
+
+    def close(self) -> None:
+        """
+        Close session, if active.
+        """
+        with self._lock:
+            if self.active:
+                try:
+                    self._request(NETFN_APP, CMD_CLOSE_SESSION,
+                                  struct.pack('<I', self._bmc_sid))
+                except Exception:  # pylint: disable=broad-except
+                    pass
+            self.active = False
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+    @traced('lan.request')
+    def _request(self, netfn: int, cmd: int, data: bytes,
+                 lun: int = 0) -> bytes:
+        self._rq_seq = (self._rq_seq + 1) & 0x3f
+        seq = self._rq_seq
+        msg = pack_ipmi_request(netfn, cmd, data, seq, lun)
+
+        def match(resp: bytes) -> bool:
+            try:
+                resp_netfn, resp_seq, resp_cmd, _ = \
+                    unpack_ipmi_response(resp)
+            except Exception:  # pylint: disable=broad-except
+                return False
+            return (resp_netfn == netfn + 1 and resp_seq == seq
+                    and resp_cmd == cmd)
+
+        resp = self._exchange(PAYLOAD_IPMI, msg, PAYLOAD_IPMI, match)
+        self._last_used = time.monotonic()
+        return unpack_ipmi_response(resp)[3]
+
+    def request(self, netfn: int, cmd: int, data: bytes = b'',
+                lun: int = 0, critical: bool = False) -> bytes:
+        """
+        Send an IPMI request over the session, opening or re-establishing
+        the session as needed.  Critical requests are sent even if the
+        BMC's circuit breaker is open.
+        Return response data, starting with the completion code.
+        """
+        breaker = bmc_breaker(self.host)
+        breaker.check(critical)
+        STARTUP.request_sent(f'netfn {netfn:#x} cmd {cmd:#x}')
+        try:
+            with self._lock:
+                response = self._locked_request(netfn, cmd, data, lun)
+        except IpmiError as error:
+            breaker.record(error)
+            raise
+        breaker.record(None)
+        return response
+
+    def _locked_request(self, netfn: int, cmd: int, data: bytes,
+                        lun: int) -> bytes:
+        idle = time.monotonic() - self._last_used
+        if not self.active or idle > self.idle_timeout:
+            self.open()
+            return self._request(netfn, cmd, data, lun)
+
+        try:
+            return self._request(netfn, cmd, data, lun)
+        except IpmiTimeoutError:
+            # Session may have been dropped by the BMC; re-establish and
+            # try once more.
+            logger.warning('Re-establishing IPMI session with %s',
+                           self.host)
+            self.open()
+            return self._request(netfn, cmd, data, lun)
+
+
+# Shared sessions, one per BMC and user.
+_sessions: Dict[Tuple[str, int, str], IpmiLanSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(host: str, username: str, password: str,
+                port: int = 623) -> IpmiLanSession:
+    """
+    Get the shared session for a BMC, creating it if needed.
+    """
+    key = (host, port, username)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None or session.password != password.encode('utf-8'):
+            session = IpmiLanSession(host, username, password, port)
+            _sessions[key] = session
+        return session
+
+
+def close_sessions() -> None:
+    """
+    Close all shared sessions.
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,296 @@
+"""
+Native IPMI client with the same interface as the Ipmitool wrapper.
+Requests are sent over a persistent RMCP+ session instead of forking
+`ipmitool` for every call.
+"""
+
+import struct
+from typing import List, Optional, Sequence, Tuple
+from .ipmi_errors import IpmiCommandError
+from .ipmi_lan import IpmiLanSession, get_session
+from .metrics import instrument
+from .sdr import RECORD_COMPACT_SENSOR, RECORD_FULL_SENSOR, SENSOR_TYPES, \
+    SdrRecord, parse_sdr_records, split_sdr_dump, threshold_status
+from .sensor_reading import SensorReading
+
+
+NETFN_SENSOR = 0x04
+NETFN_STORAGE = 0x0a
+NETFN_DCMI = 0x2c
+
+CMD_GET_SENSOR_READING = 0x2d
+CMD_GET_SDR_REPOSITORY_INFO = 0x20
+CMD_RESERVE_SDR_REPOSITORY = 0x22
+CMD_GET_SDR = 0x23
+CMD_DCMI_GET_POWER_READING = 0x02
+
+DCMI_GROUP_ID = 0xdc
+
+# Power measurement state bit of Get Power Reading.
+DCMI_POWER_ACTIVE = 0x40
+
+CC_RESERVATION_CANCELED = 0xc5
+
+# Bytes per partial Get SDR read.  Small enough for every BMC.
+SDR_CHUNK_SIZE = 16
+
+# Guard against malformed repositories with looping record IDs.
+MAX_SDR_RECORDS = 1024
+
+
+class IpmiNative:
+    """
+    Native IPMI client, compatible with the Ipmitool wrapper.
+    """
+    # Requests share one session and run one at a time.
+    parallel_requests = False
+
+    host: str
+
+    session: IpmiLanSession
+
+    records: Optional[List[SdrRecord]]
+
+    # Local SDR cache file, if set.
+    sdr_cache_file: Optional[str]
+
+    def __init__(self, host: str, username: str, password: str,
+                 port: int = 623) -> None:
+        self.host = host
+        self.session = get_session(host, username, password, port)
+        self.records = None
+        self.sdr_cache_file = None
+
+    def _command(self, netfn: int, cmd: int, data: bytes = b'',
+                 lun: int = 0) -> bytes:
+        """
+        Send command and check completion code.
+        Return response data without completion code.
+        """
+        resp = self.session.request(netfn, cmd, data, lun)
+        if not resp or resp[0] != 0:
+            code = resp[0] if resp else -1
+            raise IpmiCommandError(f'IPMI command {netfn:#04x} {cmd:#04x} '
+                                   f'failed: completion code {code:#04x}')
+        return resp[1:]
+
+    @instrument('sdr info')
+    def sdr_repository_info(self) -> Tuple[int, int, int]:
+        """
+        Get SDR Repository Info.
+        Return (record count, most recent addition, most recent erase).
+        """
+        data = self._command(NETFN_STORAGE, CMD_GET_SDR_REPOSITORY_INFO)
+        count, _, addition, erase = struct.unpack_from('<HHII', data, 1)
+        return count, addition, erase
+
+    def _reserve(self) -> bytes:
+        return self._command(NETFN_STORAGE, CMD_RESERVE_SDR_REPOSITORY)[:2]
+
+    def _get_sdr(self, reservation: bytes, record_id: int, offset: int,
+                 count: int) -> Tuple[int, bytes]:
+        resp = self.session.request(
+            NETFN_STORAGE, CMD_GET_SDR,
+            reservation + struct.pack('<HBB', record_id, offset, count))
+        if resp and resp[0] == CC_RESERVATION_CANCELED:
+            raise InterruptedError('SDR reservation canceled')
+        if not resp or resp[0] != 0:
+            code = resp[0] if resp else -1
+            raise IpmiCommandError(f'Get SDR failed for record '
+                                   f'{record_id:#06x}: completion code '
+                                   f'{code:#04x}')
+        return struct.unpack_from('<H', resp, 1)[0], resp[3:]
+
+    def read_sdr_repository(self) -> List[bytes]:
+        """
+        Read every raw record from the BMC's SDR repository.
+        """
+        raw_records: List[bytes] = []
+        reservation = self._reserve()
+        record_id = 0
+
+        while record_id != 0xffff and len(raw_records) < MAX_SDR_RECORDS:
+            try:
+                next_id, header = self._get_sdr(reservation, record_id, 0, 5)
+                raw = bytearray(header)
+                length = header[4]
+                while len(raw) < length + 5:
+                    chunk = min(SDR_CHUNK_SIZE, length + 5 - len(raw))
+                    _, data = self._get_sdr(reservation, record_id,
+                                            len(raw), chunk)
+                    raw += data
+            except InterruptedError:
+                reservation = self._reserve()
+                continue
+
+            raw_records.append(bytes(raw))
+            record_id = next_id
+
+        return raw_records
+
+    def sdr_fingerprint(self) -> str:
+        """
+        Identify the current contents of the BMC's SDR repository by its
+        record count and last addition and erase timestamps.
+        """
+        return '|'.join(str(value) for value in self.sdr_repository_info())
+
+    @instrument('sdr dump')
+    def sdr_dump(self, filename: str) -> None:
+        """
+        Save raw SDR records to a file, in `ipmitool sdr dump` format.
+        """
+        raw_records = self.read_sdr_repository()
+        with open(filename, 'wb') as dump_file:
+            dump_file.write(b''.join(raw_records))
+        self.records = parse_sdr_records(raw_records)
+
+    def use_sdr_cache(self, filename: Optional[str]) -> None:
+        """
+        Read SDR records from a file created by sdr_dump() instead of
+        downloading them from the BMC.
+        """
+        self.sdr_cache_file = filename
+        self.records = None
+
+    def sdr_records(self) -> List[SdrRecord]:
+        """
+        Get parsed sensor records, reading the cache file or repository on
+        first use.
+        """
+        if self.records is None:
+            if self.sdr_cache_file is not None:
+                with open(self.sdr_cache_file, 'rb') as dump_file:
+                    raw_records = split_sdr_dump(dump_file.read())
+            else:
+                raw_records = self.read_sdr_repository()
+            self.records = parse_sdr_records(raw_records)
+        return self.records
+
+    def _read_sensor(self, record: SdrRecord) -> Tuple[Optional[int], int]:
+        """
+        Get Sensor Reading.
+        Return (raw reading or None if unavailable, threshold state).
+        """
+        resp = self.session.request(NETFN_SENSOR, CMD_GET_SENSOR_READING,
+                                    bytes([record.number]), record.lun)
+        if len(resp) < 3 or resp[0] != 0:
+            return None, 0
+
+        flags = resp[2]
+        if flags & 0x20 or not flags & 0x40:
+            # Reading unavailable or scanning disabled.
+            return None, 0
+
+        state = resp[3] if len(resp) > 3 else 0
+        return resp[1], state
+
+    def _status(self, record: SdrRecord, reading: Optional[int],
+                state: int) -> str:
+        if record.is_analog():
+            return threshold_status(reading is None, state)
+        return 'ns' if reading is None else 'ok'
+
+    def _reading(self, record: SdrRecord) -> SensorReading:
+        raw_reading, state = self._read_sensor(record)
+        reading = SensorReading(record.name, record.number,
+                                self._status(record, raw_reading, state))
+        if raw_reading is not None and record.is_analog():
+            reading.value = record.convert(raw_reading)
+            reading.unit = record.unit_name()
+        return reading
+
+    @instrument('sdr type')
+    def sdr_type(self, sensor_type: str) -> List[SensorReading]:
+        """
+        Equivalent of `ipmitool sdr type`.
+        Return readings of sensors of the type.
+        """
+        type_code = SENSOR_TYPES.get(sensor_type.lower())
+        if type_code is None:
+            raise Exception(f'Unknown sensor type "{sensor_type}"')
+
+        return [self._reading(record) for record in self.sdr_records()
+                if record.sensor_type == type_code]
+
+    @instrument('sdr elist')
+    def sdr_elist(self, list_type: str = 'full',
+                  sensor_ids: Optional[List[int]] = None
+                  ) -> List[SensorReading]:
+        """
+        Equivalent of `ipmitool sdr elist`.
+        Only sensors in sensor_ids are read, if given.
+        """
+        if list_type not in ('all', 'full', 'compact'):
+            raise Exception(f'Unknown SDR list type "{list_type}"')
+
+        readings = []
+        for record in self.sdr_records():
+            if list_type == 'full' \
+                    and record.record_type != RECORD_FULL_SENSOR:
+                continue
+            if list_type == 'compact' \
+                    and record.record_type != RECORD_COMPACT_SENSOR:
+                continue
+            if sensor_ids is not None and record.number not in sensor_ids:
+                continue
+            readings.append(self._reading(record))
+
+        return readings
+
+    @instrument('sdr get')
+    def sdr_get(self, sensor_names: List[str],
+                fields: Sequence[str] = ()) -> List[SensorReading]:
+        """
+        Equivalent of `ipmitool sdr get`.
+        Return readings of sensors, with the extra fields listed in fields.
+        Nominal Reading, Normal Maximum and Normal Minimum are available.
+        """
+        readings: List[SensorReading] = []
+
+        for record in self.sdr_records():
+            if record.name not in sensor_names:
+                continue
+
+            reading = self._reading(record)
+            if record.is_analog():
+                for field, raw_value in (
+                        ('Nominal Reading', record.nominal),
+                        ('Normal Maximum', record.normal_max),
+                        ('Normal Minimum', record.normal_min)):
+                    if field in fields and raw_value is not None:
+                        if reading.fields is None:
+                            reading.fields = {}
+                        reading.fields[field] = \
+                            f'{record.convert(raw_value):.3f}'
+            readings.append(reading)
+
+        return readings
+
+    @instrument('dcmi power')
+    def dcmi_power_reading(self) -> float:
+        """
+        Equivalent of `ipmitool dcmi power reading`.
+        Return instantaneous power draw in watts.
+        """
+        data = self._command(NETFN_DCMI, CMD_DCMI_GET_POWER_READING,
+                             bytes([DCMI_GROUP_ID, 0x01, 0x00, 0x00]))
+        if len(data) < 18 or data[0] != DCMI_GROUP_ID:
+            raise IpmiCommandError('Invalid DCMI power reading response')
+        if not data[17] & DCMI_POWER_ACTIVE:
+            raise IpmiCommandError('DCMI power measurement is not active')
+        return float(struct.unpack_from('<H', data, 1)[0])
+
+    @instrument('raw')
+    def raw(self, raw_data: bytearray, critical: bool = False) -> None:
+        """
+        Equivalent of `ipmitool raw`.
+        First byte is the network function, second the command.  Critical
+        commands are sent even if the circuit breaker is open.
+        """
+        resp = self.session.request(raw_data[0], raw_data[1],
+                                    bytes(raw_data[2:]), critical=critical)
+        if not resp or resp[0] != 0:
+            code = resp[0] if resp else -1
+            raise IpmiCommandError(f'Error in IpmiNative.raw(): completion '
+                                   f'code {code:#04x}')
@@ -0,0 +1,41 @@
+"""
+Single round trip snapshot of CPU and fan sensors.
+"""
+
+from .controller_state import ControllerState
+from .ipmi_cpu import IpmiCpu
+from .ipmi_fan import IpmiFan
+from .tracing import traced
+
+
+class IpmiSnapshot:
+    """
+    Read CPU temperatures and fan RPMs with one `sdr elist full` call
+    instead of separate `sdr type` and `sdr get` calls.
+    Sensors must first be discovered by IpmiCpu and IpmiFan.
+    """
+    ipmi_cpu: IpmiCpu
+
+    ipmi_fan: IpmiFan
+
+    def __init__(self, ipmi_cpu: IpmiCpu, ipmi_fan: IpmiFan) -> None:
+        self.ipmi_cpu = ipmi_cpu
+        self.ipmi_fan = ipmi_fan
+
+    @traced('read_sensors')
+    def read_sensors(self, state: ControllerState, air: bool = False) -> None:
+        """
+        Read current CPU temps and fan RPMs, and inlet and exhaust temps if
+        air is set.
+        Store values in state.
+        """
+        sensor_ids = [sensor.id for sensor in state.cpu_map.values()] \
+            + [sensor.id for sensor in state.fan_map.values()]
+        if air and state.air_map is not None:
+            sensor_ids += [sensor.id for sensor in state.air_map.values()]
+        readings = self.ipmi_cpu.ipmitool.sdr_elist('full', sensor_ids)
+
+        self.ipmi_cpu.update_sensors(state, readings)
+        self.ipmi_fan.update_sensors(state, readings)
+        self.ipmi_cpu.dump_sensors(state)
+        self.ipmi_fan.dump_sensors(state)
@@ -3,11 +3,23 @@ Wrapper for ipmitool command.
 https://docs.oracle.com/cd/E19464-01/820-6850-11/IPMItool.html
 """
 
+import logging
 import re
 import subprocess
 import sys
-from typing import Dict, List
-from .util import parse_pdv
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence
+from .concurrency import bmc_semaphore
+from .ipmi_errors import IpmiCommandError, IpmiError, IpmiSessionError, \
+    IpmiTimeoutError
+from .ipmitool_parser import parse_sdr_get, parse_sdr_list
+from .metrics import instrument
+from .retry import Attempts, bmc_breaker, bmc_retry_policy
+from .sensor_reading import SensorReading
+from .startup import STARTUP
+from .tracing import TRACER
+
+logger = logging.getLogger(__name__)
 
 
 class Ipmitool:
@@ -15,89 +27,279 @@ class Ipmitool:
     Wrapper for ipmitool CLI tool.
     https://docs.oracle.com/cd/E19464-01/820-6850-11/IPMItool.html#50602039_68835
     """
+    # Each request is a separate process, so requests may run in parallel.
+    parallel_requests = True
+
+    host: str
+
     cmd_base: List[str]
 
     cmd_base_print: List[str]
 
-    def __init__(self, host: str, username: str, password: str) -> None:
+    # Local SDR cache file passed with -S, if set.
+    sdr_cache_file: Optional[str]
+
+    pat_field = re.compile(r'^(\S.*?)\s*:\s*(.*)$')
+
+    # Errors of lanplus session setup, as opposed to a rejected command.
+    pat_session_error = re.compile(
+        r'Unable to establish|session|No response|timeout|Cipher Suite',
+        re.IGNORECASE)
+
+    pat_power = re.compile(r'^\s*Instantaneous power reading:\s*(\d+)')
+
+    def __init__(self, host: str, username: str, password: str,
+                 port: int = 623) -> None:
+        self.host = host
         cmd_start = [
             'ipmitool',
             '-I', 'lanplus',
             '-H', host,
             '-U', username
         ]
+        if port != 623:
+            cmd_start += ['-p', str(port)]
         self.cmd_base = cmd_start + ['-P', password]
         self.cmd_base_print = cmd_start + ['-P', '*']
+        self.sdr_cache_file = None
+
+    def _spawn(self, args: List[str], command: str) -> subprocess.Popen:
+        """
+        Start ipmitool process.
+        """
+        logger.debug('%s', ' '.join(self.cmd_base_print + args))
+        STARTUP.request_sent(command)
+        return subprocess.Popen(self.cmd_base + args, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, encoding='utf-8')
+
+    def _error(self, method: str, stderr: str) -> IpmiError:
+        """
+        Exception for a failed ipmitool process, typed by its error output.
+        """
+        stderr = stderr.strip()
+        message = f'Error in ipmitool.{method}()'
+        if self.pat_session_error.search(stderr):
+            return IpmiSessionError(f'{message}: {stderr}')
+        return IpmiCommandError(f'{message}: {stderr}')
 
-    def _run(self, args: List[str]) -> subprocess.CompletedProcess:
-        cmd = self.cmd_base + args
-        print(' '.join(self.cmd_base_print + args))
+    @staticmethod
+    def _wait(process: subprocess.Popen,
+              timeout: float) -> subprocess.CompletedProcess:
+        """
+        Wait for ipmitool process to exit and collect its output.
+        Kill it if it takes longer than timeout seconds.
+        """
         try:
-            return subprocess.run(cmd, capture_output=True, encoding='utf-8')
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired as error:
+            process.kill()
+            process.wait()
+            raise IpmiTimeoutError(
+                f'ipmitool took longer than {timeout:0.1f}s') from error
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        return subprocess.CompletedProcess(process.args, process.returncode,
+                                           stdout, stderr)
+
+    def _run(self, args: List[str], method: str, use_cache: bool = True,
+             critical: bool = False) -> str:
+        """
+        Run ipmitool, retrying transient failures within the host's retry
+        policy.  Critical requests are sent even if the host's circuit
+        breaker is open.
+        Return its output.
+        """
+        command = ' '.join(args[:2])
+        if use_cache and self.sdr_cache_file is not None:
+            args = ['-S', self.sdr_cache_file] + args
+        breaker = bmc_breaker(self.host)
+        attempts = Attempts(bmc_retry_policy(self.host))
+        try:
+            while True:
+                breaker.check(critical)
+                try:
+                    timeout = attempts.timeout()
+                    with bmc_semaphore(self.host):
+                        with TRACER.span('ipmitool.spawn', command=command):
+                            process = self._spawn(args, command)
+                        with TRACER.span('ipmitool.wait', command=command):
+                            response = self._wait(process, timeout)
+                    if response.returncode != 0:
+                        raise self._error(method, response.stderr)
+                except IpmiError as error:
+                    breaker.record(error)
+                    if attempts.retry(self.host, command, error):
+                        continue
+                    raise
+                breaker.record(None)
+                return response.stdout
         except KeyboardInterrupt:
             sys.exit()
 
-    def sdr_type(self, sensor_type: str) -> List[List[str]]:
+    def _stream(self, args: List[str], method: str) -> Iterator[str]:
         """
-        Call `ipmitool sdr type`.
-        Output format::
+        Run ipmitool and yield lines of its output as they are read from
+        the pipe, instead of buffering all of it.
+        Raise after the last line if ipmitool failed.  Failures before the
+        first line are retried like _run(); later ones are not, as lines
+        were already consumed.
+        """
+        command = ' '.join(args[:2])
+        if self.sdr_cache_file is not None:
+            args = ['-S', self.sdr_cache_file] + args
+        breaker = bmc_breaker(self.host)
+        attempts = Attempts(bmc_retry_policy(self.host))
+        try:
+            while True:
+                breaker.check()
+                streamed = False
+                try:
+                    timeout = attempts.timeout()
+                    with bmc_semaphore(self.host):
+                        for line in self._stream_once(args, command, method,
+                                                      timeout):
+                            streamed = True
+                            yield line
+                except IpmiError as error:
+                    breaker.record(error)
+                    if not streamed \
+                            and attempts.retry(self.host, command, error):
+                        continue
+                    raise
+                breaker.record(None)
+                return
+        except KeyboardInterrupt:
+            sys.exit()
+
+    def _stream_once(self, args: List[str], command: str, method: str,
+                     timeout: float) -> Iterator[str]:
+        """
+        One attempt of _stream(), killing ipmitool after timeout seconds.
+        """
+        with TRACER.span('ipmitool.spawn', command=command):
+            process = self._spawn(args, command)
+        expired = threading.Event()
+
+        def expire() -> None:
+            expired.set()
+            process.kill()
 
-            <name> | <sensor id hex>h | <ok_status> |
-            <entity_id>.<instance_id> | <status>
+        timer = threading.Timer(timeout, expire)
+        timer.start()
+        with TRACER.span('ipmitool.stream', command=command), process:
+            try:
+                assert process.stdout is not None
+                assert process.stderr is not None
+                yield from process.stdout
+                stderr = process.stderr.read()
+                process.wait()
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                timer.cancel()
 
+        if expired.is_set():
+            raise IpmiTimeoutError(
+                f'ipmitool took longer than {timeout:0.1f}s')
+        if process.returncode != 0:
+            raise self._error(method, stderr)
+
+    @instrument('sdr type')
+    def sdr_type(self, sensor_type: str) -> List[SensorReading]:
         """
-        response = self._run(['sdr', 'type', sensor_type])
-        if response.returncode != 0:
-            print(response.stderr)
-            raise Exception('Error in ipmitool.sdr_type()')
+        Call `ipmitool sdr type`.
+        Return readings of sensors of the type.
+        """
+        lines = self._stream(['sdr', 'type', sensor_type], 'sdr_type')
+        return list(parse_sdr_list(lines))
 
-        return parse_pdv(response.stdout)
+    @instrument('sdr elist')
+    def sdr_elist(self, list_type: str = 'full',
+                  sensor_ids: Optional[List[int]] = None
+                  ) -> List[SensorReading]:
+        """
+        Call `ipmitool sdr elist`.
+        All sensors of the list type are read in a single call; readings
+        are filtered to sensor_ids, if given.
+        """
+        lines = self._stream(['sdr', 'elist', list_type], 'sdr_elist')
+        ids = set(sensor_ids) if sensor_ids is not None else None
+        return list(parse_sdr_list(lines, sensor_ids=ids))
 
-    def sdr_get(self, sensor_names: List[str]) -> Dict[str, Dict[str, str]]:
+    @instrument('sdr get')
+    def sdr_get(self, sensor_names: List[str],
+                fields: Sequence[str] = ()) -> List[SensorReading]:
         """
         Call `ipmitool sdr get`.
-        Output format::
-
-            Sensor ID: <name> (<id_hex>)
-             <field>: <value>
-             ...
-
-        """
-        response = self._run(['sdr', 'get'] + sensor_names)
-        if response.returncode != 0:
-            print(response.stderr)
-            raise Exception('Error in ipmitool.sdr_get()')
-
-        result: Dict[str, Dict[str, str]] = {}
-        header_re = re.compile(r'^\S.+:(.+)')
-        prop_re = re.compile(r'^ (.+):(.*)')
-        name: str = ''
-        item: Dict[str, str] = {}
-
-        for line in response.stdout.split('\n'):
-            match_header = header_re.match(line)
-            if match_header is not None:
-                name = match_header.groups()[0].strip()
-                item = {}
-                result[name] = item
-                continue
-
-            match_prop = prop_re.match(line)
-            if match_prop is not None:
-                key = match_prop.groups()[0].strip()
-                value = match_prop.groups()[1].strip()
-                item[key] = value
-                result[name] = item
-                continue
+        Return readings of sensors, with the extra fields listed in fields,
+        such as "Normal Maximum".
+        """
+        lines = self._stream(['sdr', 'get'] + sensor_names, 'sdr_get')
+        return list(parse_sdr_get(lines, frozenset(fields)))
+
+    @instrument('sdr info')
+    def sdr_info(self) -> Dict[str, str]:
+        """
+        Call `ipmitool sdr info`.
+        Return fields of the BMC's SDR repository info.
+        """
+        output = self._run(['sdr', 'info'], 'sdr_info', use_cache=False)
+
+        result: Dict[str, str] = {}
+        for line in output.split('\n'):
+            match_field = self.pat_field.match(line)
+            if match_field is not None:
+                result[match_field.groups()[0]] = match_field.groups()[1]
 
         return result
 
-    def raw(self, raw_data: bytearray) -> None:
+    def sdr_fingerprint(self) -> str:
+        """
+        Identify the current contents of the BMC's SDR repository by its
+        record count and last addition and erase timestamps.
+        """
+        info = self.sdr_info()
+        return '|'.join(info.get(key, '') for key in (
+            'Record Count', 'Most recent Addition', 'Most recent Erase'))
+
+    @instrument('sdr dump')
+    def sdr_dump(self, filename: str) -> None:
+        """
+        Call `ipmitool sdr dump` to save raw SDR records to a file.
+        """
+        self._run(['sdr', 'dump', filename], 'sdr_dump', use_cache=False)
+
+    def use_sdr_cache(self, filename: Optional[str]) -> None:
+        """
+        Read SDR records from a file created by sdr_dump() instead of
+        downloading them from the BMC on every call.
+        """
+        self.sdr_cache_file = filename
+
+    @instrument('dcmi power')
+    def dcmi_power_reading(self) -> float:
+        """
+        Call `ipmitool dcmi power reading`.
+        Return instantaneous power draw in watts.
+        """
+        output = self._run(['dcmi', 'power', 'reading'],
+                           'dcmi_power_reading', use_cache=False)
+
+        for line in output.split('\n'):
+            match_power = self.pat_power.match(line)
+            if match_power is not None:
+                return float(match_power.groups()[0])
+
+        raise IpmiCommandError('No power reading in ipmitool dcmi output')
+
+    @instrument('raw')
+    def raw(self, raw_data: bytearray, critical: bool = False) -> None:
         """
         Call `ipmitool raw`.
+        Critical commands are sent even if the circuit breaker is open.
         """
         payload = [('0x' + format(value, '02x')) for value in raw_data]
-        response = self._run(['raw'] + payload)
-        if response.returncode != 0:
-            print(response.stderr)
-            raise Exception('Error in ipmitool.raw()')
+        self._run(['raw'] + payload, 'raw', critical=critical)
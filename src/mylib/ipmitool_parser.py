@@ -0,0 +1,118 @@
+"""
+Streaming parsers of ipmitool output.
+Lines are consumed one at a time, e.g. straight from the subprocess pipe,
+and only sensors and fields the caller asked for are kept.
+"""
+
+from typing import AbstractSet, Collection, Iterable, Iterator, Optional, \
+    Tuple
+from .sensor_reading import SensorReading
+from .util import parse_hex
+
+# Key of the line starting each sensor in `sdr get` output.
+SDR_GET_HEADER = 'Sensor ID'
+
+
+def parse_value(text: str) -> Tuple[Optional[float], str]:
+    """
+    Parse a reading such as "3600 RPM", "40 degrees C" or
+    "3600 (+/- 120) RPM".
+    Return (value, unit), or (None, '') for "No Reading" or discrete state.
+    """
+    number, _, unit = text.strip().partition(' ')
+    try:
+        value = float(number)
+    except ValueError:
+        return None, ''
+    if unit.startswith('(+/-'):
+        unit = unit.partition(') ')[2]
+    return value, unit
+
+
+def parse_sdr_list(lines: Iterable[str],
+                   names: Optional[AbstractSet[str]] = None,
+                   sensor_ids: Optional[AbstractSet[int]] = None
+                   ) -> Iterator[SensorReading]:
+    """
+    Parse `sdr type` or `sdr elist` output, filtered to names and
+    sensor_ids, if given.
+    Output format::
+
+        <name> | <sensor id hex>h | <ok_status> |
+        <entity_id>.<instance_id> | <status>
+
+    """
+    for line in lines:
+        cols = line.split('|', 4)
+        if len(cols) < 5:
+            # Blank or truncated line.
+            continue
+
+        name = cols[0].strip()
+        if names is not None and name not in names:
+            continue
+        # Always <hex>h, cheaper than parse_hex().
+        sensor_id = int(cols[1].strip().rstrip('h'), 16)
+        if sensor_ids is not None and sensor_id not in sensor_ids:
+            continue
+
+        # Inlined parse_value(), without the `sdr get` tolerance.
+        number, _, unit = cols[4].strip().partition(' ')
+        try:
+            value: Optional[float] = float(number)
+        except ValueError:
+            value, unit = None, ''
+        yield SensorReading(name, sensor_id, cols[2].strip(), value, unit)
+
+
+def _parse_header(text: str) -> Tuple[str, int]:
+    """
+    Parse "<name> (<id_hex>)" of a `sdr get` header.
+    """
+    name, _, sensor_id = text.rpartition(' (')
+    if not name:
+        return text, 0
+    return name, parse_hex(sensor_id.rstrip(')'))
+
+
+def parse_sdr_get(lines: Iterable[str],
+                  fields: Collection[str] = ()) -> Iterator[SensorReading]:
+    """
+    Parse `sdr get` output.  The sensor reading and status become value,
+    unit and status; other fields are kept only if listed in fields.
+    Output format::
+
+        Sensor ID              : <name> (<id_hex>)
+         <field>                : <value>
+         ...
+
+    """
+    reading: Optional[SensorReading] = None
+
+    for line in lines:
+        key, colon, value = line.partition(':')
+        if not colon:
+            continue
+        if not key.startswith(' '):
+            if key.rstrip() != SDR_GET_HEADER:
+                continue
+            if reading is not None:
+                yield reading
+            name, sensor_id = _parse_header(value.strip())
+            reading = SensorReading(name, sensor_id)
+            continue
+        if reading is None:
+            continue
+
+        key = key.strip()
+        if key == 'Sensor Reading':
+            reading.value, reading.unit = parse_value(value)
+        elif key == 'Status':
+            reading.status = value.strip()
+        elif key in fields:
+            if reading.fields is None:
+                reading.fields = {}
+            reading.fields[key] = value.strip()
+
+    if reading is not None:
+        yield reading
@@ -0,0 +1,114 @@
+"""
+Logging setup.
+Records are queued by the caller and written by a background thread, so
+slow log I/O such as an SD card or syslog never delays the control loop.
+"""
+
+import atexit
+from datetime import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import Optional
+
+LOG_LEVELS = ['debug', 'info', 'warning', 'error']
+
+LOG_FORMATS = ['text', 'json']
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+
+TEXT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Logger of all PiFan modules.
+ROOT_LOGGER = 'mylib'
+
+
+class _Writer:
+    """
+    Background writer thread of queued records, while logging is set up.
+    """
+    listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line.
+    Values of a record's "fields" extra become top level keys.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records with message arguments and exception traceback rendered
+    to text, leaving structured fields for the output formatter.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        # Don't keep the caller's frames alive in the queue.
+        record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = 'info', log_format: str = 'text',
+                  filename: Optional[str] = None) -> None:
+    """
+    Send PiFan log records at level or above to filename, default stdout,
+    through a background writer thread.
+    """
+    stop_logging()
+
+    handler: logging.Handler
+    if filename is not None:
+        handler = logging.FileHandler(filename, encoding='utf-8')
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT,
+                                               TEXT_DATE_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.handlers = [_QueueHandler(log_queue)]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+    _Writer.listener = logging.handlers.QueueListener(log_queue, handler)
+    _Writer.listener.start()
+
+
+def stop_logging() -> None:
+    """
+    Write queued records and stop the writer thread.
+    """
+    listener = _Writer.listener
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        _Writer.listener = None
+
+
+atexit.register(stop_logging)
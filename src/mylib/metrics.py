@@ -0,0 +1,332 @@
+"""
+Prometheus metrics of the control loop and IPMI requests.
+The HTTP endpoint to scrape them is in metrics_server, so processes not
+serving metrics, such as cron runs, don't import http.server.
+"""
+
+import functools
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = \
+    'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Seconds, from a fast native request to a slow ipmitool SDR walk.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """
+    Metric family with values per label set.
+    """
+    kind = 'untyped'
+
+    name: str
+
+    help: str
+
+    labelnames: Tuple[str, ...]
+
+    def __init__(self, name: str, help_text: str,
+                 labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} expects labels '
+                             f'{self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelValues,
+                extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"'
+                              for name, value in pairs) + '}'
+
+    def value(self, **labels: str) -> float:
+        """
+        Current value of a label set, 0 if never set.
+        """
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def remove(self, **labels: str) -> None:
+        """
+        Drop a label set, e.g. of a sensor that disappeared.
+        """
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        """
+        Exposition lines of values.
+        """
+        # pylint: disable=unused-argument
+        with self._lock:
+            return [f'{self.name}{self._labels(key)} {_format_value(value)}'
+                    for key, value in sorted(self._values.items())]
+
+    def expose(self, openmetrics: bool = False) -> List[str]:
+        """
+        Exposition lines of metadata and values.
+        """
+        return [f'# HELP {self.name} {self.help}',
+                f'# TYPE {self.name} {self.kind}'] \
+            + self.samples(openmetrics)
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down.
+    """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Set value of a label set.
+        """
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing count.  Exposed with a _total suffix.
+    """
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        """
+        Increase value of a label set.
+        """
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        with self._lock:
+            return [f'{self.name}_total{self._labels(key)} '
+                    f'{_format_value(value)}'
+                    for key, value in sorted(self._values.items())]
+
+    def expose(self, openmetrics: bool = False) -> List[str]:
+        # OpenMetrics names the family without the suffix.
+        family = self.name if openmetrics else f'{self.name}_total'
+        return [f'# HELP {family} {self.help}',
+                f'# TYPE {family} counter'] + self.samples(openmetrics)
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+    kind = 'histogram'
+
+    buckets: Tuple[float, ...]
+
+    def __init__(self, name: str, help_text: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Add an observation to a label set.
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+                self._counts[key] = counts
+                self._sums[key] = 0.0
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            counts[index] += 1
+            self._sums[key] += value
+
+    def count(self, **labels: str) -> int:
+        """
+        Number of observations of a label set.
+        """
+        with self._lock:
+            return sum(self._counts.get(self._key(labels), []))
+
+    def samples(self, openmetrics: bool) -> List[str]:
+        lines: List[str] = []
+        with self._lock:
+            for key, counts in sorted(self._counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += count
+                    le_label = self._labels(key, ('le',
+                                                  _format_value(bound)))
+                    lines.append(f'{self.name}_bucket{le_label} '
+                                 f'{cumulative}')
+                lines.append(f'{self.name}_sum{self._labels(key)} '
+                             f'{_format_value(self._sums[key])}')
+                lines.append(f'{self.name}_count{self._labels(key)} '
+                             f'{cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics exposed together.
+    """
+    metrics: Dict[str, Metric]
+
+    def __init__(self) -> None:
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric.
+        """
+        if metric.name in self.metrics:
+            raise ValueError(f'Duplicate metric {metric.name}')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, help_text: str,
+              labelnames: Sequence[str] = ()) -> Gauge:
+        """
+        Create and add a gauge.
+        """
+        metric = Gauge(name, help_text, labelnames)
+        self.register(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str,
+                labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Create and add a counter.
+        """
+        metric = Counter(name, help_text, labelnames)
+        self.register(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str,
+                  labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """
+        Create and add a histogram.
+        """
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self.register(metric)
+        return metric
+
+    def exposition(self, openmetrics: bool = False) -> str:
+        """
+        Text exposition of all metrics, in Prometheus 0.0.4 or OpenMetrics
+        format.
+        """
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines += metric.expose(openmetrics)
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics of every controller in this process.
+REGISTRY = MetricsRegistry()
+
+CPU_TEMP = REGISTRY.gauge(
+    'pifan_cpu_temp_celsius', 'CPU temperature by sensor.',
+    ['host', 'sensor'])
+FAN_RPM = REGISTRY.gauge(
+    'pifan_fan_rpm', 'Fan speed in RPM.', ['host', 'fan'])
+FAN_PERCENT = REGISTRY.gauge(
+    'pifan_fan_percent', 'Fan speed in percent of max RPM.', ['host', 'fan'])
+AGGREGATE_TEMP = REGISTRY.gauge(
+    'pifan_aggregate_temp_celsius', 'Aggregate CPU temperature.', ['host'])
+APPLIED_SPEED = REGISTRY.gauge(
+    'pifan_applied_speed_percent', 'Last fan speed written to the BMC.',
+    ['host'])
+AIR_TEMP = REGISTRY.gauge(
+    'pifan_air_temp_celsius', 'Inlet or exhaust temperature.',
+    ['host', 'sensor'])
+POWER = REGISTRY.gauge(
+    'pifan_power_watts', 'Power draw from DCMI power reading.', ['host'])
+ZONE_TEMP = REGISTRY.gauge(
+    'pifan_zone_temp_celsius', 'Aggregate CPU temperature of a fan zone.',
+    ['host', 'zone'])
+ZONE_SPEED = REGISTRY.gauge(
+    'pifan_zone_speed_percent', 'Last fan speed written to a fan zone.',
+    ['host', 'zone'])
+POLL_DURATION = REGISTRY.histogram(
+    'pifan_poll_duration_seconds', 'Duration of a full poll.', ['host'])
+IPMI_DURATION = REGISTRY.histogram(
+    'pifan_ipmi_request_duration_seconds',
+    'Duration of an IPMI backend command.', ['host', 'command'])
+IPMI_FAILURES = REGISTRY.counter(
+    'pifan_ipmi_failures', 'Failed IPMI backend commands.',
+    ['host', 'command'])
+IPMI_RETRIES = REGISTRY.counter(
+    'pifan_ipmi_retries', 'Retries of IPMI backend commands after a '
+    'timeout or session failure.', ['host', 'command'])
+BREAKER_OPEN = REGISTRY.gauge(
+    'pifan_ipmi_breaker_open', 'Requests to the BMC are paused after '
+    'repeated failures.', ['host'])
+SUPPRESSED_WRITES = REGISTRY.counter(
+    'pifan_suppressed_writes', 'Fan speed writes skipped by the deadband.',
+    ['host'])
+DISCOVERY_RUNS = REGISTRY.counter(
+    'pifan_discovery_runs', 'Sensor discovery runs.', ['host'])
+
+
+def instrument(command: str) -> Callable:
+    """
+    Decorate an IPMI backend method to record its latency and failures,
+    labeled with the backend's host.
+    """
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            except Exception:
+                IPMI_FAILURES.inc(host=self.host, command=command)
+                raise
+            finally:
+                IPMI_DURATION.observe(time.perf_counter() - start,
+                                      host=self.host, command=command)
+        return wrapper
+    return decorator
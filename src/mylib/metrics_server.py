@@ -0,0 +1,73 @@
+"""
+Embedded HTTP endpoint serving Prometheus metrics.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+from .metrics import OPENMETRICS_CONTENT_TYPE, PROMETHEUS_CONTENT_TYPE, \
+    REGISTRY, MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Serve /metrics.
+        """
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        openmetrics = 'application/openmetrics-text' \
+            in self.headers.get('Accept', '')
+        body = self.registry.exposition(openmetrics).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE
+                         if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        # Don't log every scrape.
+        pass
+
+
+class MetricsServer:
+    """
+    HTTP endpoint serving metrics on a background thread.
+    """
+    server: ThreadingHTTPServer
+
+    def __init__(self, port: int, address: str = '127.0.0.1',
+                 registry: MetricsRegistry = REGISTRY) -> None:
+        handler = type('MetricsHandler', (_MetricsHandler,),
+                       {'registry': registry})
+        self.server = ThreadingHTTPServer((address, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='pifan-metrics', daemon=True)
+
+    @property
+    def port(self) -> int:
+        """
+        Bound port, useful with port 0.
+        """
+        return self.server.server_address[1]
+
+    def start(self) -> None:
+        """
+        Serve in the background.
+        """
+        self.thread.start()
+        logger.info('Serving metrics on port %d', self.port)
+
+    def stop(self) -> None:
+        """
+        Stop serving.
+        """
+        self.server.shutdown()
+        self.server.server_close()
@@ -2,9 +2,16 @@
 Continuously monitor by polling at an interval.
 """
 from datetime import timedelta
+import logging
 import time
+from typing import Optional
 from .controller_state import ControllerState
+from .ipmi_errors import IpmiError
 from .pi_fan_controller import PiFanController
+from .scheduler import PollScheduler
+from .watchdog import Watchdog
+
+logger = logging.getLogger(__name__)
 
 
 class Monitor:
@@ -17,31 +24,83 @@ class Monitor:
 
     count: int
 
+    scheduler: PollScheduler
+
+    # Watchdog told about every completed poll, if set.
+    watchdog: Optional[Watchdog]
+
     def __init__(self, controller: PiFanController, interval: timedelta,
-                 count: int):
+                 count: int, overrun: str = 'skip'):
         self.controller = controller
         self.interval = interval
         self.count = count
+        self.scheduler = PollScheduler(interval.total_seconds(), overrun)
+        self.watchdog = None
 
     def launch(self, state: ControllerState) -> None:
         """
         Continuously poll fan and CPU sensors and adjust fan speed according
         to easing algorithm.
+
+        Stops after count scheduled polls, including polls skipped after an
+        overrun, so cron runs stay within count intervals.  With an
+        adaptive interval, count limits the run time to count base
+        intervals instead, and the first poll waits for the interval chosen
+        by the previous run.
         """
-        counter: int = 0
+        adaptive = self.controller.adaptive is not None
+        scheduler = self.scheduler
+
+        end_time: Optional[float] = None
+        delay = 0.0
+        if adaptive:
+            if self.count > 0:
+                end_time = scheduler.clock() \
+                    + self.count * scheduler.interval
+            if state.last_poll_time is not None:
+                delay = state.last_poll_time \
+                    + self.controller.next_interval(state) - time.time()
+        scheduler.start(delay)
 
         while True:
-            self.controller.poll(state)
+            if end_time is not None and scheduler.deadline >= end_time:
+                logger.debug('Next poll is due after this run, exiting.')
+                break
+
+            # Wait for next polling interval.
+            scheduler.wait()
+            scheduler.begin()
+            self._check_watchdog(state)
+            try:
+                self.controller.poll(state)
+            except IpmiError as error:
+                # Sensor discovery failed, e.g. the BMC is unreachable.
+                # Try again next interval.
+                logger.error('%s: poll failed: %s', self.controller.name,
+                             error)
+            self._check_watchdog(state)
+            if self.watchdog is not None:
+                self.watchdog.beat(self.controller.name)
+
+            skipped = scheduler.advance(
+                self.controller.next_interval(state) if adaptive else None)
+            if skipped > 0:
+                logger.warning('Poll overran its interval, skipped %d '
+                               'poll(s).', skipped)
 
             # Stop after a defined poll limit.
-            counter += 1
-            if self.count > 0 and counter >= self.count:
+            if not adaptive and 0 < self.count <= scheduler.slots:
                 break
 
-            # Wait for next polling interval.
-            poll_start_time = self.controller.poll_start_time
-            poll_end_time = self.controller.poll_end_time
-            next_poll_time = poll_start_time + self.interval
-            if next_poll_time > poll_end_time:
-                delay = (next_poll_time - poll_end_time).total_seconds()
-                time.sleep(delay)
+        logger.info('%s', scheduler.stats)
+
+    def _check_watchdog(self, state: ControllerState) -> None:
+        """
+        Write fan speed again on the next poll, even within the deadband, if
+        the watchdog may have restored dynamic fan mode during a stall.
+        """
+        if self.watchdog is not None \
+                and self.watchdog.overdue(self.controller.name):
+            logger.warning('%s: polling stalled beyond the watchdog timeout',
+                           self.controller.name)
+            self.controller.actuator.invalidate(state)
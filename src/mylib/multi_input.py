@@ -0,0 +1,169 @@
+"""
+Fan speed adjustments from inputs other than CPU temperature: package
+power, inlet temperature and the exhaust-inlet temperature delta.
+"""
+
+import math
+from typing import Optional, Tuple
+from .util import parse_duration
+
+
+class InputSpec:
+    """
+    Multi-input settings, parsed from a spec string::
+
+        [power=GAIN[,WINDOW]][:inlet=DEG_C,GAIN][:delta=DEG_C,GAIN]
+
+    power adds GAIN fan percent per watt the power reading is above its
+    average over WINDOW (default: 2m).  Power leads CPU temperature, so fans
+    ramp before the CPU heats up.  inlet raises the fan speed floor by GAIN
+    percent per degree C of inlet temperature above DEG_C.  delta adds GAIN
+    percent per degree C the exhaust is warmer than inlet beyond DEG_C, when
+    the air is carrying away more heat than the fans are sized for.
+    """
+    # Fan percent per watt above average power, 0=disabled.
+    power_gain: float
+
+    # Time constant of the power average in seconds.
+    power_window: float
+
+    inlet_temp: float
+
+    # Fan percent floor per degree C above inlet_temp, 0=disabled.
+    inlet_gain: float
+
+    delta_temp: float
+
+    # Fan percent per degree C of exhaust-inlet delta above delta_temp,
+    # 0=disabled.
+    delta_gain: float
+
+    def __init__(self) -> None:
+        self.power_gain = 0.0
+        self.power_window = 120.0
+        self.inlet_temp = 25.0
+        self.inlet_gain = 0.0
+        self.delta_temp = 15.0
+        self.delta_gain = 0.0
+
+    def __str__(self) -> str:
+        return (f'power={self.power_gain:g},{self.power_window:g}s:'
+                f'inlet={self.inlet_temp:g},{self.inlet_gain:g}:'
+                f'delta={self.delta_temp:g},{self.delta_gain:g}')
+
+
+def _parse_pair(key: str, value: str) -> Tuple[float, float]:
+    parts = value.split(',')
+    if len(parts) != 2:
+        raise ValueError(f'Invalid {key} input "{value}", expected '
+                         'DEG_C,GAIN')
+    try:
+        return float(parts[0]), float(parts[1])
+    except ValueError as error:
+        raise ValueError(f'Invalid {key} input "{value}"') from error
+
+
+def parse_input_spec(text: str) -> InputSpec:
+    """
+    Parse multi-input spec string.  See InputSpec.
+    """
+    spec = InputSpec()
+    for part in text.strip().split(':'):
+        key, _, value = part.partition('=')
+        if key == 'power':
+            gain, _, window = value.partition(',')
+            try:
+                spec.power_gain = float(gain)
+            except ValueError as error:
+                raise ValueError(f'Invalid power input "{value}"') \
+                    from error
+            if window:
+                spec.power_window = parse_duration(window)
+        elif key == 'inlet':
+            spec.inlet_temp, spec.inlet_gain = _parse_pair(key, value)
+        elif key == 'delta':
+            spec.delta_temp, spec.delta_gain = _parse_pair(key, value)
+        else:
+            raise ValueError(f'Unknown input "{part}", expected power, '
+                             'inlet or delta')
+    return spec
+
+
+class InputState:
+    """
+    Persistent state of multi-input control, kept in ControllerState.
+    """
+    # Last power reading in watts.
+    power: Optional[float]
+
+    # Exponential moving average of power readings in watts.
+    power_avg: Optional[float]
+
+    # Epoch seconds of last power reading.
+    power_time: Optional[float]
+
+    def __init__(self) -> None:
+        self.power = None
+        self.power_avg = None
+        self.power_time = None
+
+
+class MultiInput:
+    """
+    Adjust fan speed suggested from CPU temperature with power and air
+    temperature readings.
+    """
+    spec: InputSpec
+
+    def __init__(self, spec: InputSpec) -> None:
+        self.spec = spec
+
+    def add_power(self, state: InputState, power: float, now: float) -> None:
+        """
+        Add a power reading to the average.
+        """
+        if state.power_avg is None or state.power_time is None \
+                or now - state.power_time > 10 * self.spec.power_window:
+            state.power_avg = power
+        else:
+            alpha = 1.0 - math.exp(-max(0.0, now - state.power_time)
+                                   / self.spec.power_window)
+            state.power_avg += alpha * (power - state.power_avg)
+        state.power = power
+        state.power_time = now
+
+    def power_boost(self, state: InputState) -> float:
+        """
+        Fan percent added for power above its average.
+        """
+        if state.power is None or state.power_avg is None:
+            return 0.0
+        return self.spec.power_gain * max(0.0, state.power - state.power_avg)
+
+    def inlet_floor(self, inlet: Optional[float]) -> float:
+        """
+        Min fan percent for the inlet temperature.
+        """
+        if inlet is None:
+            return 0.0
+        return self.spec.inlet_gain * max(0.0, inlet - self.spec.inlet_temp)
+
+    def delta_boost(self, inlet: Optional[float],
+                    exhaust: Optional[float]) -> float:
+        """
+        Fan percent added for exhaust-inlet delta above the threshold.
+        """
+        if inlet is None or exhaust is None:
+            return 0.0
+        return self.spec.delta_gain \
+            * max(0.0, exhaust - inlet - self.spec.delta_temp)
+
+    def adjust(self, speed: int, state: InputState, inlet: Optional[float],
+               exhaust: Optional[float], max_fan: int) -> int:
+        """
+        Add power and delta boosts to a suggested speed and raise it to the
+        inlet floor.
+        """
+        boosted = speed + self.power_boost(state) \
+            + self.delta_boost(inlet, exhaust)
+        return min(max_fan, int(max(boosted, self.inlet_floor(inlet))))
@@ -2,13 +2,42 @@
 Pi Fan controller class.
 """
 
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
+import logging
+import math
 import os
-import traceback
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+from .adaptive_interval import AdaptiveInterval
+from .aggregator import AggregateSpec
+from .concurrency import DEFAULT_CONCURRENCY, set_bmc_concurrency
 from .controller_state import ControllerState
-from .ipmi_cpu import IpmiCpu
+from .easing import ease_linear, ease_parabolic
+from .fan_actuator import FanActuator
+from .fan_zone import FanZone
+from .history import FLAG_DRY_RUN, FLAG_ERROR, FLAG_FAILSAFE, FLAG_READY, \
+    FLAG_SUPPRESSED, HistoryFile, HistoryRecord, history_filename
+from .ipmi_cpu import EXHAUST_SENSOR, INLET_SENSOR, IpmiCpu
+from .ipmi_errors import IpmiError
 from .ipmi_fan import IpmiFan
-from .util import make_slug
+from .ipmi_snapshot import IpmiSnapshot
+from .metrics import AGGREGATE_TEMP, AIR_TEMP, APPLIED_SPEED, CPU_TEMP, \
+    DISCOVERY_RUNS, FAN_PERCENT, FAN_RPM, POLL_DURATION, POWER, \
+    SUPPRESSED_WRITES, ZONE_SPEED, ZONE_TEMP
+from .multi_input import MultiInput
+from .pid import PidController, PidState
+from .sdr_cache import SdrCache
+from .state_format import StateFormatError, is_legacy_pickle
+from .tracing import TRACER, traced
+from .util import default_state_path, make_slug
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds a validated SDR cache is trusted without asking the BMC again.
+SDR_CHECK_INTERVAL = 3600.0
 
 
 class PiFanController:
@@ -23,7 +52,14 @@ class PiFanController:
 
     ipmi_cpu: IpmiCpu
 
-    interval: int
+    snapshot: IpmiSnapshot
+
+    actuator: FanActuator
+
+    interval: float
+
+    # Vary poll interval with CPU temperature trend if set.
+    adaptive: Optional[AdaptiveInterval]
 
     ideal_temp: float
 
@@ -31,12 +67,60 @@ class PiFanController:
 
     easing: str
 
+    # Gains and limits of PID easing.
+    pid: PidController
+
+    # Fan zones with their own CPUs and curves.  All fans follow the
+    # hottest CPU if empty.
+    zones: List[FanZone]
+
+    zone_fans_checked: bool
+
+    # Adjust fan speed with power, inlet and exhaust readings if set.
+    inputs: Optional[MultiInput]
+
+    # Restore dynamic fan mode after this many consecutive failed polls,
+    # 0=never.
+    failsafe_polls: int
+
     dry_run: bool
 
     state_path: str
 
     sample_size: int
 
+    # CPU temp aggregation settings.  Mean of sample_size samples if None.
+    aggregate: Optional[AggregateSpec]
+
+    # Keep a local SDR repository cache next to the state file.
+    use_sdr_cache: bool
+
+    sdr_cache_checked: bool
+
+    # Seconds between checks of the SDR cache against the BMC, which cost
+    # an IPMI request.  Cron runs in between use the cache as is.
+    sdr_check_interval: float
+
+    # Max records in poll history file, 0=disabled.
+    history_size: int
+
+    history: Optional[HistoryFile]
+
+    # Record of the last poll, for status queries.
+    last_record: Optional[HistoryRecord]
+
+    # Last state written to or read from the state file.
+    saved_state_buf: bytes
+
+    # Source of epoch seconds.  Replaced by the thermal simulator.
+    clock: Callable[[], float]
+
+    # Max concurrent IPMI requests to the BMC, 1=sequential.
+    concurrency: int
+
+    # Runs IPMI requests of a poll concurrently.
+    executor: Optional[ThreadPoolExecutor]
+
     poll_start_time: datetime
 
     poll_end_time: datetime
@@ -46,58 +130,129 @@ class PiFanController:
         self.name = name
         self.ipmi_fan = ipmi_fan
         self.ipmi_cpu = ipmi_cpu
-        self.interval = 10
+        self.snapshot = IpmiSnapshot(ipmi_cpu, ipmi_fan)
+        self.actuator = FanActuator(ipmi_fan)
+        self.interval = 10.0
+        self.adaptive = None
         self.ideal_temp = 40.0
         self.max_temp = 75.0
         self.max_fan = 100
         self.easing = 'linear'
+        self.pid = PidController()
+        self.zones = []
+        self.zone_fans_checked = False
+        self.inputs = None
+        self.failsafe_polls = 3
         self.dry_run = False
         self.sample_size = 3
+        self.aggregate = None
+        self.use_sdr_cache = True
+        self.sdr_cache_checked = False
+        self.sdr_check_interval = SDR_CHECK_INTERVAL
+        self.history_size = 0
+        self.history = None
+        self.last_record = None
+        self.saved_state_buf = b''
+        self.clock = time.time
+        self.concurrency = DEFAULT_CONCURRENCY
+        self.executor = None
         self.poll_start_time = datetime.fromtimestamp(0)
         self.poll_end_time = datetime.fromtimestamp(0)
+        self.state_path = default_state_path()
 
-        if 'TMP' in os.environ:
-            self.state_path = os.environ['TMP']
-        else:
-            self.state_path = '/tmp'
-
-    def _suggest_fan_speed_linear(self, cpu_temp: float) -> int:
+    def _suggest_fan_speed_linear(self, cpu_temp: float, ideal_temp: float,
+                                  max_temp: float) -> int:
         """
         Suggest a fan speed based on linear algorithm.
         """
-        offset = cpu_temp - self.ideal_temp
+        offset = cpu_temp - ideal_temp
         if offset < 0:
             return 0
 
-        temp_range = self.max_temp - self.ideal_temp
-        speed = self.max_fan * offset / temp_range
+        temp_range = max_temp - ideal_temp
+        speed = ease_linear(offset, temp_range, self.max_fan)
         return min(self.max_fan, int(speed))
 
-    def _suggest_fan_speed_parabolic(self, cpu_temp: float) -> int:
+    def _suggest_fan_speed_parabolic(self, cpu_temp: float,
+                                     ideal_temp: float,
+                                     max_temp: float) -> int:
         """
         Suggest a fan speed based on parabolic curve.
         """
-        # https://www.futurelearn.com/info/courses/maths-linear-quadratic/0/steps/12130
-        # y = max_temp/(temp_range^2)*x^2
-        offset = cpu_temp - self.ideal_temp
+        offset = cpu_temp - ideal_temp
         if offset < 0:
             return 0
 
-        temp_range = float(self.max_temp - self.ideal_temp)
-        speed = self.max_fan / (temp_range * temp_range) * (offset * offset)
+        temp_range = float(max_temp - ideal_temp)
+        speed = ease_parabolic(offset, temp_range, self.max_fan)
         return min(self.max_fan, int(speed))
 
-    def suggest_fan_speed(self, cpu_temp: float) -> int:
+    def _suggest_fan_speed_pid(self, cpu_temp: float, ideal_temp: float,
+                               max_temp: float, pid_state: PidState,
+                               now: float) -> int:
+        """
+        Suggest a fan speed by PID control around the ideal temperature.
+        Max temperature always gets max fan speed.
+        """
+        self.pid.max_output = self.max_fan
+        speed = self.pid.update(pid_state, cpu_temp, ideal_temp, now)
+        if cpu_temp >= max_temp:
+            pid_state.output = self.max_fan
+            return self.max_fan
+        return int(round(speed))
+
+    def _suggest(self, easing: str, cpu_temp: float, ideal_temp: float,
+                 max_temp: float, pid_state: Optional[PidState],
+                 now: Optional[float]) -> int:
+        if easing == 'linear':
+            return self._suggest_fan_speed_linear(cpu_temp, ideal_temp,
+                                                  max_temp)
+        if easing == 'parabolic':
+            return self._suggest_fan_speed_parabolic(cpu_temp, ideal_temp,
+                                                     max_temp)
+        if easing == 'pid':
+            if pid_state is None:
+                raise Exception('PID easing requires controller state')
+            return self._suggest_fan_speed_pid(
+                cpu_temp, ideal_temp, max_temp, pid_state,
+                self.clock() if now is None else now)
+
+        raise Exception(f'Unrecognized easing type "{easing}"')
+
+    @traced('suggest_fan_speed')
+    def suggest_fan_speed(self, cpu_temp: float,
+                          state: Optional[ControllerState] = None,
+                          now: Optional[float] = None) -> int:
         """
         Suggest a fan speed for a CPU temperature.
-        Use selected easing algorithm.
+        Use selected easing algorithm.  PID easing requires state and the
+        time of the temperature sample.
         """
-        if self.easing == 'linear':
-            return self._suggest_fan_speed_linear(cpu_temp)
-        if self.easing == 'parabolic':
-            return self._suggest_fan_speed_parabolic(cpu_temp)
+        return self._suggest(self.easing, cpu_temp, self.ideal_temp,
+                             self.max_temp,
+                             state.pid if state is not None else None, now)
+
+    @traced('suggest_zone_speed')
+    def suggest_zone_speed(self, zone: FanZone, cpu_temp: float,
+                           state: ControllerState,
+                           now: Optional[float] = None) -> int:
+        """
+        Suggest a fan speed for a zone's CPU temperature, using the zone's
+        curve settings where set and the controller's otherwise.
+        """
+        return self._suggest(
+            zone.easing or self.easing, cpu_temp,
+            self.ideal_temp if zone.ideal_temp is None else zone.ideal_temp,
+            self.max_temp if zone.max_temp is None else zone.max_temp,
+            state.zone_state(zone.name).pid, now)
 
-        raise Exception(f'Unrecognized easing type "{self.easing}"')
+    def aggregate_spec(self) -> AggregateSpec:
+        """
+        Get CPU temp aggregation settings.
+        """
+        if self.aggregate is not None:
+            return self.aggregate
+        return AggregateSpec('mean', self.sample_size)
 
     def state_filename(self) -> str:
         """
@@ -106,83 +261,609 @@ class PiFanController:
         slug = 'pifan_' + make_slug(self.name)
         return os.path.join(self.state_path, slug + '.dat')
 
+    def sdr_cache_filename(self) -> str:
+        """
+        Generate a valid filename for storing the SDR repository cache.
+        """
+        slug = 'pifan_' + make_slug(self.name)
+        return os.path.join(self.state_path, slug + '.sdr')
+
+    def history_filename(self) -> str:
+        """
+        Generate a valid filename for storing poll history.
+        """
+        return history_filename(self.state_path, self.name)
+
+    @traced('append_history')
+    def append_history(self, record: HistoryRecord) -> None:
+        """
+        Append poll record to history file, if enabled.
+        """
+        if self.history_size <= 0:
+            return
+
+        try:
+            if self.history is None:
+                self.history = HistoryFile(self.history_filename(),
+                                           self.history_size)
+            self.history.append(record)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Continuing without poll history')
+            self.history_size = 0
+
+    @traced('check_sdr_cache')
+    def check_sdr_cache(self, state: ControllerState) -> None:
+        """
+        Validate or build SDR cache and use it for all IPMI requests.
+        Forces sensor rediscovery if the BMC's SDR repository changed.
+        A cache validated less than sdr_check_interval ago is used without
+        validation.
+        """
+        self.sdr_cache_checked = True
+        if not self.use_sdr_cache:
+            return
+
+        try:
+            sdr_cache = SdrCache(self.sdr_cache_filename())
+            backends = [self.ipmi_cpu.ipmitool, self.ipmi_fan.ipmitool]
+            now = self.clock()
+            if state.sdr_check_time is not None \
+                    and 0 <= now - state.sdr_check_time \
+                    < self.sdr_check_interval \
+                    and sdr_cache.attach_unchecked(backends):
+                return
+            changed = sdr_cache.attach(backends)
+            state.sdr_check_time = now
+            if changed:
+                logger.info('SDR repository changed, rediscovering sensors')
+                state.cpu_map = {}
+                state.fan_map = {}
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Continuing without SDR cache')
+
     def load_state(self) -> ControllerState:
         """
         Load state file, if it exists.
         Otherwise, create a new object.
         """
         filename = self.state_filename()
-        if os.path.exists(filename):
-            # Parse file contents.
+        spec = self.aggregate_spec()
+        state = ControllerState()
+        state.set_aggregate_spec(spec)
+
+        try:
             with open(filename, 'rb') as state_file:
                 state_buf = state_file.read()
+        except FileNotFoundError:
+            return state
 
-            state = ControllerState()
+        # Parse file contents.
+        try:
             state.restore(state_buf)
-            state.set_sample_size(self.sample_size)
-            print(f'Loaded state from {filename}')
-            return state
+        except StateFormatError as error:
+            logger.error('Discarding state file %s: %s', filename, error)
+            state = ControllerState()
+            state.set_aggregate_spec(spec)
+        else:
+            if is_legacy_pickle(state_buf):
+                logger.info('Migrated legacy state file %s', filename)
+            logger.debug('Loaded state from %s', filename)
+            self.saved_state_buf = state_buf
 
-        # Return new object.
-        state = ControllerState()
-        state.set_sample_size(self.sample_size)
         return state
 
+    @traced('save_state')
     def save_state(self, state: ControllerState) -> None:
         """
         Save state file.
+        The file is replaced atomically so a crash or power loss leaves
+        either the old or the new state.  Unchanged state is not written.
         """
-        filename = self.state_filename()
         state_buf = state.dump()
-        with open(filename, 'wb') as state_file:
-            state_file.write(state_buf)
+        if state_buf == self.saved_state_buf:
+            return
+
+        filename = self.state_filename()
+        fd, tmp_filename = tempfile.mkstemp(
+            prefix=os.path.basename(filename) + '.', dir=self.state_path)
+        try:
+            with os.fdopen(fd, 'wb') as state_file:
+                state_file.write(state_buf)
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.unlink(tmp_filename)
+            raise
+        self.saved_state_buf = state_buf
+
+    @staticmethod
+    def _record_sensors(state: ControllerState,
+                        record: HistoryRecord) -> None:
+        """
+        Copy sensor values to history record.
+        """
+        assert state.cpu_map is not None and state.fan_map is not None
+        record.cpu_temps = [cpu.temp for cpu in state.cpu_map.values()]
+        record.fan_rpms = [fan.rpm for fan in state.fan_map.values()]
+        percents = [fan.percent() for fan in state.fan_map.values()
+                    if fan.max]
+        if percents:
+            record.fan_percent = sum(percents) / len(percents)
+
+    def _update_metrics(self, state: ControllerState,
+                        record: HistoryRecord) -> None:
+        """
+        Publish sensor values and controller outputs of a poll.
+        """
+        host = self.name
+        if state.cpu_map is not None:
+            for key, cpu in state.cpu_map.items():
+                CPU_TEMP.set(cpu.temp, host=host, sensor=key)
+        if state.fan_map is not None:
+            for key, fan in state.fan_map.items():
+                FAN_RPM.set(fan.rpm, host=host, fan=key)
+                if fan.max:
+                    FAN_PERCENT.set(fan.percent(), host=host, fan=key)
+        AGGREGATE_TEMP.set(record.agg_temp, host=host)
+        if state.applied_speed is not None:
+            APPLIED_SPEED.set(state.applied_speed, host=host)
+        for key, air in (state.air_map or {}).items():
+            AIR_TEMP.set(air.temp, host=host, sensor=key)
+        if self.inputs is not None and state.inputs.power is not None:
+            POWER.set(state.inputs.power, host=host)
+        for zone in self.zones:
+            zone_state = state.zone_state(zone.name)
+            ZONE_TEMP.set(zone_state.aggregator.value(), host=host,
+                          zone=zone.name)
+            if zone_state.applied_speed is not None:
+                ZONE_SPEED.set(zone_state.applied_speed, host=host,
+                               zone=zone.name)
+
+    def _log_summary(self, state: ControllerState, record: HistoryRecord,
+                     duration: float) -> None:
+        """
+        Log one line describing a poll.  The JSON log format gets the
+        values as separate fields.
+        """
+        zone_speeds: Dict[str, Optional[int]] = {
+            zone.name: state.zone_state(zone.name).applied_speed
+            for zone in self.zones}
+        fields = {
+            'host': self.name,
+            'cpu_temp': None if math.isnan(record.cpu_temp)
+            else record.cpu_temp,
+            'agg_temp': None if math.isnan(record.agg_temp)
+            else round(record.agg_temp, 2),
+            'suggested_speed': None if record.suggested_speed < 0
+            else record.suggested_speed,
+            'applied_speed': state.applied_speed,
+            'zone_speeds': zone_speeds if self.zones else None,
+            'fan_percent': None if math.isnan(record.fan_percent)
+            else round(record.fan_percent, 1),
+            'power': state.inputs.power if self.inputs is not None
+            else None,
+            'inlet_temp': self.ipmi_cpu.get_air_temp(state, INLET_SENSOR)
+            if self.inputs is not None else None,
+            'duration': round(duration, 3),
+            'dry_run': bool(record.flags & FLAG_DRY_RUN),
+            'suppressed': bool(record.flags & FLAG_SUPPRESSED),
+            'error': bool(record.flags & FLAG_ERROR),
+            'failsafe': bool(record.flags & FLAG_FAILSAFE),
+        }
+
+        parts = []
+        if fields['cpu_temp'] is not None:
+            parts.append(f'cpu {record.cpu_temp:0.0f}C')
+        if record.flags & FLAG_READY:
+            parts.append(f'aggregate {record.agg_temp:0.1f}C')
+            parts.append(f'suggested {record.suggested_speed}%')
+        elif record.flags & FLAG_ERROR:
+            pass
+        elif record.flags & FLAG_FAILSAFE:
+            # Escalated to max fan speed before the aggregate was ready.
+            parts.append(f'suggested {record.suggested_speed}%')
+        else:
+            parts.append(f'collecting {self._progress(state)}')
+        if state.applied_speed is not None:
+            parts.append(f'applied {state.applied_speed}%'
+                         + (' (write skipped)' if fields['suppressed']
+                            else ''))
+        zone_parts = [f'{name} {speed}%' for name, speed
+                      in zone_speeds.items() if speed is not None]
+        if zone_parts:
+            parts.append('zones ' + ', '.join(zone_parts))
+        if fields['fan_percent'] is not None:
+            parts.append(f'fans {record.fan_percent:0.0f}%')
+        if fields['power'] is not None:
+            parts.append(f'power {fields["power"]:0.0f}W')
+        if fields['inlet_temp'] is not None:
+            parts.append(f'inlet {fields["inlet_temp"]:0.0f}C')
+        if fields['dry_run']:
+            parts.append('dry run')
+        if fields['failsafe']:
+            parts.append('failsafe')
+        if fields['error']:
+            parts.append('failed')
+        parts.append(f'{duration:0.2f}s')
+
+        logger.log(logging.WARNING if fields['error'] else logging.INFO,
+                   '%s: %s', self.name, ', '.join(parts),
+                   extra={'fields': fields})
+
+    def _parallel(self) -> bool:
+        """
+        Check if IPMI requests of a poll may run concurrently.  Start
+        executor on first use.
+        """
+        if self.concurrency <= 1 \
+                or not self.ipmi_cpu.ipmitool.parallel_requests \
+                or not self.ipmi_fan.ipmitool.parallel_requests:
+            return False
+        if self.executor is None:
+            set_bmc_concurrency(self.name, self.concurrency)
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.concurrency - 1,
+                thread_name_prefix=f'pifan-{self.name}')
+        return True
+
+    def _discover_sensors(self, state: ControllerState) -> None:
+        """
+        Discover fans and CPUs, concurrently if allowed.
+        """
+        if not self._parallel():
+            self.ipmi_fan.discover_sensors(state)
+            self.ipmi_cpu.discover_sensors(state)
+            return
+
+        assert self.executor is not None
+        cpu_discovery = self.executor.submit(self.ipmi_cpu.discover_sensors,
+                                             state)
+        try:
+            self.ipmi_fan.discover_sensors(state)
+        finally:
+            cpu_discovery.result()
+
+    def _ready(self, state: ControllerState) -> bool:
+        """
+        Check if the CPU temp aggregate and those of all zones are full.
+        """
+        return state.aggregator.ready() \
+            and all(state.zone_state(zone.name).aggregator.ready()
+                    for zone in self.zones)
+
+    def _progress(self, state: ControllerState) -> str:
+        """
+        Describe how full the first incomplete aggregate is.
+        """
+        for zone in self.zones:
+            aggregator = state.zone_state(zone.name).aggregator
+            if state.aggregator.ready() and not aggregator.ready():
+                return f'zone {zone.name} {aggregator.progress()}'
+        return state.aggregator.progress()
+
+    def _over_max_temp(self, state: ControllerState, cpu_temp: float) -> bool:
+        """
+        Check if the hottest CPU reading, or that of a zone with a lower max
+        temp, is at or above max temp.
+        """
+        if cpu_temp >= self.max_temp:
+            return True
+        for zone in self.zones:
+            if zone.max_temp is not None and zone.max_temp < self.max_temp \
+                    and self.ipmi_cpu.get_zone_cpu_temp(
+                        state, zone.cpus) >= zone.max_temp:
+                return True
+        return False
+
+    def _escalate(self, state: ControllerState) -> int:
+        """
+        Set all fans to max speed at once, bypassing the aggregate.
+        Return speed now in effect.
+        """
+        speed = self.actuator.apply(state, self.max_fan)
+        for zone in self.zones:
+            zone_state = state.zone_state(zone.name)
+            zone_state.applied_speed = speed
+            zone_state.applied_time = state.applied_time
+        return speed
+
+    def _failsafe(self, state: ControllerState,
+                  record: Optional[HistoryRecord] = None) -> None:
+        """
+        Restore dynamic fan mode after too many consecutive failed polls,
+        so the BMC takes over instead of leaving fans at a static speed.
+        Retried on later failed polls until it succeeds.
+        """
+        if self.dry_run or self.failsafe_polls <= 0 \
+                or state.failed_polls < self.failsafe_polls \
+                or (state.failed_polls > self.failsafe_polls
+                    and not state.static_fans):
+            return
+        logger.warning('%s: %d consecutive polls failed, restoring dynamic '
+                       'fan mode', self.name, state.failed_polls)
+        if record is not None:
+            record.flags |= FLAG_FAILSAFE
+        try:
+            self.actuator.restore_dynamic(state)
+        except IpmiError as error:
+            logger.error('%s: failed to restore dynamic fan mode: %s',
+                         self.name, error)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('%s: failed to restore dynamic fan mode',
+                             self.name)
+
+    def release_fans(self, state: ControllerState,
+                     force: bool = False) -> bool:
+        """
+        Give fan control back to the BMC, e.g. on exit.  In dry run mode,
+        only if forced, e.g. when dry run was switched on at runtime.
+        Return True on success.
+        """
+        if self.dry_run and not force:
+            return True
+        try:
+            self.actuator.restore_dynamic(state)
+            self.save_state(state)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('%s: failed to restore dynamic fan mode',
+                             self.name)
+            return False
+        logger.info('%s: restored dynamic fan mode', self.name)
+        return True
+
+    def _read_power(self, state: ControllerState, now: float) -> None:
+        """
+        Add a DCMI power reading to the power average, if power input is
+        enabled.  A failed reading only disables feed forward for this poll.
+        """
+        if self.inputs is None or self.inputs.spec.power_gain <= 0:
+            return
+        try:
+            power = self.ipmi_cpu.ipmitool.dcmi_power_reading()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning('%s: no power reading: %s', self.name, error)
+            state.inputs.power = None
+            return
+        self.inputs.add_power(state.inputs, power, now)
+
+    def _adjust_speed(self, state: ControllerState, speed: int) -> int:
+        """
+        Adjust a suggested fan speed with power, inlet and exhaust readings.
+        """
+        if self.inputs is None:
+            return speed
+        adjusted = self.inputs.adjust(
+            speed, state.inputs,
+            self.ipmi_cpu.get_air_temp(state, INLET_SENSOR),
+            self.ipmi_cpu.get_air_temp(state, EXHAUST_SENSOR), self.max_fan)
+        if adjusted != speed:
+            logger.debug('Adjusted fan speed by inputs: %d%% -> %d%%', speed,
+                         adjusted)
+        return adjusted
+
+    def _check_zone_fans(self, state: ControllerState) -> None:
+        """
+        Warn about discovered fans outside of any zone, which keep their
+        last speed, and zone fans that weren't discovered.
+        """
+        self.zone_fans_checked = True
+        assert state.fan_map is not None
+        zone_fans = {fan for zone in self.zones for fan in zone.fans}
+        fans = {int(name[3:]) for name in state.fan_map}
+        for fan in sorted(fans - zone_fans):
+            logger.warning('%s: Fan%d is not in any fan zone', self.name, fan)
+        for fan in sorted(zone_fans - fans):
+            logger.warning('%s: Fan%d of a fan zone was not discovered',
+                           self.name, fan)
+
+    def _add_zone_temps(self, state: ControllerState,
+                        now: float) -> Dict[str, float]:
+        """
+        Add max CPU temp of each zone to its aggregate.
+        Return new aggregate values by zone name.
+        """
+        return {zone.name: state.zone_state(zone.name).aggregator.add(
+            self.ipmi_cpu.get_zone_cpu_temp(state, zone.cpus), now)
+                for zone in self.zones}
+
+    def _control_zones(self, state: ControllerState,
+                       zone_temps: Dict[str, float], now: float) -> int:
+        """
+        Suggest and apply a fan speed for each zone.
+        Return highest suggested speed.
+        """
+        suggested = -1
+        for zone in self.zones:
+            speed = self._adjust_speed(state, self.suggest_zone_speed(
+                zone, zone_temps[zone.name], state, now))
+            logger.debug('Zone %s at %0.1fC, suggested fan speed: %d%%',
+                         zone.name, zone_temps[zone.name], speed)
+            suggested = max(suggested, speed)
+            if not self.dry_run:
+                self.actuator.apply(state, speed, zone)
+
+        # Report the fastest zone as the applied speed.  Leave applied time
+        # unset so writes to all fans aren't skipped if zones are removed.
+        speeds = [state.zone_state(zone.name).applied_speed
+                  for zone in self.zones]
+        if any(speed is not None for speed in speeds):
+            state.applied_speed = max(speed for speed in speeds
+                                      if speed is not None)
+            state.applied_time = None
+        return suggested
+
+    def next_interval(self, state: ControllerState) -> float:
+        """
+        Seconds from start of last poll until the next poll.
+        """
+        if self.adaptive is None or state.poll_interval is None:
+            return float(self.interval)
+        return state.poll_interval
 
     def poll(self, state: ControllerState) -> None:
         """
         Poll fan and CPU sensors and adjust fan speed according to easing
         algorithm.
         """
-        # Discover sensors if not set in state.
-        if state.fan_map is None or state.cpu_map is None:
-            print('--- Discover sensors')
-            self.ipmi_fan.discover_sensors(state)
-            self.ipmi_cpu.discover_sensors(state)
+        with TRACER.span('poll', host=self.name):
+            try:
+                self._poll(state)
+            except Exception:
+                # Sensor discovery failed, e.g. the BMC is unreachable.
+                state.failed_polls += 1
+                state.sdr_check_time = None
+                self._failsafe(state)
+                raise
+
+    def _prepare_sensors(self, state: ControllerState) -> None:
+        """
+        Check the SDR cache, discover sensors if not set in state and check
+        fans of zones, as needed before reading sensors.
+        """
+        if not self.sdr_cache_checked:
+            self.check_sdr_cache(state)
+
+        if not state.fan_map or not state.cpu_map \
+                or (self.inputs is not None and state.air_map is None):
+            logger.info('Discovering sensors')
+            DISCOVERY_RUNS.inc(host=self.name)
+            with TRACER.span('discover_sensors'):
+                self._discover_sensors(state)
             self.save_state(state)
+        if self.zones and not self.zone_fans_checked:
+            self._check_zone_fans(state)
+
+    def _poll(self, state: ControllerState) -> None:
+        perf_start = time.perf_counter()
+        self._prepare_sensors(state)
+
+        now = self.clock()
+        self.poll_start_time = datetime.fromtimestamp(now)
+        logger.debug('--- Poll start: %s', self.name)
 
-        self.poll_start_time = datetime.now()
-        print('\n--- Poll start: ' + self.poll_start_time.strftime('%x %X'))
+        record = HistoryRecord()
+        record.time = now
+        if self.dry_run:
+            record.flags |= FLAG_DRY_RUN
+        suppressed_writes = state.suppressed_writes
 
+        fan_read: Optional[Future] = None
         try:
-            # Get current CPU temps and aggregate.
-            self.ipmi_cpu.read_sensors(state)
+            if self._parallel():
+                # Read fan speeds in the background while the control path
+                # reads CPU temps and sets fan speed.
+                assert self.executor is not None
+                fan_read = self.executor.submit(self.ipmi_fan.read_speeds,
+                                                state)
+                self.ipmi_cpu.read_sensors(state)
+            else:
+                # Get current CPU temps and fan speeds in one request.
+                self.snapshot.read_sensors(state,
+                                           air=self.inputs is not None)
+            self._read_power(state, now)
             cpu_temp = self.ipmi_cpu.get_max_cpu_temp(state)
-            agg_cpu_temp = state.add_aggregate_temp(cpu_temp)
+            agg_cpu_temp = state.add_aggregate_temp(cpu_temp, now)
+            zone_temps = self._add_zone_temps(state, now)
+            if fan_read is None:
+                self._record_sensors(state, record)
+            record.cpu_temp = cpu_temp
+
+            if self.adaptive is not None:
+                self.adaptive.update(state, agg_cpu_temp, now,
+                                     self.ideal_temp, self.max_temp)
+
+            self._control(state, record, agg_cpu_temp, zone_temps, now)
+
+            if fan_read is not None:
+                fan_read.result()
+                self._record_sensors(state, record)
+
+        except Exception as error:  # pylint: disable=broad-except
+            if isinstance(error, IpmiError):
+                # The BMC didn't answer or rejected a request; a traceback
+                # adds nothing.
+                logger.error('%s: poll failed: %s', self.name, error)
+            else:
+                logger.exception('%s: poll failed', self.name)
+            record.flags |= FLAG_ERROR
+            if fan_read is not None:
+                # Don't save state while the fan read is updating it.
+                wait([fan_read])
 
-            # Save state to file for use with --one mode or if polling was
-            # restarted.
-            self.save_state(state)
+        self._finish_poll(state, record, suppressed_writes, perf_start)
 
-            num_samples = len(state.samples)
-            if num_samples < state.sample_size:
-                # Need more samples before proceeding.
-                print(f'Collected {num_samples}/{state.sample_size} '
-                      'samples.')
+    def _control(self, state: ControllerState, record: HistoryRecord,
+                 agg_cpu_temp: float, zone_temps: Dict[str, float],
+                 now: float) -> None:
+        """
+        Escalate, wait for more samples or set fan speed from the
+        aggregate temperature, as the poll's readings call for.
+        """
+        cpu_temp = record.cpu_temp
+        if self._over_max_temp(state, cpu_temp):
+            # Don't wait for the aggregate to catch up.
+            logger.warning('%s: CPU at %0.0fC, at or above max temp, '
+                           'setting fans to %d%%', self.name, cpu_temp,
+                           self.max_fan)
+            record.flags |= FLAG_FAILSAFE
+            record.suggested_speed = self.max_fan
+            if not self.dry_run:
+                self._escalate(state)
+
+        elif not self._ready(state):
+            # Need more samples before proceeding.
+            logger.debug('Collected %s.', self._progress(state))
 
+        else:
+            # Set fan speed.
+            logger.debug('Aggregate CPU temperature: %0.1fC', agg_cpu_temp)
+            record.flags |= FLAG_READY
+            record.agg_temp = agg_cpu_temp
+            if self.zones:
+                record.suggested_speed = self._control_zones(
+                    state, zone_temps, now)
             else:
-                # Set fan speed.
-                print(f'Aggregate CPU temperature: {agg_cpu_temp:0.1f}C')
-                speed = self.suggest_fan_speed(agg_cpu_temp)
-                print(f'Suggested fan speed: {speed}%')
-
+                speed = self._adjust_speed(state, self.suggest_fan_speed(
+                    agg_cpu_temp, state, now))
+                logger.debug('Suggested fan speed: %d%%', speed)
+                record.suggested_speed = speed
                 if not self.dry_run:
-                    self.ipmi_fan.set_fan_speed(speed)
-                else:
-                    print('Dry run mode: not calling set_fan_speed()')
-
-                self.ipmi_fan.read_sensors(state)
+                    self.actuator.apply(state, speed)
 
-        except Exception:  # pylint: disable=broad-except
-            print(traceback.format_exc())
+            if self.dry_run:
+                logger.debug('Dry run mode: not calling set_fan_speed()')
 
-        self.poll_end_time = datetime.now()
-        print('--- Poll end: ' + self.poll_end_time.strftime('%x %X'))
+    def _finish_poll(self, state: ControllerState, record: HistoryRecord,
+                     suppressed_writes: int, perf_start: float) -> None:
+        """
+        Apply failsafe after a failed poll, save state and report the poll
+        to history, metrics and log.
+        """
+        if record.flags & FLAG_ERROR:
+            state.failed_polls += 1
+            # Validate the SDR cache next run, in case sensors changed.
+            state.sdr_check_time = None
+            self._failsafe(state, record)
+        else:
+            state.failed_polls = 0
+
+        # Save state to file for use with --count mode or if polling was
+        # restarted.  Includes samples and the applied fan speed.
+        self.save_state(state)
+
+        if state.applied_speed is not None:
+            record.applied_speed = state.applied_speed
+        if state.suppressed_writes != suppressed_writes:
+            record.flags |= FLAG_SUPPRESSED
+            SUPPRESSED_WRITES.inc(state.suppressed_writes - suppressed_writes,
+                                  host=self.name)
+        self.append_history(record)
+        self.last_record = record
+        self._update_metrics(state, record)
+        duration = time.perf_counter() - perf_start
+        POLL_DURATION.observe(duration, host=self.name)
+        self._log_summary(state, record, duration)
+
+        self.poll_end_time = datetime.fromtimestamp(self.clock())
+        logger.debug('--- Poll end: %s', self.name)
@@ -0,0 +1,143 @@
+"""
+PID fan speed controller.
+"""
+
+from typing import Optional, Tuple
+
+
+class PidState:
+    """
+    Persistent state of PidController, kept in ControllerState.
+    """
+    # Integral term, in fan percent.
+    integral: float
+
+    last_temp: Optional[float]
+
+    # Epoch seconds of last update.
+    last_time: Optional[float]
+
+    # Last output fan percent.
+    output: Optional[float]
+
+    def __init__(self) -> None:
+        self.integral = 0.0
+        self.last_temp = None
+        self.last_time = None
+        self.output = None
+
+    def __str__(self) -> str:
+        return (f'PidState: integral={self.integral:0.2f}, '
+                f'last_temp={self.last_temp}, output={self.output}')
+
+
+class PidController:
+    """
+    PID controller driving fan percent to hold a CPU temperature setpoint.
+
+    Error is temperature above setpoint, so fans speed up when hot.  The
+    derivative acts on temperature rather than error so setpoint changes
+    don't kick the output.  The integral term is clamped to the output
+    range and frozen while the output saturates (anti-windup).  Output
+    changes are limited to slew_rate percent per second.
+    """
+    # Fan percent per degree C.
+    kp: float
+
+    # Fan percent per degree C second.
+    ki: float
+
+    # Fan percent per degree C per second.
+    kd: float
+
+    # Max output change in fan percent per second, 0=unlimited.
+    slew_rate: float
+
+    min_output: float
+
+    max_output: float
+
+    # Skip integral, derivative and slew terms when updates are further
+    # apart than this many seconds, e.g. after the controller was stopped.
+    max_gap: float
+
+    def __init__(self, kp: float = 4.0, ki: float = 0.02, kd: float = 10.0,
+                 slew_rate: float = 1.0) -> None:
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.slew_rate = slew_rate
+        self.min_output = 0.0
+        self.max_output = 100.0
+        self.max_gap = 600.0
+
+    def __str__(self) -> str:
+        return (f'PidController: kp={self.kp}, ki={self.ki}, kd={self.kd}, '
+                f'slew_rate={self.slew_rate}')
+
+    def _clamp(self, value: float) -> float:
+        return max(self.min_output, min(self.max_output, value))
+
+    def update(self, state: PidState, temp: float, setpoint: float,
+               now: float) -> float:
+        """
+        Compute fan percent for temperature measured at epoch seconds now.
+        Updates state.
+        """
+        error = temp - setpoint
+        elapsed: Optional[float] = None
+        if state.last_time is not None:
+            elapsed = now - state.last_time
+            if elapsed <= 0 or elapsed > self.max_gap:
+                elapsed = None
+
+        proportional = self.kp * error
+        derivative = 0.0
+        integral = state.integral
+        if elapsed is not None:
+            assert state.last_temp is not None
+            derivative = self.kd * (temp - state.last_temp) / elapsed
+            integral = self._clamp(integral + self.ki * error * elapsed)
+
+            # Don't wind up further while saturated.
+            unlimited = proportional + integral + derivative
+            if (unlimited > self.max_output and error > 0) \
+                    or (unlimited < self.min_output and error < 0):
+                integral = state.integral
+
+        output = self._clamp(proportional + integral + derivative)
+
+        if elapsed is not None and state.output is not None \
+                and self.slew_rate > 0:
+            max_change = self.slew_rate * elapsed
+            output = max(state.output - max_change,
+                         min(state.output + max_change, output))
+
+        state.integral = integral
+        state.last_temp = temp
+        state.last_time = now
+        state.output = output
+        return output
+
+    def reset(self, state: PidState) -> None:
+        """
+        Discard integral and history.
+        """
+        state.integral = 0.0
+        state.last_temp = None
+        state.last_time = None
+        state.output = None
+
+
+def parse_pid_gains(text: str) -> Tuple[float, float, float]:
+    """
+    Parse PID gains string KP,KI,KD.
+    """
+    parts = text.split(',')
+    if len(parts) != 3:
+        raise ValueError(f'Invalid PID gains "{text}", expected KP,KI,KD')
+    try:
+        kp, ki, kd = (float(part) for part in parts)
+    except ValueError as error:
+        raise ValueError(f'Invalid PID gains "{text}"') from error
+    return kp, ki, kd
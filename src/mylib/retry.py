@@ -0,0 +1,235 @@
+"""
+Per-BMC request deadlines, retries and circuit breaker.
+Like the concurrency limit, settings and breaker state are shared by every
+backend talking to the same BMC.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional
+from .ipmi_errors import TRANSIENT_ERRORS, IpmiTimeoutError, \
+    IpmiUnavailableError
+from .metrics import BREAKER_OPEN, IPMI_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Seconds an ipmitool attempt may take unless configured.
+DEFAULT_TIMEOUT = 15.0
+
+# Retries of a transient failure unless configured.
+DEFAULT_RETRIES = 2
+
+
+class RetryPolicy:
+    """
+    Deadline and retries of a request.
+    """
+    # Seconds an attempt may take before it's abandoned.
+    timeout: float
+
+    # Retries after a transient failure, 0=none.
+    retries: int
+
+    # Max delay before the first retry in seconds, doubled for each retry.
+    # The actual delay is random up to the max, so requests of several
+    # controllers don't retry in lockstep.
+    backoff: float
+
+    max_backoff: float
+
+    # Seconds a request may take including retries.
+    deadline: float
+
+    def __init__(self, timeout: float = DEFAULT_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES) -> None:
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = 0.5
+        self.max_backoff = 4.0
+        self.deadline = 2 * timeout
+
+    def __str__(self) -> str:
+        return (f'RetryPolicy: timeout={self.timeout}s, '
+                f'retries={self.retries}, deadline={self.deadline}s')
+
+
+class Attempts:
+    """
+    Attempts of one request under a retry policy.
+    """
+    policy: RetryPolicy
+
+    # Retries made so far.
+    retries: int
+
+    start: float
+
+    def __init__(self, policy: RetryPolicy) -> None:
+        self.policy = policy
+        self.retries = 0
+        self.start = time.monotonic()
+
+    def timeout(self) -> float:
+        """
+        Seconds the next attempt may take.
+        """
+        remaining = self.start + self.policy.deadline - time.monotonic()
+        if remaining <= 0:
+            raise IpmiTimeoutError('Request deadline exceeded')
+        return min(self.policy.timeout, remaining)
+
+    def retry(self, host: str, command: str, error: Exception) -> bool:
+        """
+        Wait before retrying a failed attempt.
+        Return False if the request should fail instead.
+        """
+        if not isinstance(error, TRANSIENT_ERRORS) \
+                or self.retries >= self.policy.retries:
+            return False
+        delay = random.uniform(0, min(self.policy.max_backoff,
+                                      self.policy.backoff * 2 ** self.retries))
+        if time.monotonic() + delay >= self.start + self.policy.deadline:
+            return False
+
+        self.retries += 1
+        logger.warning('%s: %s failed: %s, retry %d of %d in %0.1fs', host,
+                       command, error, self.retries, self.policy.retries,
+                       delay)
+        IPMI_RETRIES.inc(host=host, command=command)
+        time.sleep(delay)
+        return True
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a BMC after repeated transient failures, so a
+    flapping BMC fails polls at once instead of stalling each of them for
+    the full deadline.  After a pause, one request is let through to probe
+    the BMC; the pause doubles each time the probe fails.
+    """
+    host: str
+
+    # Consecutive transient failures that open the breaker.
+    threshold: int
+
+    # Seconds of the first pause.
+    pause: float
+
+    max_pause: float
+
+    failures: int
+
+    # Monotonic time requests may resume, if open.
+    open_until: Optional[float]
+
+    # Pause of the current or last opening.
+    current_pause: float
+
+    # A probe request was let through and hasn't reported yet.
+    probing: bool
+
+    def __init__(self, host: str, threshold: int = 5, pause: float = 30.0,
+                 max_pause: float = 300.0) -> None:
+        self.host = host
+        self.threshold = threshold
+        self.pause = pause
+        self.max_pause = max_pause
+        self.failures = 0
+        self.open_until = None
+        self.current_pause = pause
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def check(self, critical: bool = False) -> None:
+        """
+        Raise IpmiUnavailableError if a request may not be sent now.
+        Critical requests, such as restoring dynamic fan mode, are always
+        sent.
+        """
+        with self._lock:
+            if self.open_until is None or critical:
+                return
+            now = time.monotonic()
+            if now < self.open_until:
+                raise IpmiUnavailableError(
+                    f'BMC {self.host} is unavailable after {self.failures} '
+                    'failed requests')
+            # Let this request probe the BMC.  Others wait for its result,
+            # or for another pause if it never reports one.
+            self.probing = True
+            self.open_until = now + self.current_pause
+
+    def record(self, error: Optional[Exception]) -> None:
+        """
+        Record the outcome of a request, None for success.
+        """
+        with self._lock:
+            if error is None or not isinstance(error, TRANSIENT_ERRORS):
+                # The BMC answered.
+                if self.open_until is not None:
+                    logger.info('%s: BMC responding again', self.host)
+                    BREAKER_OPEN.set(0, host=self.host)
+                self.failures = 0
+                self.open_until = None
+                self.current_pause = self.pause
+                self.probing = False
+                return
+
+            self.failures += 1
+            if self.open_until is not None:
+                if not self.probing:
+                    # Sent before the pause, or critical.
+                    return
+                self.probing = False
+                self.current_pause = min(self.max_pause,
+                                         2 * self.current_pause)
+            elif self.failures < self.threshold:
+                return
+            self.open_until = time.monotonic() + self.current_pause
+            logger.warning('%s: %d consecutive IPMI failures, pausing '
+                           'requests for %gs', self.host, self.failures,
+                           self.current_pause)
+            BREAKER_OPEN.set(1, host=self.host)
+
+
+_policies: Dict[str, RetryPolicy] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def set_bmc_retry_policy(host: str, policy: RetryPolicy) -> None:
+    """
+    Set retry policy of requests to host.
+    """
+    if policy.timeout <= 0:
+        raise ValueError(f'Invalid IPMI timeout {policy.timeout}')
+    if policy.retries < 0:
+        raise ValueError(f'Invalid IPMI retries {policy.retries}')
+    with _lock:
+        _policies[host] = policy
+
+
+def bmc_retry_policy(host: str) -> RetryPolicy:
+    """
+    Retry policy of requests to host.
+    """
+    with _lock:
+        policy = _policies.get(host)
+        if policy is None:
+            policy = RetryPolicy()
+            _policies[host] = policy
+        return policy
+
+
+def bmc_breaker(host: str) -> CircuitBreaker:
+    """
+    Circuit breaker of requests to host.
+    """
+    with _lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host)
+            _breakers[host] = breaker
+        return breaker
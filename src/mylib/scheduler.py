@@ -0,0 +1,151 @@
+"""
+Drift-free poll scheduler on the monotonic clock.
+"""
+
+import time
+from typing import Callable, Optional
+
+OVERRUN_POLICIES = ['skip', 'catch-up']
+
+
+class ScheduleStats:
+    """
+    Jitter and overrun counters of a PollScheduler.
+    """
+    polls: int
+
+    # Polls that ended after the next poll was due.
+    overruns: int
+
+    # Scheduled polls dropped because of overruns.
+    skipped: int
+
+    # Seconds a poll started after its deadline.
+    last_jitter: float
+
+    max_jitter: float
+
+    total_jitter: float
+
+    def __init__(self) -> None:
+        self.polls = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def __str__(self) -> str:
+        return (f'ScheduleStats: polls={self.polls}, '
+                f'overruns={self.overruns}, skipped={self.skipped}, '
+                f'jitter mean={self.mean_jitter() * 1000:0.1f}ms '
+                f'max={self.max_jitter * 1000:0.1f}ms')
+
+    def mean_jitter(self) -> float:
+        """
+        Mean seconds a poll started after its deadline.
+        """
+        return self.total_jitter / self.polls if self.polls else 0.0
+
+
+class PollScheduler:
+    """
+    Schedule polls at absolute deadlines on the monotonic clock, so wall
+    clock steps don't distort the schedule and poll overhead doesn't
+    accumulate as drift.
+
+    When a poll ends after the next deadline, the skip policy drops the
+    missed deadlines and continues on the original grid.  The catch-up
+    policy runs missed polls back to back, up to max_backlog of them.
+    """
+    interval: float
+
+    overrun: str
+
+    max_backlog: int
+
+    # Deadline of next poll in monotonic seconds.
+    deadline: float
+
+    # Deadlines passed, polled or skipped.
+    slots: int
+
+    stats: ScheduleStats
+
+    clock: Callable[[], float]
+
+    def __init__(self, interval: float, overrun: str = 'skip',
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f'Invalid overrun policy "{overrun}"')
+        self.interval = interval
+        self.overrun = overrun
+        self.max_backlog = 3
+        self.clock = clock
+        self.deadline = clock()
+        self.slots = 0
+        self.stats = ScheduleStats()
+
+    def start(self, delay: float = 0.0) -> None:
+        """
+        Schedule first poll delay seconds from now.
+        """
+        self.deadline = self.clock() + max(0.0, delay)
+        self.slots = 0
+
+    def delay(self) -> float:
+        """
+        Seconds until next poll is due.
+        """
+        return max(0.0, self.deadline - self.clock())
+
+    def wait(self) -> None:
+        """
+        Sleep until next poll is due.
+        """
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+    def begin(self) -> None:
+        """
+        Record start of the due poll.
+        """
+        jitter = max(0.0, self.clock() - self.deadline)
+        stats = self.stats
+        stats.polls += 1
+        stats.last_jitter = jitter
+        stats.max_jitter = max(stats.max_jitter, jitter)
+        stats.total_jitter += jitter
+
+    def skip(self) -> None:
+        """
+        Record the due poll as skipped, e.g. because the previous poll is
+        still running.
+        """
+        self.stats.skipped += 1
+
+    def advance(self, interval: Optional[float] = None) -> int:
+        """
+        Schedule next poll interval seconds after the last deadline,
+        default self.interval.  Apply overrun policy if that time has
+        already passed.
+        Return number of deadlines skipped.
+        """
+        if interval is None:
+            interval = self.interval
+        self.slots += 1
+        self.deadline += interval
+        now = self.clock()
+        if now <= self.deadline:
+            return 0
+
+        self.stats.overruns += 1
+        late = int((now - self.deadline) // interval)
+        skipped = late + 1
+        if self.overrun == 'catch-up':
+            skipped = max(0, late + 1 - self.max_backlog)
+        self.deadline += skipped * interval
+        self.slots += skipped
+        self.stats.skipped += skipped
+        return skipped
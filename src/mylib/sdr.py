@@ -0,0 +1,266 @@
+"""
+Sensor Data Record (SDR) parsing and sensor reading conversion.
+Used by the native IPMI client to answer `sdr type` and `sdr get` queries.
+"""
+
+from typing import Dict, List, Optional
+
+
+RECORD_FULL_SENSOR = 0x01
+RECORD_COMPACT_SENSOR = 0x02
+
+# Event/reading type code for threshold based sensors.
+READING_TYPE_THRESHOLD = 0x01
+
+# ipmitool sensor type names -> IPMI sensor type codes.
+SENSOR_TYPES: Dict[str, int] = {
+    'temperature': 0x01,
+    'voltage': 0x02,
+    'current': 0x03,
+    'fan': 0x04,
+    'physical security': 0x05,
+    'processor': 0x07,
+    'power supply': 0x08,
+    'power unit': 0x09,
+    'memory': 0x0c,
+}
+
+# IPMI base unit codes -> ipmitool unit names.
+UNITS: Dict[int, str] = {
+    1: 'degrees C',
+    2: 'degrees F',
+    3: 'degrees K',
+    4: 'Volts',
+    5: 'Amps',
+    6: 'Watts',
+    7: 'Joules',
+    18: 'RPM',
+    19: 'Hz',
+}
+
+
+def _signed(value: int, bits: int) -> int:
+    if value & (1 << (bits - 1)):
+        return value - (1 << bits)
+    return value
+
+
+def format_number(value: float) -> str:
+    """
+    Format a converted reading the way ipmitool does for brief output.
+    """
+    if value == int(value):
+        return str(int(value))
+    return f'{value:.2f}'
+
+
+def threshold_status(unavailable: bool, state: int) -> str:
+    """
+    Sensor status column for a threshold sensor, as printed by ipmitool.
+    """
+    if unavailable:
+        return 'ns'
+    if state & 0x24:
+        return 'nr'
+    if state & 0x12:
+        return 'cr'
+    if state & 0x09:
+        return 'nc'
+    return 'ok'
+
+
+class SdrRecord:
+    """
+    Full or compact sensor data record.
+    """
+    record_id: int
+
+    record_type: int
+
+    owner: int
+
+    lun: int
+
+    number: int
+
+    entity_id: int
+
+    entity_instance: int
+
+    sensor_type: int
+
+    reading_type: int
+
+    analog_format: int
+
+    base_unit: int
+
+    m: int
+
+    b: int
+
+    b_exp: int
+
+    r_exp: int
+
+    tolerance: int
+
+    nominal: Optional[int]
+
+    normal_max: Optional[int]
+
+    normal_min: Optional[int]
+
+    name: str
+
+    raw: bytes
+
+    def __init__(self) -> None:
+        self.record_id = 0
+        self.record_type = 0
+        self.owner = 0x20
+        self.lun = 0
+        self.number = 0
+        self.entity_id = 0
+        self.entity_instance = 0
+        self.sensor_type = 0
+        self.reading_type = 0
+        # Analog data format: 0=unsigned, 1=1's complement,
+        # 2=2's complement, 3=no analog reading.
+        self.analog_format = 3
+        self.base_unit = 0
+        self.m = 1
+        self.b = 0
+        self.b_exp = 0
+        self.r_exp = 0
+        self.tolerance = 0
+        self.nominal = None
+        self.normal_max = None
+        self.normal_min = None
+        self.name = ''
+        self.raw = b''
+
+    def __str__(self) -> str:
+        return (f'SdrRecord: name={self.name}, number={self.number:#x}, '
+                f'type={self.sensor_type:#x}')
+
+    def is_analog(self) -> bool:
+        """
+        True if the sensor returns a convertible analog reading.
+        """
+        return (self.record_type == RECORD_FULL_SENSOR
+                and self.analog_format != 3)
+
+    def convert(self, raw_value: int) -> float:
+        """
+        Convert a raw reading byte using the record's linear formula:
+        y = (M * x + B * 10^Bexp) * 10^Rexp
+        """
+        if self.analog_format == 1:
+            value = _signed(raw_value, 8)
+            if value < 0:
+                value += 1
+        elif self.analog_format == 2:
+            value = _signed(raw_value, 8)
+        else:
+            value = raw_value
+
+        result = (self.m * value + self.b * 10.0 ** self.b_exp) \
+            * 10.0 ** self.r_exp
+        return round(result, 6)
+
+    def unit_name(self) -> str:
+        """
+        Unit name, as printed by ipmitool.
+        """
+        return UNITS.get(self.base_unit, 'unspecified')
+
+    def format_reading(self, raw_value: int) -> str:
+        """
+        Format a raw reading as ipmitool's brief reading column.
+        """
+        if not self.is_analog():
+            return f'{raw_value:#04x}'
+        value = format_number(self.convert(raw_value))
+        return f'{value} {self.unit_name()}'
+
+    def entity(self) -> str:
+        """
+        Entity ID and instance, as printed by ipmitool.
+        """
+        return f'{self.entity_id}.{self.entity_instance}'
+
+
+def parse_sdr_record(raw: bytes) -> Optional[SdrRecord]:
+    """
+    Parse a raw SDR record, including its 5 byte header.
+    Return None for record types other than full or compact sensors.
+    """
+    if len(raw) < 5:
+        return None
+
+    record_type = raw[3]
+    if record_type not in (RECORD_FULL_SENSOR, RECORD_COMPACT_SENSOR):
+        return None
+
+    record = SdrRecord()
+    record.raw = bytes(raw)
+    record.record_id = raw[0] | (raw[1] << 8)
+    record.record_type = record_type
+    record.owner = raw[5]
+    record.lun = raw[6] & 0x03
+    record.number = raw[7]
+    record.entity_id = raw[8]
+    record.entity_instance = raw[9] & 0x7f
+    record.sensor_type = raw[12]
+    record.reading_type = raw[13]
+    record.analog_format = raw[20] >> 6
+    record.base_unit = raw[21]
+
+    if record_type == RECORD_FULL_SENSOR:
+        record.m = _signed(raw[24] | ((raw[25] & 0xc0) << 2), 10)
+        record.tolerance = raw[25] & 0x3f
+        record.b = _signed(raw[26] | ((raw[27] & 0xc0) << 2), 10)
+        record.r_exp = _signed(raw[29] >> 4, 4)
+        record.b_exp = _signed(raw[29] & 0x0f, 4)
+        flags = raw[30]
+        record.nominal = raw[31] if flags & 0x01 else None
+        record.normal_max = raw[32] if flags & 0x02 else None
+        record.normal_min = raw[33] if flags & 0x04 else None
+        name_offset = 47
+    else:
+        # Compact records have no analog reading.
+        record.analog_format = 3
+        name_offset = 31
+
+    if len(raw) > name_offset:
+        length = raw[name_offset] & 0x1f
+        name = raw[name_offset + 1:name_offset + 1 + length]
+        record.name = name.decode('ascii', 'replace').rstrip('\x00 ')
+
+    return record
+
+
+def parse_sdr_records(raw_records: List[bytes]) -> List[SdrRecord]:
+    """
+    Parse a list of raw SDR records, skipping unsupported types.
+    """
+    records = []
+    for raw in raw_records:
+        record = parse_sdr_record(raw)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def split_sdr_dump(data: bytes) -> List[bytes]:
+    """
+    Split raw SDR records, as written by `ipmitool sdr dump`.
+    """
+    raw_records = []
+    offset = 0
+    while offset + 5 <= len(data):
+        length = data[offset + 4] + 5
+        raw_records.append(data[offset:offset + length])
+        offset += length
+    return raw_records
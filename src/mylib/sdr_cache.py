@@ -0,0 +1,112 @@
+"""
+Persistent per-host cache of the BMC's SDR repository.
+"""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+from .ipmi_backend import IpmiBackend
+
+logger = logging.getLogger(__name__)
+
+
+class SdrCache:
+    """
+    Local copy of a BMC's SDR repository, in `ipmitool sdr dump` format.
+    Saves each request from downloading and walking the repository.
+    The cache is rebuilt whenever the repository's fingerprint (record count
+    and last addition/erase timestamps) or the file's checksum no longer
+    match.
+    """
+    filename: str
+
+    meta_filename: str
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self.meta_filename = filename + '.meta'
+
+    def _file_digest(self) -> str:
+        # Imported here; cron runs using the cache unchecked never hash it.
+        import hashlib  # pylint: disable=import-outside-toplevel
+        with open(self.filename, 'rb') as cache_file:
+            return hashlib.sha1(cache_file.read()).hexdigest()
+
+    def read_meta(self) -> Optional[Dict[str, str]]:
+        """
+        Read cache metadata, if present.
+        """
+        if not os.path.exists(self.meta_filename):
+            return None
+        try:
+            with open(self.meta_filename, 'r', encoding='utf-8') as meta_file:
+                return json.load(meta_file)
+        except ValueError:
+            return None
+
+    def is_valid(self, fingerprint: str) -> bool:
+        """
+        Check cache matches the BMC's current SDR repository.
+        """
+        meta = self.read_meta()
+        if meta is None or not os.path.exists(self.filename):
+            return False
+        return (meta.get('fingerprint') == fingerprint
+                and meta.get('sha1') == self._file_digest())
+
+    def rebuild(self, backend: IpmiBackend, fingerprint: str) -> None:
+        """
+        Download SDR repository into the cache file.
+        """
+        tmp_filename = self.filename + '.tmp'
+        backend.sdr_dump(tmp_filename)
+        os.replace(tmp_filename, self.filename)
+
+        meta = {'fingerprint': fingerprint, 'sha1': self._file_digest()}
+        tmp_filename = self.meta_filename + '.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_filename, self.meta_filename)
+
+    def attach(self, backends: List[IpmiBackend]) -> bool:
+        """
+        Validate or rebuild the cache, then make backends read SDR records
+        from it.
+        Return True if a previous cache was discarded because the SDR
+        repository changed, meaning sensors should be rediscovered.
+        """
+        fingerprint = backends[0].sdr_fingerprint()
+        if self.is_valid(fingerprint):
+            logger.debug('Using SDR cache %s', self.filename)
+            changed = False
+        else:
+            changed = self.read_meta() is not None
+            logger.info('Building SDR cache %s', self.filename)
+            self.rebuild(backends[0], fingerprint)
+
+        for backend in backends:
+            backend.use_sdr_cache(self.filename)
+
+        return changed
+
+    def attach_unchecked(self, backends: List[IpmiBackend]) -> bool:
+        """
+        Make backends read SDR records from the cache without validating
+        it against the BMC, saving a request.
+        Return False if there is no cache.
+        """
+        if not os.path.exists(self.filename):
+            return False
+        logger.debug('Using SDR cache %s unchecked', self.filename)
+        for backend in backends:
+            backend.use_sdr_cache(self.filename)
+        return True
+
+    def invalidate(self) -> None:
+        """
+        Delete cache files.
+        """
+        for filename in (self.filename, self.meta_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
@@ -0,0 +1,54 @@
+"""
+Sensor reading returned by IPMI backends.
+"""
+
+from typing import Dict, Optional
+
+
+class SensorReading:
+    """
+    Current reading of one sensor.
+    Slotted, since one is created per sensor line of every poll.
+    """
+    __slots__ = ('name', 'id', 'status', 'value', 'unit', 'fields')
+
+    name: str
+
+    id: int
+
+    # ok | nc | cr | nr | ns, as printed by ipmitool.
+    status: str
+
+    # Converted reading, or None if unavailable or discrete.
+    value: Optional[float]
+
+    # Unit name, such as "RPM" or "degrees C".
+    unit: str
+
+    # Extra `sdr get` fields requested by the caller, such as
+    # "Normal Maximum".
+    fields: Optional[Dict[str, str]]
+
+    def __init__(self, name: str = '', sensor_id: int = 0,
+                 status: str = '', value: Optional[float] = None,
+                 unit: str = '',
+                 fields: Optional[Dict[str, str]] = None) -> None:
+        self.name = name
+        self.id = sensor_id
+        self.status = status
+        self.value = value
+        self.unit = unit
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return (f'SensorReading: name={self.name}, id={self.id:#x}, '
+                f'status={self.status}, value={self.value}, '
+                f'unit={self.unit}')
+
+    def field(self, name: str) -> Optional[str]:
+        """
+        Value of an extra field, or None if not read.
+        """
+        if self.fields is None:
+            return None
+        return self.fields.get(name)
@@ -0,0 +1,103 @@
+"""
+Startup profile of a run: where time goes from process start to the first
+IPMI request.  Cron runs pay this cost every poll, so it is worth keeping
+small on slow hardware like a Pi Zero.
+"""
+
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _process_age() -> Optional[float]:
+    """
+    Seconds since this process started, if the platform tells.
+    Resolution is a clock tick, typically 10ms.
+    """
+    try:
+        with open('/proc/self/stat', 'r', encoding='ascii') as stat_file:
+            stat = stat_file.read()
+        # Fields after the command name, which may contain spaces.  Start
+        # time in ticks since boot is field 22.
+        start_ticks = int(stat.rpartition(')')[2].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) \
+            - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupProfile:
+    """
+    Phases of startup, timed until the first IPMI request is sent.
+    """
+    # Report phases when the first request is sent.
+    enabled: bool
+
+    # perf_counter() time the process started, or the profile was created
+    # if unknown.
+    start: float
+
+    # True if start is the process start time.
+    from_process_start: bool
+
+    # Name and perf_counter() end time of each phase.
+    phases: List[Tuple[str, float]]
+
+    # perf_counter() time and command of the first IPMI request.
+    first_request: Optional[Tuple[float, str]]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        now = time.perf_counter()
+        age = _process_age()
+        self.from_process_start = age is not None and age >= 0
+        self.start = now
+        if age is not None and self.from_process_start:
+            self.start = now - age
+        self.phases = []
+        self.first_request = None
+        if self.from_process_start:
+            self.phases.append(('python', now))
+
+    def mark(self, phase: str) -> None:
+        """
+        End a phase, started by the end of the previous one.
+        """
+        if self.first_request is None:
+            self.phases.append((phase, time.perf_counter()))
+
+    def request_sent(self, command: str) -> None:
+        """
+        Record an IPMI request, reporting the profile on the first one.
+        """
+        if self.first_request is not None:
+            return
+        self.first_request = (time.perf_counter(), command)
+        if self.enabled:
+            logger.info('%s', self.report())
+
+    def report(self) -> str:
+        """
+        Format phase durations and time to the first IPMI request, in ms.
+        """
+        parts = []
+        last = self.start
+        for phase, end in self.phases:
+            parts.append(f'{phase} {(end - last) * 1000:0.1f}ms')
+            last = end
+        text = 'Startup profile: ' + ', '.join(parts)
+        if self.first_request is not None:
+            sent, command = self.first_request
+            origin = 'process start' if self.from_process_start \
+                else 'profile start'
+            text += (f', poll_start {(sent - last) * 1000:0.1f}ms; first '
+                     f'IPMI command ({command}) '
+                     f'{(sent - self.start) * 1000:0.1f}ms after {origin}')
+        return text
+
+
+# Startup profile of this process, reported with --startup-profile.
+STARTUP = StartupProfile()
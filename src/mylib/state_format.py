@@ -0,0 +1,394 @@
+"""
+Versioned binary file format of ControllerState.
+
+Layout::
+
+    header:  magic "PFST" | version u16 | flags u16 | body length u32 |
+             body crc32 u32
+    body:    sections of: tag 4s | length u32 | data
+
+Each section has a fixed layout.  Unknown sections are skipped, so newer
+sections can be added without breaking older readers.  All values are
+little endian.
+"""
+
+import io
+import math
+import pickle
+import struct
+import zlib
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, \
+    TYPE_CHECKING
+from .aggregator import TempAggregator
+from .cpu_sensor import CpuSensor
+from .fan_sensor import FanSensor
+from .pid import PidState
+
+if TYPE_CHECKING:
+    from .controller_state import ControllerState
+
+
+MAGIC = b'PFST'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHII')
+SECTION = struct.Struct('<4sI')
+
+# Sample size, sample count, last sample time.  Superseded by AGGREGATE.
+SAMPLES = struct.Struct('<HHd')
+# Sample count, EWMA value, window start time, then (time, value) samples.
+AGGREGATE = struct.Struct('<Hdd')
+AGGREGATE_SAMPLE = struct.Struct('<dd')
+# Name, sensor ID, temperature.
+CPU_SENSOR = struct.Struct('<16sHd')
+# Name, sensor ID, RPM, max RPM.
+FAN_SENSOR = struct.Struct('<16sHII')
+# Static fans, applied speed, applied time, suppressed writes.
+ACTUATOR = struct.Struct('<BhdI')
+# PID integral, last temperature, last update time, last output.
+PID = struct.Struct('<dddd')
+# Poll interval, last poll aggregate temperature, last poll time.
+INTERVAL = struct.Struct('<ddd')
+# Consecutive failed polls.
+FAILSAFE = struct.Struct('<I')
+# Last SDR cache check time.
+SDR_CHECK = struct.Struct('<d')
+# Last power reading, power average, last power reading time.
+INPUTS = struct.Struct('<ddd')
+# Zone name, applied speed, applied time, then PID and AGGREGATE with
+# samples.
+ZONE = struct.Struct('<16shd')
+
+COUNT = struct.Struct('<H')
+
+
+class StateFormatError(Exception):
+    """
+    State file is corrupt or in an unknown format.
+    """
+
+
+def _opt_float(value: Optional[float]) -> float:
+    return float('nan') if value is None else float(value)
+
+
+def _from_opt_float(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+def _name(value: str) -> bytes:
+    return value.encode('utf-8')[:16]
+
+
+def _from_name(value: bytes) -> str:
+    return value.rstrip(b'\x00').decode('utf-8', 'replace')
+
+
+def _section(tag: bytes, data: bytes) -> bytes:
+    return SECTION.pack(tag, len(data)) + data
+
+
+def _sections(body: bytes) -> Iterator[Tuple[bytes, bytes]]:
+    offset = 0
+    while offset < len(body):
+        if offset + SECTION.size > len(body):
+            raise StateFormatError('Truncated section header')
+        tag, length = SECTION.unpack_from(body, offset)
+        offset += SECTION.size
+        if offset + length > len(body):
+            raise StateFormatError(f'Truncated section {tag!r}')
+        yield tag, body[offset:offset + length]
+        offset += length
+
+
+def _restore_samples(state: 'ControllerState', values: List[float],
+                     last_time: Optional[float]) -> None:
+    """
+    Restore untimed samples of older state, stamped with the last sample
+    time.
+    """
+    if last_time is None:
+        return
+    state.aggregator.restore([(last_time, value) for value in values],
+                             None, None)
+
+
+def _encode_aggregate(aggregator: TempAggregator) -> bytes:
+    samples = aggregator.samples()
+    data = AGGREGATE.pack(len(samples), _opt_float(aggregator.ewma),
+                          _opt_float(aggregator.start_time))
+    for sample in samples:
+        data += AGGREGATE_SAMPLE.pack(*sample)
+    return data
+
+
+def _decode_aggregate(data: bytes, offset: int,
+                      aggregator: TempAggregator) -> None:
+    count, ewma, start_time = AGGREGATE.unpack_from(data, offset)
+    offset += AGGREGATE.size
+    samples = [AGGREGATE_SAMPLE.unpack_from(
+        data, offset + i * AGGREGATE_SAMPLE.size) for i in range(count)]
+    aggregator.restore(samples, _from_opt_float(ewma),
+                       _from_opt_float(start_time))
+
+
+def _encode_pid(pid: PidState) -> bytes:
+    return PID.pack(pid.integral, _opt_float(pid.last_temp),
+                    _opt_float(pid.last_time), _opt_float(pid.output))
+
+
+def _decode_pid(data: bytes, offset: int, pid: PidState) -> None:
+    integral, last_temp, last_time, output = PID.unpack_from(data, offset)
+    pid.integral = integral
+    pid.last_temp = _from_opt_float(last_temp)
+    pid.last_time = _from_opt_float(last_time)
+    pid.output = _from_opt_float(output)
+
+
+def encode_state(state: 'ControllerState') -> bytes:
+    """
+    Serialize state.
+    """
+    body = io.BytesIO()
+
+    body.write(_section(b'AGGR', _encode_aggregate(state.aggregator)))
+
+    if state.cpu_map is not None:
+        data = COUNT.pack(len(state.cpu_map))
+        for cpu in state.cpu_map.values():
+            data += CPU_SENSOR.pack(_name(cpu.name), cpu.id, cpu.temp)
+        body.write(_section(b'CPUS', data))
+
+    if state.fan_map is not None:
+        data = COUNT.pack(len(state.fan_map))
+        for fan in state.fan_map.values():
+            data += FAN_SENSOR.pack(_name(fan.name), fan.id, fan.rpm,
+                                    fan.max)
+        body.write(_section(b'FANS', data))
+
+    if state.air_map is not None:
+        data = COUNT.pack(len(state.air_map))
+        for air in state.air_map.values():
+            data += CPU_SENSOR.pack(_name(air.name), air.id, air.temp)
+        body.write(_section(b'AIR ', data))
+
+    applied_speed = -1 if state.applied_speed is None else state.applied_speed
+    body.write(_section(b'ACT ', ACTUATOR.pack(
+        int(state.static_fans), applied_speed,
+        _opt_float(state.applied_time), state.suppressed_writes)))
+
+    body.write(_section(b'PID ', _encode_pid(state.pid)))
+
+    body.write(_section(b'IVL ', INTERVAL.pack(
+        _opt_float(state.poll_interval), _opt_float(state.last_poll_temp),
+        _opt_float(state.last_poll_time))))
+
+    body.write(_section(b'FAIL', FAILSAFE.pack(state.failed_polls)))
+
+    body.write(_section(b'SDRC', SDR_CHECK.pack(
+        _opt_float(state.sdr_check_time))))
+
+    inputs = state.inputs
+    body.write(_section(b'INPT', INPUTS.pack(
+        _opt_float(inputs.power), _opt_float(inputs.power_avg),
+        _opt_float(inputs.power_time))))
+
+    for name, zone in state.zones.items():
+        applied_speed = -1 if zone.applied_speed is None \
+            else zone.applied_speed
+        body.write(_section(b'ZONE', ZONE.pack(
+            _name(name), applied_speed, _opt_float(zone.applied_time))
+            + _encode_pid(zone.pid) + _encode_aggregate(zone.aggregator)))
+
+    body_buf = body.getvalue()
+    return HEADER.pack(MAGIC, VERSION, 0, len(body_buf),
+                       zlib.crc32(body_buf)) + body_buf
+
+
+def _decode_aggr(section: bytes, state: 'ControllerState') -> None:
+    _decode_aggregate(section, 0, state.aggregator)
+
+
+def _decode_samples(section: bytes, state: 'ControllerState') -> None:
+    _, count, last_time = SAMPLES.unpack_from(section)
+    values = struct.unpack_from(f'<{count}d', section, SAMPLES.size)
+    _restore_samples(state, list(values), _from_opt_float(last_time))
+
+
+def _decode_temp_sensors(section: bytes) -> List[CpuSensor]:
+    sensors = []
+    for offset in range(COUNT.size, len(section), CPU_SENSOR.size):
+        name, sensor_id, temp = CPU_SENSOR.unpack_from(section, offset)
+        sensor = CpuSensor()
+        sensor.name = _from_name(name)
+        sensor.id = sensor_id
+        sensor.temp = temp
+        sensors.append(sensor)
+    return sensors
+
+
+def _decode_cpus(section: bytes, state: 'ControllerState') -> None:
+    state.cpu_map = {f'{cpu.name} ({cpu.id:#x})': cpu
+                     for cpu in _decode_temp_sensors(section)}
+
+
+def _decode_air(section: bytes, state: 'ControllerState') -> None:
+    state.air_map = {air.name: air for air in _decode_temp_sensors(section)}
+
+
+def _decode_fans(section: bytes, state: 'ControllerState') -> None:
+    fan_map: Dict[str, FanSensor] = {}
+    for offset in range(COUNT.size, len(section), FAN_SENSOR.size):
+        name, sensor_id, rpm, max_rpm = FAN_SENSOR.unpack_from(section,
+                                                               offset)
+        fan = FanSensor()
+        fan.name = _from_name(name)
+        fan.id = sensor_id
+        fan.rpm = rpm
+        fan.max = max_rpm
+        fan_map[fan.name] = fan
+    state.fan_map = fan_map
+
+
+def _decode_actuator(section: bytes, state: 'ControllerState') -> None:
+    static_fans, applied_speed, applied_time, suppressed = \
+        ACTUATOR.unpack_from(section)
+    state.static_fans = bool(static_fans)
+    state.applied_speed = None if applied_speed < 0 else applied_speed
+    state.applied_time = _from_opt_float(applied_time)
+    state.suppressed_writes = suppressed
+
+
+def _decode_state_pid(section: bytes, state: 'ControllerState') -> None:
+    _decode_pid(section, 0, state.pid)
+
+
+def _decode_interval(section: bytes, state: 'ControllerState') -> None:
+    interval, last_temp, last_time = INTERVAL.unpack_from(section)
+    state.poll_interval = _from_opt_float(interval)
+    state.last_poll_temp = _from_opt_float(last_temp)
+    state.last_poll_time = _from_opt_float(last_time)
+
+
+def _decode_failsafe(section: bytes, state: 'ControllerState') -> None:
+    state.failed_polls, = FAILSAFE.unpack_from(section)
+
+
+def _decode_sdr_check(section: bytes, state: 'ControllerState') -> None:
+    check_time, = SDR_CHECK.unpack_from(section)
+    state.sdr_check_time = _from_opt_float(check_time)
+
+
+def _decode_inputs(section: bytes, state: 'ControllerState') -> None:
+    power, power_avg, power_time = INPUTS.unpack_from(section)
+    state.inputs.power = _from_opt_float(power)
+    state.inputs.power_avg = _from_opt_float(power_avg)
+    state.inputs.power_time = _from_opt_float(power_time)
+
+
+def _decode_zone(section: bytes, state: 'ControllerState') -> None:
+    name, applied_speed, applied_time = ZONE.unpack_from(section)
+    zone = state.zone_state(_from_name(name))
+    zone.applied_speed = None if applied_speed < 0 else applied_speed
+    zone.applied_time = _from_opt_float(applied_time)
+    _decode_pid(section, ZONE.size, zone.pid)
+    _decode_aggregate(section, ZONE.size + PID.size, zone.aggregator)
+
+
+# Decoder of each section tag.  Unknown tags are skipped.
+_SECTION_DECODERS: Dict[bytes, Callable[[bytes, 'ControllerState'], None]] = {
+    b'AGGR': _decode_aggr,
+    b'SMPL': _decode_samples,
+    b'CPUS': _decode_cpus,
+    b'AIR ': _decode_air,
+    b'FANS': _decode_fans,
+    b'ACT ': _decode_actuator,
+    b'PID ': _decode_state_pid,
+    b'IVL ': _decode_interval,
+    b'FAIL': _decode_failsafe,
+    b'SDRC': _decode_sdr_check,
+    b'INPT': _decode_inputs,
+    b'ZONE': _decode_zone,
+}
+
+
+def decode_state(data: bytes, state: 'ControllerState') -> None:
+    """
+    Deserialize state created by encode_state().
+    """
+    if len(data) < HEADER.size:
+        raise StateFormatError('Truncated state header')
+
+    magic, version, _, length, crc = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise StateFormatError('Not a PiFan state file')
+    if version > VERSION:
+        raise StateFormatError(f'Unsupported state version {version}')
+
+    body = data[HEADER.size:HEADER.size + length]
+    if len(body) != length or zlib.crc32(body) != crc:
+        raise StateFormatError('State checksum mismatch')
+
+    for tag, section in _sections(body):
+        decoder = _SECTION_DECODERS.get(tag)
+        if decoder is None:
+            # Section of a newer writer.
+            continue
+        try:
+            decoder(section, state)
+        except struct.error as error:
+            raise StateFormatError(f'Corrupt section {tag!r}: {error}') \
+                from error
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """
+    Unpickler restricted to the classes of legacy pickle state files.
+    """
+    allowed = {
+        ('mylib.controller_state', 'ControllerState'),
+        ('mylib.cpu_sensor', 'CpuSensor'),
+        ('mylib.fan_sensor', 'FanSensor'),
+        ('copyreg', '_reconstructor'),
+        ('builtins', 'object'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.allowed:
+            raise StateFormatError(
+                f'Refusing to load {module}.{name} from legacy state')
+        return super().find_class(module, name)
+
+
+def is_legacy_pickle(data: bytes) -> bool:
+    """
+    Check if data is a state file from before the binary format.
+    """
+    return data[:1] == b'\x80'
+
+
+def decode_legacy_state(data: bytes, state: 'ControllerState') -> None:
+    """
+    Migrate a legacy pickle state file.
+    Only PiFan's own state classes may be loaded.
+    """
+    # pylint: disable=import-outside-toplevel
+    from .controller_state import ControllerState
+
+    try:
+        loaded_state = _LegacyUnpickler(io.BytesIO(data)).load()
+        if not isinstance(loaded_state, ControllerState):
+            raise StateFormatError(f'Legacy state is a '
+                                   f'{type(loaded_state).__name__}')
+        fields = dict(loaded_state.__dict__)
+        values = fields.pop('samples', [])
+        last_time = fields.pop('last_sample_time', None)
+        fields.pop('sample_size', None)
+        state.__dict__.update(fields)
+        _restore_samples(state, values, last_time)
+    except StateFormatError:
+        raise
+    except Exception as error:
+        # Any malformed pickle, e.g. a truncated file or unexpected field
+        # types.
+        raise StateFormatError(f'Corrupt legacy state: {error}') from error
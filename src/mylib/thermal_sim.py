@@ -0,0 +1,467 @@
+"""
+Closed loop thermal simulation of a server for evaluating controller
+settings.
+PiFanController runs unmodified against simulated IPMI sensors, on a
+simulated clock, so hours of load are evaluated in seconds.
+"""
+
+import contextlib
+import csv
+import logging
+import math
+import tempfile
+from typing import Dict, Iterator, List, Optional, Tuple
+from .bmc_simulator import BmcSimulator
+from .ipmi_cpu import IpmiCpu
+from .ipmi_fan import IpmiFan
+from .ipmi_native import IpmiNative
+from .log import ROOT_LOGGER
+from .pi_fan_controller import PiFanController
+
+
+WORKLOADS = ['idle', 'steady', 'steps', 'spiky', 'diurnal']
+
+
+class SimClock:
+    """
+    Simulated epoch seconds, advanced explicitly.
+    """
+    now: float
+
+    def __init__(self, start: float = 1.6e9) -> None:
+        self.now = start
+
+    def time(self) -> float:
+        """
+        Current simulated epoch seconds.
+        """
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        """
+        Move clock forward.
+        """
+        self.now += seconds
+
+
+class Workload:
+    """
+    CPU load over time, 0-100 percent.
+    Either a built-in profile or a trace file of `seconds,percent` rows.
+    Trace values hold until the next row and the trace repeats.
+    """
+    name: str
+
+    trace: List[Tuple[float, float]]
+
+    def __init__(self, name: str = 'steps') -> None:
+        self.name = name
+        self.trace = []
+        if name not in WORKLOADS:
+            self.trace = self._read_trace(name)
+
+    @staticmethod
+    def _read_trace(filename: str) -> List[Tuple[float, float]]:
+        trace: List[Tuple[float, float]] = []
+        with open(filename, 'r', encoding='utf-8', newline='') as trace_file:
+            for row in csv.reader(trace_file):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    trace.append((float(row[0]), float(row[1])))
+                except ValueError:
+                    # Header row.
+                    continue
+        if not trace:
+            raise Exception(f'No workload samples in {filename}')
+        trace.sort()
+        return trace
+
+    def load(self, elapsed: float) -> float:
+        """
+        CPU load percent at elapsed seconds since start.
+        """
+        # pylint: disable=too-many-return-statements
+        if self.trace:
+            period = self.trace[-1][0] + 1.0
+            offset = elapsed % period
+            value = self.trace[0][1]
+            for sample_time, sample_value in self.trace:
+                if sample_time > offset:
+                    break
+                value = sample_value
+            return value
+
+        if self.name == 'idle':
+            return 5.0
+        if self.name == 'steady':
+            return 50.0
+        if self.name == 'steps':
+            # Alternate light and heavy load every 15 minutes.
+            return 90.0 if int(elapsed // 900) % 2 else 10.0
+        if self.name == 'spiky':
+            # Light load with a 1 minute burst every 10 minutes.
+            return 100.0 if elapsed % 600 >= 540 else 10.0
+        # diurnal: sinusoid over 24 hours, peaking mid-day.
+        return 50.0 - 40.0 * math.cos(2 * math.pi * elapsed / 86400)
+
+
+class ThermalModel:
+    """
+    First order thermal model of CPU package temperature::
+
+        C dT/dt = P(load) - G(fan) (T - ambient)
+
+    P is CPU power between idle and max.  G is passive conductance plus fan
+    cooling, rising with airflow to the power of fan_exponent.  Fan speed
+    follows the commanded speed with a small lag.
+    """
+    ambient: float
+
+    idle_power: float
+
+    max_power: float
+
+    # Joules per degree C.
+    heat_capacity: float
+
+    # Watts per degree C without fans.
+    passive_conductance: float
+
+    # Additional watts per degree C at 100% fans.
+    fan_conductance: float
+
+    fan_exponent: float
+
+    # Fans never turn slower than this percent.
+    fan_floor: float
+
+    # Seconds for fans to settle on a new speed.
+    fan_time_constant: float
+
+    # Fan percent chosen by the BMC in dynamic mode.
+    dynamic_fan: float
+
+    temp: float
+
+    fan_percent: float
+
+    def __init__(self, ambient: float = 22.0) -> None:
+        self.ambient = ambient
+        self.idle_power = 60.0
+        self.max_power = 240.0
+        self.heat_capacity = 300.0
+        self.passive_conductance = 3.5
+        self.fan_conductance = 4.0
+        self.fan_exponent = 0.8
+        self.fan_floor = 5.0
+        self.fan_time_constant = 5.0
+        self.dynamic_fan = 30.0
+        self.fan_percent = self.dynamic_fan
+        self.temp = self.steady_temp(0.0, self.fan_percent)
+
+    def power(self, load: float) -> float:
+        """
+        CPU power in watts at load percent.
+        """
+        return self.idle_power \
+            + (self.max_power - self.idle_power) * load / 100.0
+
+    def conductance(self, fan_percent: float) -> float:
+        """
+        Cooling in watts per degree C at fan percent.
+        """
+        airflow = max(self.fan_floor, fan_percent) / 100.0
+        return self.passive_conductance \
+            + self.fan_conductance * airflow ** self.fan_exponent
+
+    def steady_temp(self, load: float, fan_percent: float) -> float:
+        """
+        Temperature reached after a long time at constant load and fans.
+        """
+        return self.ambient + self.power(load) / self.conductance(fan_percent)
+
+    def step(self, seconds: float, load: float, fan_command: float) -> None:
+        """
+        Advance model by seconds.  Keep steps short, e.g. 1 second.
+        """
+        settle = 1.0 - math.exp(-seconds / self.fan_time_constant)
+        self.fan_percent += (fan_command - self.fan_percent) * settle
+        cooling = self.conductance(self.fan_percent) \
+            * (self.temp - self.ambient)
+        self.temp += (self.power(load) - cooling) / self.heat_capacity \
+            * seconds
+
+
+class LoopbackSession:
+    """
+    Stand-in for IpmiLanSession answering from a BmcSimulator in process.
+    Counts requests and fan writes.
+    """
+    bmc: BmcSimulator
+
+    requests: int
+
+    writes: int
+
+    def __init__(self, bmc: BmcSimulator) -> None:
+        self.bmc = bmc
+        self.requests = 0
+        self.writes = 0
+
+    def request(self, netfn: int, cmd: int, data: bytes = b'',
+                lun: int = 0, critical: bool = False) -> bytes:
+        """
+        Execute IPMI command.
+        Return response data, starting with completion code.
+        """
+        # pylint: disable=unused-argument
+        self.requests += 1
+        if netfn == 0x30:
+            self.writes += 1
+        return self.bmc.handle_command(netfn, cmd, data)
+
+
+class SimBackend(IpmiNative):
+    """
+    Native IPMI client wired to a simulated BMC.
+    """
+    # pylint: disable=super-init-not-called
+    def __init__(self, bmc: BmcSimulator) -> None:
+        self.host = 'simulator'
+        self.session = LoopbackSession(bmc)  # type: ignore[assignment]
+        self.records = None
+        self.sdr_cache_file = None
+
+
+class SimIpmiCpu(IpmiCpu):
+    """
+    IpmiCpu reading simulated sensors.
+    """
+    # pylint: disable=super-init-not-called
+    def __init__(self, backend: SimBackend) -> None:
+        self.ipmitool = backend
+
+
+class SimIpmiFan(IpmiFan):
+    """
+    IpmiFan controlling simulated fans.
+    """
+    # pylint: disable=super-init-not-called
+    def __init__(self, backend: SimBackend) -> None:
+        self.ipmitool = backend
+
+
+class SimReport:
+    """
+    Results of a simulation run.
+    """
+    duration: float
+
+    polls: int
+
+    ideal_temp: float
+
+    max_temp: float
+
+    # Seconds CPU temperature was above ideal and max temperature.
+    time_above_ideal: float
+
+    time_above_max: float
+
+    peak_temp: float
+
+    # Integral of fan percent over time, in percent-hours.  Proxy for noise
+    # and fan power.
+    fan_integral: float
+
+    ipmi_requests: int
+
+    ipmi_writes: int
+
+    suppressed_writes: int
+
+    def __init__(self) -> None:
+        self.duration = 0.0
+        self.polls = 0
+        self.ideal_temp = 0.0
+        self.max_temp = 0.0
+        self.time_above_ideal = 0.0
+        self.time_above_max = 0.0
+        self.peak_temp = float('-inf')
+        self.fan_integral = 0.0
+        self.ipmi_requests = 0
+        self.ipmi_writes = 0
+        self.suppressed_writes = 0
+
+    def __str__(self) -> str:
+        return (f'SimReport: duration={self.duration:.0f}s, '
+                f'polls={self.polls}, '
+                f'above_ideal={self.time_above_ideal:.0f}s, '
+                f'peak={self.peak_temp:.1f}C, '
+                f'fan_integral={self.fan_integral:.1f}%h, '
+                f'writes={self.ipmi_writes}')
+
+    def mean_fan(self) -> float:
+        """
+        Mean fan percent.
+        """
+        if self.duration <= 0:
+            return float('nan')
+        return self.fan_integral * 3600.0 / self.duration
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Report values by name.
+        """
+        return {
+            'duration_s': self.duration,
+            'polls': self.polls,
+            'time_above_ideal_s': self.time_above_ideal,
+            'time_above_ideal_pct':
+                100.0 * self.time_above_ideal / self.duration
+                if self.duration else 0.0,
+            'time_above_max_s': self.time_above_max,
+            'peak_temp_c': self.peak_temp,
+            'fan_integral_pct_h': self.fan_integral,
+            'mean_fan_pct': self.mean_fan(),
+            'ipmi_requests': self.ipmi_requests,
+            'ipmi_writes': self.ipmi_writes,
+            'suppressed_writes': self.suppressed_writes,
+        }
+
+
+@contextlib.contextmanager
+def _log_level(level: int) -> Iterator[None]:
+    """
+    Temporarily change level of PiFan loggers.
+    """
+    logger = logging.getLogger(ROOT_LOGGER)
+    old_level = logger.level
+    logger.setLevel(level)
+    try:
+        yield
+    finally:
+        logger.setLevel(old_level)
+
+
+class ThermalSimulation:
+    """
+    Run a PiFanController against a ThermalModel and Workload.
+    """
+    model: ThermalModel
+
+    workload: Workload
+
+    clock: SimClock
+
+    bmc: BmcSimulator
+
+    backend: SimBackend
+
+    controller: PiFanController
+
+    # Model integration step in seconds.
+    step: float
+
+    def __init__(self, workload: Workload,
+                 model: Optional[ThermalModel] = None) -> None:
+        self.workload = workload
+        self.model = model if model is not None else ThermalModel()
+        self.clock = SimClock()
+        self.bmc = BmcSimulator(listen=False)
+        self.backend = SimBackend(self.bmc)
+        self.step = 1.0
+
+        self.controller = PiFanController('simulator',
+                                          SimIpmiFan(self.backend),
+                                          SimIpmiCpu(self.backend))
+        self.controller.clock = self.clock.time
+        self.controller.actuator.clock = self.clock.time
+        self.controller.use_sdr_cache = False
+        self.controller.history_size = 0
+        self._update_sensors()
+
+    def fan_command(self) -> float:
+        """
+        Fan percent currently requested from the BMC.
+        """
+        speeds = self.bmc.fan_speeds
+        if not self.bmc.static_fans or not speeds:
+            return self.model.dynamic_fan
+        if 0xff in speeds and len(speeds) == 1:
+            return float(speeds[0xff])
+        # The model has one airflow path; use the mean of per-fan speeds,
+        # counting fans without their own speed at the all-fans speed.
+        default = speeds.get(0xff, self.model.dynamic_fan)
+        fans = sum(1 for sensor in self.bmc.sensors
+                   if sensor.sensor_type == 0x04)
+        return sum(speeds.get(index, default) for index in range(fans)) \
+            / fans
+
+    def _update_sensors(self, load: float = 0.0) -> None:
+        model = self.model
+        self.bmc.power = model.power(load)
+        for sensor in self.bmc.sensors:
+            if sensor.name == 'Inlet Temp':
+                sensor.value = model.ambient
+            elif sensor.name == 'Exhaust Temp':
+                sensor.value = model.ambient \
+                    + 0.3 * (model.temp - model.ambient)
+            elif sensor.name == 'Temp':
+                # Second socket runs slightly cooler.
+                sensor.value = model.temp - 3.0 * (sensor.number & 0x01)
+            elif sensor.name.startswith('Fan'):
+                sensor.value = max(model.fan_floor, model.fan_percent) \
+                    / 100.0 * sensor.normal_max
+
+    def run(self, duration: float, verbose: bool = False) -> SimReport:
+        """
+        Simulate duration seconds.  Controller log records below error
+        level are discarded unless verbose.
+        """
+        report = SimReport()
+        report.ideal_temp = self.controller.ideal_temp
+        report.max_temp = self.controller.max_temp
+        start = self.clock.time()
+
+        with tempfile.TemporaryDirectory(prefix='pifan_sim.') as state_path:
+            self.controller.state_path = state_path
+            output = contextlib.nullcontext() if verbose \
+                else _log_level(logging.ERROR)
+            with output:
+                state = self.controller.load_state()
+                next_poll = start
+
+                while self.clock.time() - start < duration:
+                    if self.clock.time() >= next_poll:
+                        self.controller.poll(state)
+                        report.polls += 1
+                        next_poll += self.controller.next_interval(state)
+
+                    # Integrate model until next poll.
+                    seconds = min(self.step, next_poll - self.clock.time(),
+                                  duration - (self.clock.time() - start))
+                    load = self.workload.load(self.clock.time() - start)
+                    self.model.step(seconds, load, self.fan_command())
+                    self.clock.advance(seconds)
+                    self._update_sensors(load)
+
+                    report.peak_temp = max(report.peak_temp,
+                                           self.model.temp)
+                    if self.model.temp > report.ideal_temp:
+                        report.time_above_ideal += seconds
+                    if self.model.temp > report.max_temp:
+                        report.time_above_max += seconds
+                    report.fan_integral += max(self.model.fan_floor,
+                                               self.model.fan_percent) \
+                        * seconds / 3600.0
+
+            report.suppressed_writes = state.suppressed_writes
+
+        report.duration = self.clock.time() - start
+        session = self.backend.session
+        assert isinstance(session, LoopbackSession)
+        report.ipmi_requests = session.requests
+        report.ipmi_writes = session.writes
+        return report
@@ -0,0 +1,125 @@
+"""
+Lightweight span tracing of poll phases.
+
+Spans are written as JSON lines or as a Chrome trace file, which can be
+opened in chrome://tracing or https://ui.perfetto.dev.  While tracing is
+off, span() returns a shared no-op context manager.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, IO, Iterator, \
+    List, Optional
+
+TRACE_FORMATS: List[str] = ['jsonl', 'chrome']
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Tracer:
+    """
+    Record timed spans to a trace file.
+    """
+    enabled: bool
+
+    trace_format: str
+
+    trace_file: Optional[IO[str]]
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.trace_format = 'jsonl'
+        self.trace_file = None
+        self._lock = threading.Lock()
+        self._events = 0
+
+    def open(self, filename: str, trace_format: str = 'jsonl') -> None:
+        """
+        Start writing spans to filename.
+        """
+        if trace_format not in TRACE_FORMATS:
+            raise ValueError(f'Unknown trace format "{trace_format}"')
+        self.close()
+        self.trace_format = trace_format
+        self.trace_file = open(  # pylint: disable=consider-using-with
+            filename, 'w', encoding='utf-8')
+        self._events = 0
+        if trace_format == 'chrome':
+            # Chrome accepts an unterminated array if the process dies.
+            self.trace_file.write('[\n')
+        self.enabled = True
+
+    def close(self) -> None:
+        """
+        Stop tracing and close trace file.
+        """
+        with self._lock:
+            self.enabled = False
+            if self.trace_file is None:
+                return
+            if self.trace_format == 'chrome':
+                self.trace_file.write('\n]\n')
+            self.trace_file.close()
+            self.trace_file = None
+
+    def _emit(self, name: str, start: float, duration: float,
+              args: Dict[str, Any]) -> None:
+        thread = threading.current_thread()
+        if self.trace_format == 'chrome':
+            event = {'name': name, 'ph': 'X', 'ts': round(start * 1e6, 1),
+                     'dur': round(duration * 1e6, 1), 'pid': os.getpid(),
+                     'tid': thread.ident, 'args': args}
+        else:
+            event = {'name': name, 'start': round(start, 6),
+                     'duration': round(duration, 6),
+                     'thread': thread.name, **args}
+        line = json.dumps(event, default=str)
+        with self._lock:
+            if self.trace_file is None:
+                return
+            if self.trace_format == 'chrome':
+                self.trace_file.write((',\n' if self._events else '') + line)
+            else:
+                self.trace_file.write(line + '\n')
+            self._events += 1
+            self.trace_file.flush()
+
+    @contextlib.contextmanager
+    def _span(self, name: str, args: Dict[str, Any]) -> Iterator[None]:
+        start = time.time()
+        perf_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._emit(name, start, time.perf_counter() - perf_start, args)
+
+    def span(self, name: str, **args: Any) -> ContextManager:
+        """
+        Context manager timing a span with optional arguments.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, args)
+
+
+# Tracer of this process, enabled by --trace.
+TRACER = Tracer()
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorate a function to record a span per call.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with TRACER.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,226 @@
+"""
+Fan curve auto-tuner.
+Replays recorded poll history through many candidate settings at once and
+ranks them by peak CPU temperature against fan use.
+
+Requires numpy: pip3 install pifan[tune]
+"""
+
+from typing import Iterable, List, Sequence, Tuple
+import numpy as np
+from .easing import EASING_CURVES
+from .history import HistoryRecord
+from .thermal_sim import ThermalModel
+
+
+class ThermalTrace:
+    """
+    Recorded CPU temperature and fan percent per poll.
+    """
+    time: np.ndarray
+
+    temp: np.ndarray
+
+    fan: np.ndarray
+
+    def __init__(self, records: Iterable[HistoryRecord]) -> None:
+        times: List[float] = []
+        temps: List[float] = []
+        fans: List[float] = []
+        for record in records:
+            if np.isnan(record.cpu_temp) or np.isnan(record.fan_percent):
+                continue
+            times.append(record.time)
+            temps.append(record.cpu_temp)
+            fans.append(record.fan_percent)
+
+        self.time = np.array(times, dtype=float)
+        self.temp = np.array(temps, dtype=float)
+        self.fan = np.array(fans, dtype=float)
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def recorded(self, max_gap: float = 120.0) -> Tuple[float, float]:
+        """
+        Peak temperature and fan percent-hours of the recording itself.
+        """
+        if len(self) == 0:
+            return float('nan'), 0.0
+        elapsed = np.diff(self.time)
+        elapsed[(elapsed <= 0) | (elapsed > max_gap)] = 0.0
+        return float(self.temp.max()), \
+            float((self.fan[:-1] * elapsed).sum() / 3600.0)
+
+
+class TuneCandidates:
+    """
+    Grid of candidate settings, one array element per candidate.
+    """
+    easing: np.ndarray
+
+    ideal_temp: np.ndarray
+
+    max_temp: np.ndarray
+
+    sample_size: np.ndarray
+
+    def __init__(self, easings: Sequence[str], ideal_temps: Sequence[float],
+                 max_temps: Sequence[float], sample_sizes: Sequence[int],
+                 min_range: float = 5.0) -> None:
+        for easing in easings:
+            if easing not in EASING_CURVES:
+                raise Exception(f'Easing "{easing}" can\'t be tuned')
+
+        grid = np.meshgrid(np.arange(len(easings)), ideal_temps, max_temps,
+                           sample_sizes, indexing='ij')
+        easing_index, ideal, maximum, size = \
+            (axis.ravel() for axis in grid)
+
+        # Drop curves too steep to be useful.
+        keep = maximum - ideal >= min_range
+        self.easings = list(easings)
+        self.easing = easing_index[keep]
+        self.ideal_temp = ideal[keep].astype(float)
+        self.max_temp = maximum[keep].astype(float)
+        self.sample_size = size[keep].astype(int)
+
+    def __len__(self) -> int:
+        return len(self.easing)
+
+    def describe(self, index: int) -> str:
+        """
+        Command line options of a candidate.
+        """
+        return (f'--easing {self.easings[self.easing[index]]} '
+                f'--idealtemp {self.ideal_temp[index]:g} '
+                f'--maxtemp {self.max_temp[index]:g} '
+                f'--sample-size {self.sample_size[index]}')
+
+
+class TuneResult:
+    """
+    Simulated outcome of each candidate.
+    """
+    candidates: TuneCandidates
+
+    peak_temp: np.ndarray
+
+    # Fan percent-hours.
+    fan_integral: np.ndarray
+
+    # Seconds above each candidate's ideal temperature.
+    time_above_ideal: np.ndarray
+
+    writes: np.ndarray
+
+    def __init__(self, candidates: TuneCandidates) -> None:
+        count = len(candidates)
+        self.candidates = candidates
+        self.peak_temp = np.full(count, -np.inf)
+        self.fan_integral = np.zeros(count)
+        self.time_above_ideal = np.zeros(count)
+        self.writes = np.zeros(count, dtype=int)
+
+    def pareto(self, peak_limit: float) -> np.ndarray:
+        """
+        Indexes of candidates not beaten on both peak temperature and fan
+        integral by another candidate, quietest first.  Peaks are compared
+        in steps of 0.1C.
+        Candidates peaking above peak_limit are excluded.
+        """
+        peak = np.round(self.peak_temp, 1)
+        allowed = np.nonzero(peak <= peak_limit)[0]
+        order = allowed[np.lexsort((peak[allowed],
+                                    self.fan_integral[allowed]))]
+        front = []
+        best_peak = np.inf
+        for index in order:
+            if peak[index] < best_peak:
+                front.append(index)
+                best_peak = peak[index]
+        return np.array(front, dtype=int)
+
+
+def _conductance(model: ThermalModel, fan: np.ndarray) -> np.ndarray:
+    """
+    ThermalModel.conductance() of an array of fan percents.
+    """
+    airflow = np.maximum(model.fan_floor, fan) / 100.0
+    return model.passive_conductance \
+        + model.fan_conductance * airflow ** model.fan_exponent
+
+
+def evaluate(trace: ThermalTrace, candidates: TuneCandidates,
+             model: ThermalModel, deadband: int = 2, max_step_down: int = 10,
+             max_fan: int = 100, max_gap: float = 120.0) -> TuneResult:
+    """
+    Replay trace through every candidate.
+
+    The heat input of each poll interval is inferred from the recorded
+    temperature change and fan speed using the thermal model.  Each
+    candidate then sees the same heat input, but its own fan speeds,
+    computed by the controller's easing curves, mean aggregate and fan
+    write deadband.  Gaps longer than max_gap seconds resynchronize every
+    candidate with the recorded temperature.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    result = TuneResult(candidates)
+    count = len(candidates)
+    if len(trace) < 2 or count == 0:
+        return result
+
+    elapsed = np.diff(trace.time)
+    conductance = _conductance(model, trace.fan[:-1])
+    power = model.heat_capacity * np.diff(trace.temp) \
+        / np.where(elapsed > 0, elapsed, 1.0) \
+        + conductance * (trace.temp[:-1] - model.ambient)
+
+    temp_range = candidates.max_temp - candidates.ideal_temp
+    curves = [(EASING_CURVES[easing], candidates.easing == index)
+              for index, easing in enumerate(candidates.easings)]
+
+    # Aggregate window, newest sample first, weighted per candidate.
+    max_samples = int(candidates.sample_size.max())
+    window = np.full((max_samples, count), trace.temp[0])
+    weights = (np.arange(max_samples)[:, None]
+               < candidates.sample_size[None, :]) / candidates.sample_size
+
+    temp = np.full(count, trace.temp[0])
+    applied = np.full(count, trace.fan[0])
+
+    for step, seconds in enumerate(elapsed):
+        if seconds <= 0 or seconds > max_gap:
+            temp[:] = trace.temp[step + 1]
+            window[:] = trace.temp[step + 1]
+            continue
+
+        # BMC reports whole degrees.
+        window[1:] = window[:-1]
+        window[0] = np.round(temp)
+        offset = (window * weights).sum(axis=0) - candidates.ideal_temp
+
+        speed = np.zeros(count)
+        for curve, selected in curves:
+            speed[selected] = curve(offset[selected], temp_range[selected],
+                                    max_fan)
+        speed = np.where(offset < 0, 0, np.minimum(max_fan, np.trunc(speed)))
+
+        # FanActuator step down limit and deadband.
+        if max_step_down > 0:
+            speed = np.maximum(speed, applied - max_step_down)
+        write = (np.abs(speed - applied) > deadband) \
+            | ((speed >= max_fan) & (applied < max_fan))
+        applied = np.where(write, speed, applied)
+        result.writes += write
+
+        temp += seconds / model.heat_capacity \
+            * (power[step] - _conductance(model, applied)
+               * (temp - model.ambient))
+
+        np.maximum(result.peak_temp, temp, out=result.peak_temp)
+        result.fan_integral += np.maximum(model.fan_floor, applied) \
+            * seconds / 3600.0
+        result.time_above_ideal += seconds * (temp > candidates.ideal_temp)
+
+    return result
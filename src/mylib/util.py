@@ -2,33 +2,16 @@
 General utilities.
 """
 
+import os
 import re
-from typing import List
 import unicodedata
 
 
 RE_SLUG1 = re.compile(r'[^.\w\s-]')
 RE_SLUG2 = re.compile(r'[-\s]+')
+RE_DURATION = re.compile(r'^(\d+(?:\.\d+)?)(s|m|h|d)$')
 
-
-def parse_pdv(text: str) -> List[List[str]]:
-    """
-    Parse pipe delimited values.
-    """
-    rows = []
-    lines = text.split('\n')
-
-    for line in lines:
-        row = []
-        cols = line.split('|')
-
-        for col in cols:
-            col2 = col.strip()
-            row.append(col2)
-
-        rows.append(row)
-
-    return rows
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
 
 
 def parse_hex(text: str) -> int:
@@ -52,3 +35,22 @@ def make_slug(value: str) -> str:
         .lower()
     value = RE_SLUG1.sub('', value)
     return RE_SLUG2.sub('-', value).strip('-_')
+
+
+def parse_duration(text: str) -> float:
+    """
+    Parse duration with unit suffix s, m, h or d, such as 30s or 1.5h.
+    Return seconds.
+    """
+    match_duration = RE_DURATION.match(text.strip())
+    if match_duration is None:
+        raise ValueError(f'Invalid duration "{text}"')
+    value, unit = match_duration.groups()
+    return float(value) * DURATION_UNITS[unit]
+
+
+def default_state_path() -> str:
+    """
+    Directory of state files: $TMP, or /tmp if not set.
+    """
+    return os.environ.get('TMP', '/tmp')
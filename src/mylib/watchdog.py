@@ -0,0 +1,231 @@
+"""
+Watchdog process restoring dynamic fan mode when the controller goes
+silent.
+
+The BMC's own IPMI watchdog timer can only reset or power cycle the
+server, so fans are guarded by a child process instead.  The controller
+sends a heartbeat line after every poll on the child's stdin.  If a host
+misses heartbeats for its timeout, or the controller exits without
+stopping the watchdog, e.g. when killed, the child gives fan control back
+to the BMC.
+"""
+
+from dataclasses import dataclass
+import json
+import logging
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+from .bmc_host import BmcHost
+from .ipmi_fan import IpmiFan
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a heartbeat before dynamic fan mode is restored.
+DEFAULT_WATCHDOG_TIMEOUT = 120.0
+
+
+def watchdog_timeout(setting: Optional[float], max_interval: float) -> float:
+    """
+    Watchdog timeout for a setting, 0=disabled or None for the default of
+    DEFAULT_WATCHDOG_TIMEOUT or 3 poll intervals, whichever is longer.
+    """
+    if setting is None:
+        return max(DEFAULT_WATCHDOG_TIMEOUT, 3 * max_interval)
+    if 0 < setting <= max_interval:
+        raise ValueError(f'Watchdog timeout {setting:g}s must be longer '
+                         f'than the poll interval {max_interval:g}s')
+    return setting
+
+
+@dataclass
+class WatchdogHost(BmcHost):
+    """
+    Host guarded by the watchdog.
+    """
+    timeout: float = DEFAULT_WATCHDOG_TIMEOUT
+
+
+class Watchdog:
+    """
+    Controller side of the watchdog: start the child and send heartbeats.
+    """
+    hosts: List[WatchdogHost]
+
+    process: Optional[subprocess.Popen]
+
+    # monotonic() time of the last heartbeat or overdue check of each host.
+    last_beat: Dict[str, float]
+
+    def __init__(self, hosts: List[WatchdogHost]) -> None:
+        self.hosts = hosts
+        self.process = None
+        self.last_beat = {}
+
+    def start(self) -> None:
+        """
+        Start the watchdog process.  Credentials are passed on its stdin,
+        not its command line.
+        """
+        package_path = os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [package_path] + ([env['PYTHONPATH']]
+                              if env.get('PYTHONPATH') else []))
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'mylib.watchdog'], stdin=subprocess.PIPE,
+            env=env, encoding='utf-8')
+        self.last_beat = {host.name: time.monotonic() for host in self.hosts}
+        self._send(json.dumps({'hosts': [vars(host) for host in self.hosts]}))
+        logger.info('Started fan watchdog, pid %d', self.process.pid)
+
+    def _send(self, line: str) -> None:
+        if self.process is None or self.process.stdin is None:
+            return
+        try:
+            self.process.stdin.write(line + '\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            logger.error('Fan watchdog exited')
+            self.process = None
+
+    def beat(self, name: str) -> None:
+        """
+        Report a completed poll of a host.
+        """
+        self._send(f'beat {name}')
+        if name in self.last_beat:
+            self.last_beat[name] = time.monotonic()
+
+    def overdue(self, name: str) -> bool:
+        """
+        Check if a host went without a heartbeat for its timeout since the
+        last heartbeat or overdue check, so the watchdog may have restored
+        dynamic fan mode behind its controller.
+        """
+        if self.process is None or name not in self.last_beat:
+            return False
+        timeout = next(host.timeout for host in self.hosts
+                       if host.name == name)
+        now = time.monotonic()
+        if now - self.last_beat[name] < timeout:
+            return False
+        self.last_beat[name] = now
+        return True
+
+    def stop(self, clean: bool = True) -> None:
+        """
+        Stop the watchdog.  Unless clean, e.g. because dynamic fan mode
+        could not be restored on exit, it restores dynamic mode of every
+        host first.
+        """
+        if self.process is None:
+            return
+        if clean:
+            self._send('stop')
+        process = self.process
+        self.process = None
+        assert process.stdin is not None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+
+
+def _restore(host: WatchdogHost) -> bool:
+    """
+    Restore dynamic fan mode of a host.
+    Return True on success.
+    """
+    try:
+        IpmiFan(host.host, host.username, host.password, host.ipmi,
+                host.port).set_dynamic_fans()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('%s: failed to restore dynamic fan mode', host.name)
+        return False
+    logger.warning('%s: restored dynamic fan mode', host.name)
+    return True
+
+
+def run(fd: int, hosts: List[WatchdogHost], buf: bytes = b'') -> None:
+    """
+    Watch heartbeat lines read from fd, after those already in buf, until
+    stopped or end of file.
+    """
+    last_beat: Dict[str, float] = {host.name: time.monotonic()
+                                   for host in hosts}
+    tripped: Dict[str, bool] = {host.name: False for host in hosts}
+
+    while True:
+        while b'\n' in buf:
+            line, buf = buf.split(b'\n', 1)
+            command, _, name = line.decode('utf-8').strip().partition(' ')
+            if command == 'stop':
+                return
+            if command == 'beat' and name in last_beat:
+                last_beat[name] = time.monotonic()
+                if tripped[name]:
+                    logger.info('%s: polling resumed', name)
+                    tripped[name] = False
+
+        now = time.monotonic()
+        for host in hosts:
+            if tripped[host.name] \
+                    or now - last_beat[host.name] < host.timeout:
+                continue
+            logger.error('%s: no poll for %gs', host.name, host.timeout)
+            if _restore(host):
+                tripped[host.name] = True
+            else:
+                # Retry after another timeout.
+                last_beat[host.name] = now
+
+        wait = min(max(0.0, host.timeout - (now - last_beat[host.name]))
+                   for host in hosts if not tripped[host.name]) \
+            if not all(tripped.values()) else None
+        readable, _, _ = select.select([fd], [], [], wait)
+        if not readable:
+            continue
+
+        data = os.read(fd, 4096)
+        if not data:
+            logger.error('Controller exited without stopping the watchdog')
+            for host in hosts:
+                _restore(host)
+            return
+
+        buf += data
+
+
+def main() -> None:
+    """
+    Watchdog process entrypoint.
+    """
+    # Interrupts and termination of the process group are meant for the
+    # controller; the watchdog exits when the controller does.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s watchdog: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S', level=logging.INFO, stream=sys.stderr)
+
+    fd = sys.stdin.fileno()
+    line = b''
+    while b'\n' not in line:
+        data = os.read(fd, 4096)
+        if not data:
+            return
+        line += data
+    config, _, rest = line.partition(b'\n')
+    hosts = [WatchdogHost(**host) for host in json.loads(config)['hosts']]
+    run(fd, hosts, rest)
+
+
+if __name__ == '__main__':
+    main()
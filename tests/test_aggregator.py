@@ -0,0 +1,119 @@
+"""
+Tests of TempAggregator's running aggregates against naive recomputation.
+"""
+
+import random
+import statistics
+from typing import List, Tuple
+import pytest
+from mylib.aggregator import AggregateSpec, TempAggregator, \
+    parse_aggregate_spec
+
+
+def naive(kind: str, values: List[float]) -> float:
+    if kind == 'mean':
+        return statistics.mean(values)
+    if kind == 'median':
+        return statistics.median(values)
+    return max(values)
+
+
+def window(spec: AggregateSpec,
+           samples: List[Tuple[float, float]]) -> List[float]:
+    """
+    Values a window of spec holds after samples, recomputed from scratch.
+    """
+    if not spec.is_time_based():
+        return [value for _, value in samples[-spec.samples:]]
+    now = samples[-1][0]
+    kept = [value for sample_time, value in samples
+            if sample_time >= now - spec.seconds]
+    return kept or [samples[-1][1]]
+
+
+@pytest.mark.parametrize('kind', ['mean', 'median', 'max'])
+@pytest.mark.parametrize('text', ['3', '10', '60s', '5m'])
+def test_matches_naive_recomputation(kind, text):
+    spec = parse_aggregate_spec(f'{kind}:{text}')
+    aggregator = TempAggregator(spec)
+    rand = random.Random(1)
+    samples: List[Tuple[float, float]] = []
+    now = 1000.0
+    for _ in range(2000):
+        # Irregular intervals, with runs of equal values for the max queue.
+        now += rand.choice([1.0, 5.0, 10.0, 30.0])
+        value = float(rand.choice([40, 45, 50, 55, 60, 70]))
+        samples.append((now, value))
+        result = aggregator.add(value, now)
+        expected = window(spec, samples)
+        assert aggregator.values() == expected
+        assert result == pytest.approx(naive(kind, expected))
+
+
+def test_count_window_expiry():
+    aggregator = TempAggregator(parse_aggregate_spec('max:3'))
+    for now, value in enumerate([70.0, 40.0, 41.0, 42.0]):
+        aggregator.add(value, float(now))
+    # 70 fell out of the window.
+    assert aggregator.value() == 42.0
+    assert aggregator.count == 3
+
+
+def test_time_window_expiry():
+    aggregator = TempAggregator(parse_aggregate_spec('mean:60s'))
+    aggregator.add(80.0, 0.0)
+    aggregator.add(40.0, 30.0)
+    assert aggregator.value() == 60.0
+    aggregator.add(40.0, 61.0)
+    assert aggregator.values() == [40.0, 40.0]
+    # A gap longer than the window keeps only the newest sample.
+    aggregator.add(50.0, 200.0)
+    assert aggregator.values() == [50.0]
+
+
+def test_stale_samples_discarded():
+    aggregator = TempAggregator(parse_aggregate_spec('mean:3:stale=10m'))
+    aggregator.add(70.0, 0.0)
+    aggregator.add(70.0, 10.0)
+    aggregator.add(40.0, 10.0 + 601.0)
+    assert aggregator.values() == [40.0]
+    assert aggregator.start_time == 611.0
+    assert not aggregator.ready()
+
+
+def test_ready_and_progress():
+    aggregator = TempAggregator(parse_aggregate_spec('mean:60s'))
+    aggregator.add(40.0, 0.0)
+    aggregator.add(40.0, 30.0)
+    assert not aggregator.ready()
+    assert aggregator.progress() == '30/60s'
+    aggregator.add(40.0, 60.0)
+    assert aggregator.ready()
+
+
+def test_ewma_by_samples():
+    aggregator = TempAggregator(parse_aggregate_spec('ewma:3'))
+    assert aggregator.add(40.0, 0.0) == 40.0
+    # alpha = 2 / (3 + 1)
+    assert aggregator.add(60.0, 10.0) == pytest.approx(50.0)
+    assert aggregator.add(60.0, 20.0) == pytest.approx(55.0)
+
+
+def test_restore_round_trip():
+    spec = parse_aggregate_spec('median:5')
+    aggregator = TempAggregator(spec)
+    for now in range(8):
+        aggregator.add(40.0 + now, float(now))
+    restored = TempAggregator(spec)
+    restored.restore(aggregator.samples(), aggregator.ewma,
+                     aggregator.start_time)
+    assert restored.samples() == aggregator.samples()
+    assert restored.value() == aggregator.value()
+    assert restored.start_time == 0.0
+
+
+def test_parse_aggregate_spec_rejects_bad_input():
+    with pytest.raises(ValueError):
+        parse_aggregate_spec('mode:3')
+    with pytest.raises(ValueError):
+        parse_aggregate_spec('mean:0')
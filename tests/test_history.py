@@ -0,0 +1,140 @@
+"""
+Tests of the poll history ring file.
+"""
+
+import math
+import pytest
+from mylib.history import FLAG_READY, HEADER_SIZE, RECORD, HistoryFile, \
+    HistoryRecord, downsample, history_filename, summarize
+
+
+def make_record(time: float, cpu_temp: float = 50.0,
+                speed: int = 20) -> HistoryRecord:
+    record = HistoryRecord()
+    record.time = time
+    record.cpu_temp = cpu_temp
+    record.agg_temp = cpu_temp
+    record.suggested_speed = speed
+    record.applied_speed = speed
+    record.flags = FLAG_READY
+    record.cpu_temps = [cpu_temp, cpu_temp - 1]
+    record.fan_rpms = [3000, 3100, 70000]
+    record.fan_percent = speed
+    return record
+
+
+def fill(filename: str, capacity: int, count: int) -> None:
+    with HistoryFile(filename, capacity) as history:
+        history.open()
+        for index in range(count):
+            history.append(make_record(float(index * 10), 40.0 + index))
+
+
+def test_record_round_trip():
+    record = make_record(12.5)
+    decoded = HistoryRecord.unpack(record.pack())
+    assert decoded.time == 12.5
+    assert decoded.cpu_temps == [50.0, 49.0]
+    # RPMs are clamped to the 16-bit field.
+    assert decoded.fan_rpms == [3000, 3100, 0xffff]
+    assert decoded.suggested_speed == decoded.applied_speed == 20
+    assert decoded.flags == FLAG_READY
+
+
+def test_file_size_is_fixed(tmp_path):
+    filename = str(tmp_path / 'ring.hist')
+    fill(filename, 8, 20)
+    assert (tmp_path / 'ring.hist').stat().st_size \
+        == HEADER_SIZE + 8 * RECORD.size
+
+
+def test_wraparound_keeps_newest(tmp_path):
+    filename = str(tmp_path / 'ring.hist')
+    fill(filename, 8, 21)
+    with HistoryFile(filename) as history:
+        times = [record.time for record in history.records()]
+        assert history.capacity == 8
+        assert history.count == 8
+        assert history.head == 21 % 8
+    assert times == [float(index * 10) for index in range(13, 21)]
+
+
+@pytest.mark.parametrize('count', [0, 1, 5, 8, 13, 21])
+def test_find_after_wraparound(tmp_path, count):
+    filename = str(tmp_path / 'ring.hist')
+    fill(filename, 8, count)
+    with HistoryFile(filename) as history:
+        history.open(create=False)
+        times = [history.read(index).time for index in range(history.count)]
+        for start_time in range(-5, count * 10 + 5, 5):
+            expected = sum(1 for time in times if time < start_time)
+            assert history.find(start_time) == expected
+
+
+def test_records_time_range_after_wraparound(tmp_path):
+    filename = str(tmp_path / 'ring.hist')
+    fill(filename, 8, 21)
+    with HistoryFile(filename) as history:
+        times = [record.time
+                 for record in history.records(145.0, 185.0)]
+    assert times == [150.0, 160.0, 170.0, 180.0]
+
+
+def test_reopen_keeps_capacity_and_appends(tmp_path):
+    filename = str(tmp_path / 'ring.hist')
+    fill(filename, 8, 10)
+    with HistoryFile(filename, capacity=1000) as history:
+        history.append(make_record(100.0))
+        times = [record.time for record in history.records()]
+        assert history.capacity == 8
+    assert times == [30.0, 40.0, 50.0, 60.0, 70.0, 80.0, 90.0, 100.0]
+
+
+def test_missing_file(tmp_path):
+    history = HistoryFile(str(tmp_path / 'missing.hist'))
+    with pytest.raises(FileNotFoundError):
+        list(history.records())
+
+
+def test_unrecognized_file(tmp_path):
+    path = tmp_path / 'bad.hist'
+    path.write_bytes(b'\x00' * 64)
+    with pytest.raises(Exception, match='Unrecognized'):
+        HistoryFile(str(path)).open(create=False)
+
+
+def test_downsample_after_wraparound(tmp_path):
+    filename = str(tmp_path / 'ring.hist')
+    fill(filename, 8, 21)
+    with HistoryFile(filename) as history:
+        rows = list(downsample(history.records(), 30.0))
+    # Records at 130..200s fall in buckets 120, 150, 180.
+    assert [row[:2] for row in rows] == [[120.0, 2], [150.0, 3],
+                                         [180.0, 3]]
+    # Mean CPU temp of records 13, 14 then 15..17 then 18..20.
+    assert [row[2] for row in rows] == [53.5, 56.0, 59.0]
+
+
+def test_downsample_ignores_missing_speed():
+    records = [make_record(0.0, speed=-1), make_record(1.0, speed=40)]
+    rows = list(downsample(iter(records), 60.0))
+    assert len(rows) == 1
+    assert rows[0][1] == 2
+    assert rows[0][4] == 40.0
+    assert not list(downsample(iter([]), 60.0))
+
+
+def test_summarize():
+    records = [make_record(float(time), 40.0 + time) for time in range(5)]
+    cpu_stats = summarize(iter(records))[0]
+    assert cpu_stats.count == 5
+    assert cpu_stats.min == 40.0
+    assert cpu_stats.max == 44.0
+    assert cpu_stats.mean == pytest.approx(42.0)
+    assert cpu_stats.stddev() == pytest.approx(math.sqrt(2.0))
+
+
+def test_history_filename():
+    assert history_filename('/var/lib/pifan', 'idrac.example').startswith(
+        '/var/lib/pifan/pifan_')
+    assert history_filename('/tmp', 'a').endswith('.hist')
@@ -0,0 +1,203 @@
+"""
+Tests of the versioned binary state file format.
+"""
+
+import os
+import pickle
+import struct
+import zlib
+import pytest
+from mylib.aggregator import AggregateSpec
+from mylib.controller_state import ControllerState
+from mylib.cpu_sensor import CpuSensor
+from mylib.fan_sensor import FanSensor
+from mylib.state_format import HEADER, MAGIC, SECTION, VERSION, \
+    StateFormatError, decode_state, encode_state, is_legacy_pickle
+
+
+def make_state() -> ControllerState:
+    state = ControllerState()
+    state.set_aggregate_spec(AggregateSpec('max', 0, 60.0))
+    for offset, temp in enumerate([48.0, 52.0, 50.0]):
+        state.add_aggregate_temp(temp, 1000.0 + offset * 10)
+
+    cpu = CpuSensor()
+    cpu.name = 'CPU1 Temp'
+    cpu.id = 0x0e
+    cpu.temp = 52.0
+    state.cpu_map = {'CPU1 Temp (0xe)': cpu}
+    fan = FanSensor()
+    fan.name = 'Fan1'
+    fan.id = 0x30
+    fan.rpm = 4200
+    fan.max = 15000
+    state.fan_map = {'Fan1': fan}
+    inlet = CpuSensor()
+    inlet.name = 'Inlet Temp'
+    inlet.id = 0x04
+    inlet.temp = 24.0
+    state.air_map = {'Inlet Temp': inlet}
+
+    state.static_fans = True
+    state.applied_speed = 25
+    state.applied_time = 1010.0
+    state.suppressed_writes = 7
+    state.pid.integral = 3.5
+    state.pid.last_temp = 52.0
+    state.pid.last_time = 1020.0
+    state.pid.output = 26.5
+    state.poll_interval = 15.0
+    state.last_poll_temp = 52.0
+    state.last_poll_time = 1020.0
+    state.failed_polls = 2
+    state.sdr_check_time = 900.0
+    state.inputs.power = 310.0
+    state.inputs.power_avg = 300.0
+    state.inputs.power_time = 1020.0
+
+    zone = state.zone_state('pcie')
+    zone.applied_speed = 40
+    zone.applied_time = 1015.0
+    zone.pid.integral = 1.25
+    zone.aggregator.add(61.0, 1020.0)
+    return state
+
+
+def restored(data: bytes) -> ControllerState:
+    state = ControllerState()
+    state.set_aggregate_spec(AggregateSpec('max', 0, 60.0))
+    state.restore(data)
+    return state
+
+
+def with_body(body: bytes, version: int = VERSION) -> bytes:
+    return HEADER.pack(MAGIC, version, 0, len(body), zlib.crc32(body)) \
+        + body
+
+
+def test_round_trip():
+    original = make_state()
+    state = restored(original.dump())
+
+    assert state.aggregator.samples() == original.aggregator.samples()
+    assert state.aggregator.value() == 52.0
+    cpu = state.cpu_map['CPU1 Temp (0xe)']
+    assert (cpu.name, cpu.id, cpu.temp) == ('CPU1 Temp', 0x0e, 52.0)
+    fan = state.fan_map['Fan1']
+    assert (fan.id, fan.rpm, fan.max) == (0x30, 4200, 15000)
+    assert state.air_map['Inlet Temp'].temp == 24.0
+
+    assert state.static_fans
+    assert state.applied_speed == 25
+    assert state.applied_time == 1010.0
+    assert state.suppressed_writes == 7
+    assert vars(state.pid) == vars(original.pid)
+    assert state.poll_interval == 15.0
+    assert state.last_poll_temp == 52.0
+    assert state.last_poll_time == 1020.0
+    assert state.failed_polls == 2
+    assert state.sdr_check_time == 900.0
+    assert vars(state.inputs) == vars(original.inputs)
+
+    zone = state.zones['pcie']
+    assert zone.applied_speed == 40
+    assert zone.applied_time == 1015.0
+    assert zone.pid.integral == 1.25
+    assert zone.aggregator.samples() == [(1020.0, 61.0)]
+
+
+def test_round_trip_of_empty_state():
+    state = restored(ControllerState().dump())
+    assert state.cpu_map is None
+    assert state.fan_map is None
+    assert state.applied_speed is None
+    assert state.pid.last_temp is None
+    assert state.poll_interval is None
+    assert not state.zones
+    assert state.aggregator.samples() == []
+
+
+def test_unknown_section_skipped():
+    data = make_state().dump()
+    body = data[HEADER.size:] + SECTION.pack(b'NEW!', 3) + b'xyz'
+    state = restored(with_body(body))
+    assert state.applied_speed == 25
+
+
+@pytest.mark.parametrize('length', [0, 1, HEADER.size - 1, HEADER.size,
+                                    HEADER.size + 5, -1])
+def test_truncated(length):
+    data = make_state().dump()
+    with pytest.raises(StateFormatError):
+        decode_state(data[:length], ControllerState())
+
+
+def test_bad_magic():
+    data = make_state().dump()
+    with pytest.raises(StateFormatError, match='Not a PiFan'):
+        decode_state(b'XXXX' + data[4:], ControllerState())
+
+
+def test_newer_version():
+    body = make_state().dump()[HEADER.size:]
+    with pytest.raises(StateFormatError, match='Unsupported'):
+        decode_state(with_body(body, VERSION + 1), ControllerState())
+
+
+def test_checksum_mismatch():
+    data = bytearray(make_state().dump())
+    data[-1] ^= 0xff
+    with pytest.raises(StateFormatError, match='checksum'):
+        decode_state(bytes(data), ControllerState())
+
+
+def test_truncated_section():
+    body = SECTION.pack(b'ACT ', 100) + b'\x00' * 10
+    with pytest.raises(StateFormatError, match='Truncated section'):
+        decode_state(with_body(body), ControllerState())
+
+
+def test_short_section():
+    # Valid checksum, but too short for the section's layout.
+    body = SECTION.pack(b'PID ', 4) + struct.pack('<f', 1.0)
+    with pytest.raises(StateFormatError, match='Corrupt section'):
+        decode_state(with_body(body), ControllerState())
+
+
+def legacy_state(**fields) -> ControllerState:
+    state = ControllerState.__new__(ControllerState)
+    state.__dict__.update(fields)
+    return state
+
+
+def test_legacy_pickle_migrated():
+    data = pickle.dumps(legacy_state(
+        samples=[50.0, 54.0], sample_size=2, last_sample_time=1000.0,
+        static_fans=True, applied_speed=30))
+    assert is_legacy_pickle(data)
+    state = ControllerState()
+    state.restore(data)
+    assert state.static_fans
+    assert state.applied_speed == 30
+    assert state.aggregator.values() == [50.0, 54.0]
+    assert not hasattr(state, 'samples')
+
+
+def test_legacy_pickle_of_other_type():
+    with pytest.raises(StateFormatError, match='dict'):
+        ControllerState().restore(pickle.dumps({'applied_speed': 30}))
+
+
+def test_legacy_pickle_refuses_other_classes():
+    with pytest.raises(StateFormatError, match='Refusing'):
+        ControllerState().restore(pickle.dumps(os.getcwd))
+
+
+def test_corrupt_legacy_pickle():
+    data = pickle.dumps(legacy_state(applied_speed=30))
+    with pytest.raises(StateFormatError, match='Corrupt legacy'):
+        ControllerState().restore(data[:len(data) // 2])
+
+
+def test_encode_is_deterministic():
+    assert encode_state(make_state()) == encode_state(make_state())